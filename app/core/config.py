@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -21,16 +22,109 @@ class Settings(BaseSettings):
 
     # Google Cloud Storage Configuration
     GOOGLE_CLOUD_PROJECT: str
+    SIGNED_URL_WINDOW: int = 600  #   Signed GET urls are shared within a time window
+    SIGNED_URL_CACHE_SIZE: int = 10000  #   Max signed urls kept in process memory
+    MAX_BATCH_IMAGES: int = 50  #   Max images per bulk signed url request
+
+    # Storage Configuration
+    STORAGE_BACKEND: Literal["gcs", "local"] = "gcs"  #   "local" to run offline
+    LOCAL_STORAGE_ROOT: str = "storage"  #   Directory of the files, when local
+    LOCAL_STORAGE_URL: str = "http://localhost:8000/api/v1/storage"
+    LOCAL_STORAGE_MAX_SIZE: int = 20 * 1024 * 1024  #   Max bytes of an upload
 
     JWT_ACCESS_TOKEN_EXPIRES: str
     JWT_REFRESH_TOKEN_EXPIRES: str
 
     RATELIMIT_STORAGE_URL: str
 
+    # Pagination Configuration
+    MAX_PER_PAGE: int = 50
+    COMMENT_TREE_MAX_DEPTH: int = 5  #   Max reply levels returned by a comment tree
+    COMMENT_TREE_MAX_BREADTH: int = 20  #   Max replies returned per comment of a tree
+
     # Redis Configuration
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
+    REDIS_MAX_CONNECTIONS: int = 50  #   Per process
+    REDIS_POOL_TIMEOUT: float = 0.2  #   Max wait for a free connection
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_SOCKET_TIMEOUT: float = 0.5  #   Max wait for a reply
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  #   Ping idle connections before reuse
+    REDIS_BREAKER_FAILURES: int = 5  #   Consecutive failures which open the circuit
+    REDIS_BREAKER_RESET: float = 10  #   Seconds before a trial call is let through
+
+    # Password hashing Configuration
+    PASSWORD_HASH_METHOD: str = "scrypt:32768:8:1"  #   Werkzeug method string
+    PASSWORD_HASH_WORKERS: int = 2  #   Hashing processes per gunicorn worker
+    PASSWORD_HASH_QUEUE_SIZE: int = 8  #   Waiting calls before 503 responses
+    PASSWORD_HASH_TIMEOUT: float = 5
+
+    # Token revocation cache Configuration
+    REVOCATION_CACHE_SIZE: int = 100000  #   Max tokens (and users) kept in process
+    REVOCATION_CACHE_TTL: int = 60  #   Checked tokens are trusted for this long
+
+    # Principal cache Configuration
+    PRINCIPAL_CACHE_SIZE: int = 10000  #   Max principals kept in process memory
+    PRINCIPAL_CACHE_TTL: int = 30  #   Staleness bound of the in-process copy
+    PRINCIPAL_REDIS_TTL: int = 3600
+
+    # Home timeline Configuration
+    TIMELINE_MAX_LENGTH: int = 800  #   Max post ids kept per user timeline
+    TIMELINE_TTL: int = 7 * 24 * 3600  #   Timelines of inactive users expire
+    TIMELINE_FANOUT_LIMIT: int = 10000  #   Above this, followers pull on read
+
+    # Tag Configuration
+    TAG_ID_CACHE_SIZE: int = 10000  #   Max tag name -> id entries kept in process
+    TAG_ID_CACHE_TTL: int = 3600
+
+    # Tag search Configuration
+    TAG_SEARCH_MAX_TAGS: int = 5  #   Max tags combined in one search
+    TAG_SEARCH_TTL: int = 60  #   Multi-tag results are kept to page through them
+    TAG_POSTS_MAX_LENGTH: int = 10000  #   Max (newest) post ids kept per tag
+    TAG_POSTS_TTL: int = 24 * 3600  #   Posting lists are rebuilt from the database
+
+    # Trending tags Configuration
+    TRENDING_TOP_SIZE: int = 100  #   Max tags returned per window
+    TRENDING_BUCKET_SIZE: int = 1000  #   Max tags kept per closed time bucket
+    TRENDING_CACHE_TTL: int = 60  #   Top lists are recomputed at most once per TTL
+
+    # User search Configuration
+    USER_SEARCH_MAX_RESULTS: int = 500  #   Max ranked users per search
+
+    # Image processing Configuration
+    #   Max width and height of each variant, in pixels
+    IMAGE_VARIANT_SIZES: dict[str, int] = {"thumbnail": 320, "feed": 640, "full": 1080}
+    IMAGE_VARIANT_FORMATS: list[str] = ["webp", "jpeg"]  #   Preferred format first
+    IMAGE_VARIANT_QUALITY: int = 80
+    IMAGE_PROCESS_WORKERS: int = 2  #   Processing threads per gunicorn worker
+    IMAGE_PROCESS_QUEUE_SIZE: int = 100  #   Above this, left to `flask process-images`
+
+    # Image garbage collector Configuration
+    IMAGE_GC_MIN_AGE: int = 24 * 3600  #   Younger unused uploads may still be posted
+    IMAGE_GC_BATCH_SIZE: int = 500  #   Images read and deleted per batch
+    IMAGE_GC_WORKERS: int = 8  #   Concurrent delete requests to the bucket
+    IMAGE_GC_LOCK_TTL: int = 600  #   Also the time budget of one run
+
+    # Like buffer Configuration
+    LIKE_FLUSH_INTERVAL: int = 5  #   Seconds between two flushes to the database
+    LIKE_FLUSH_BATCH_SIZE: int = 500  #   Max posts flushed per run
+
+    # Query budget Configuration
+    QUERY_BUDGET_MODE: Literal["raise", "log"] = "log"  #   "raise" in dev and tests
+    QUERY_SAMPLE_RATE: float = 0.01  #   Share of requests logged in "log" mode
+    QUERY_REPEAT_THRESHOLD: int = 3  #   Times a statement shape repeats in an N+1
+
+    # Admin Configuration
+    ADMIN_USER_IDS: list[int] = []  #   Users allowed to call the admin endpoints
+
+    # Profiler Configuration
+    PROFILER_INTERVAL: float = 0.005  #   Seconds between two samples of a thread
+    PROFILER_MAX_DEPTH: int = 128  #   Innermost frames kept per stack
+    PROFILER_MAX_WINDOW: int = 3600  #   Max lifetime of a profile token or window
+    PROFILER_REFRESH_INTERVAL: int = 5  #   Profiled endpoints are re-read from Redis
+    PROFILER_RETENTION: int = 24 * 3600  #   Profiles expire after their last sample
+    PROFILER_MAX_STACKS: int = 5000  #   Distinct stacks kept per endpoint
 
     @property
     def db_url(self) -> str:
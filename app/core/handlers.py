@@ -8,6 +8,7 @@ from werkzeug.exceptions import (
     NotFound,
     BadRequest,
     InternalServerError,
+    ServiceUnavailable,
 )
 
 # from flask_limiter.errors import RateLimitExceeded
@@ -47,6 +48,14 @@ def register_error_handlers(app: Flask):
         current_app.logger.error(str(error), exc_info=True)
         return api_response(message=str(error), status=500)
 
+    @app.errorhandler(ServiceUnavailable)
+    def handle_service_unavailable_error(error):
+        current_app.logger.warning(str(error))
+        response, status = api_response(message=str(error), status=503)
+        if error.retry_after is not None:
+            response.headers["Retry-After"] = str(error.retry_after)
+        return response, status
+
     # @app.errorhandler(429)
     # def handle_rate_limit_error(error):
     #     # Try to extract headers from the error if available
@@ -0,0 +1,125 @@
+#   References: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    generate_password_hash,
+    check_password_hash,
+)
+
+from app.core.config import settings
+from app.logs.config import PASSWORD_HASH_IN_FLIGHT, PASSWORD_HASH_REJECTED
+
+
+def _normalize_method(method: str) -> str:
+    """
+    Method as werkzeug writes it in the hashes it makes, with the default
+    parameters of the omitted ones (e.g. `pbkdf2:sha256` -> `pbkdf2:sha256:1000000`)
+    """
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        return "scrypt:32768:8:1"
+    if name == "pbkdf2" and len(args) < 2:
+        hash_name = args[0] if args else "sha256"
+        return f"pbkdf2:{hash_name}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords in a small process pool, off the request threads.
+
+    Scrypt/pbkdf2 are CPU bound and hold the GIL, so running them in the request
+    thread stalls every other request of the worker. At most `workers + queue_size`
+    calls are in flight per process, further calls are rejected right away with a
+    503 instead of piling up behind a login storm.
+    """
+
+    def __init__(self, method: str, workers: int, queue_size: int, timeout: float):
+        self.method = _normalize_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self.max_in_flight = workers + queue_size
+        self._in_flight = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        PASSWORD_HASH_IN_FLIGHT.set_function(lambda: self._in_flight)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        #   Created on first use, so that each gunicorn worker owns its pool. Workers
+        #   are spawned, not forked from a process running scheduler threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        #   A pool process died (e.g. OOM killed), start a new pool on next call
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _release(self, *_) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _run(self, function, *args):
+        with self._lock:
+            saturated = self._in_flight >= self.max_in_flight
+            if not saturated:
+                self._in_flight += 1
+        if saturated:
+            PASSWORD_HASH_REJECTED.inc()
+            raise ServiceUnavailable(
+                "Too many login attempts in progress. Please try again later.",
+                retry_after=1,
+            )
+        executor = self._get_executor()
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._reset(executor)
+            raise ServiceUnavailable("Password hashing is unavailable, try again.")
+        except Exception:
+            self._release()
+            raise
+        #   The slot is freed when the call really ends, even after a timeout
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise ServiceUnavailable(
+                "Password hashing timed out. Please try again later.", retry_after=1
+            )
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise ServiceUnavailable("Password hashing is unavailable, try again.")
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether a hash was made with another method or other parameters"""
+        return password_hash.split("$", 1)[0] != self.method
+
+
+password_hasher = PasswordHasher(
+    method=settings.PASSWORD_HASH_METHOD,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+    timeout=settings.PASSWORD_HASH_TIMEOUT,
+)
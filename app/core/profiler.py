@@ -0,0 +1,74 @@
+#   References: https://www.brendangregg.com/flamegraphs.html
+
+import sys
+import time
+import threading
+from collections import Counter
+
+from app.core.config import settings
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of request threads. A single daemon thread wakes up
+    every `interval` seconds and records the stack of each profiled thread as a
+    collapsed stack (`module:caller;module:function`), the input format of
+    flamegraph.pl and speedscope.
+
+    Unlike cProfile nothing runs on each function call, so the overhead is low
+    and does not grow with the code profiled. The sampling thread is idle while
+    no thread is profiled.
+    """
+
+    def __init__(self, interval: float, max_depth: int):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = {}
+        self._active = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start sampling the current thread"""
+        with self._lock:
+            self._stacks[threading.get_ident()] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                #   Started on first use, so that each gunicorn worker owns its thread
+                self._thread = threading.Thread(
+                    target=self._run, name="sampling-profiler", daemon=True
+                )
+                self._thread.start()
+            self._active.set()
+
+    def stop(self) -> Counter:
+        """Stop sampling the current thread, returns its collapsed stack counts"""
+        with self._lock:
+            stacks = self._stacks.pop(threading.get_ident(), Counter())
+            if not self._stacks:
+                self._active.clear()
+        return stacks
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            module = frame.f_globals.get("__name__", "?")
+            names.append(f"{module}:{frame.f_code.co_qualname}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._collapse(frame)] += 1
+            del frames
+
+
+sampling_profiler = SamplingProfiler(
+    interval=settings.PROFILER_INTERVAL, max_depth=settings.PROFILER_MAX_DEPTH
+)
@@ -1,17 +1,178 @@
+import time
+import uuid
+import logging
+import threading
 import redis
 from datetime import datetime
 
+from redis.client import Pipeline
+from redis.exceptions import (
+    ConnectionError as RedisConnectionError,
+    TimeoutError as RedisTimeoutError,
+)
+
+from app.core.cache import TTLCache
+from app.core.circuit_breaker import CircuitBreaker
 from app.core.config import settings
+from app.logs.config import (
+    REDIS_COMMAND_LATENCY,
+    REDIS_COMMAND_ERRORS,
+    REDIS_POOL_CONNECTIONS,
+    REDIS_CIRCUIT_OPEN,
+)
+from app.logs.request_cost import record_redis_call
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RedisConnectionError):
+    """Raised instead of calling Redis while the circuit breaker is open"""
+
+
+def _guarded_call(breaker: CircuitBreaker, command: str, call):
+    """
+    Run a Redis call through the circuit breaker and record its metrics, also
+    added to the cost of the current request. Only connection errors and
+    timeouts count as failures: an error reply still means that Redis is up.
+    """
+    if not breaker.allow():
+        REDIS_COMMAND_ERRORS.labels(command=command, error="CircuitOpenError").inc()
+        raise CircuitOpenError("Redis circuit breaker is open.")
+    start = time.perf_counter()
+    try:
+        result = call()
+    except (RedisConnectionError, RedisTimeoutError) as error:
+        breaker.record_failure()
+        REDIS_COMMAND_ERRORS.labels(command=command, error=type(error).__name__).inc()
+        raise
+    except Exception:
+        breaker.record_success()
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        REDIS_COMMAND_LATENCY.labels(command=command).observe(duration)
+        record_redis_call(duration)
+    breaker.record_success()
+    return result
+
+
+class ResilientPipeline(Pipeline):
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute(self, raise_on_error: bool = True):
+        return _guarded_call(
+            self.breaker,
+            "PIPELINE",
+            lambda: super(ResilientPipeline, self).execute(raise_on_error),
+        )
+
+
+class ResilientRedis(redis.Redis):
+    """Redis client whose commands and pipelines go through a circuit breaker"""
+
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        return _guarded_call(
+            self.breaker,
+            str(args[0]).upper(),
+            lambda: super(ResilientRedis, self).execute_command(*args, **options),
+        )
+
+    def pipeline(self, transaction=True, shard_hint=None) -> ResilientPipeline:
+        return ResilientPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+            breaker=self.breaker,
+        )
+
+
+def _idle_connections(pool) -> int:
+    return sum(1 for connection in list(pool.pool.queue) if connection is not None)
 
 
 class RedisClient:
+    """
+    Redis access of the app.
+
+    Connections come from a bounded pool with connect and read timeouts, so a
+    stalled Redis cannot block request threads for long. After repeated failures
+    the circuit breaker opens and calls fail fast with `CircuitOpenError` (a
+    redis `ConnectionError`): callers degrade as for any `RedisError`, i.e. the
+    token revocation check fails open, caches and indexes fall back to the
+    database and buffered writes are written directly.
+    """
+
     def __init__(self):
-        self.redis_client = redis.Redis(
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.REDIS_BREAKER_FAILURES,
+            reset_timeout=settings.REDIS_BREAKER_RESET,
+        )
+        self.connection_pool = redis.BlockingConnectionPool(
             host=settings.REDIS_HOST,
             port=settings.REDIS_PORT,
             db=settings.REDIS_DB,
             decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        self.redis_client = ResilientRedis(
+            connection_pool=self.connection_pool,
+            decode_responses=True,
+            breaker=self.breaker,
+        )
+        #   Subscriptions wait for messages, they have no read timeout
+        self.pubsub_client = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            decode_responses=True,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        REDIS_POOL_CONNECTIONS.labels(state="in_use").set_function(
+            lambda: len(self.connection_pool._connections)
+            - _idle_connections(self.connection_pool)
         )
+        REDIS_POOL_CONNECTIONS.labels(state="idle").set_function(
+            lambda: _idle_connections(self.connection_pool)
+        )
+        REDIS_POOL_CONNECTIONS.labels(state="max").set(settings.REDIS_MAX_CONNECTIONS)
+        REDIS_CIRCUIT_OPEN.set_function(
+            lambda: int(self.breaker.state != CircuitBreaker.CLOSED)
+        )
+        #   Token revocation state, see `is_revoked`
+        self._revoked_jtis = TTLCache(
+            maxsize=settings.REVOCATION_CACHE_SIZE,
+            ttl=int(settings.JWT_REFRESH_TOKEN_EXPIRES),
+        )
+        self._active_jtis = TTLCache(
+            maxsize=settings.REVOCATION_CACHE_SIZE, ttl=settings.REVOCATION_CACHE_TTL
+        )
+        self._logout_all_at = TTLCache(
+            maxsize=settings.REVOCATION_CACHE_SIZE, ttl=settings.REVOCATION_CACHE_TTL
+        )
+        self._revocation_listening = False
+
+    #   ==================================================
+    #   =============== Token revocation =================
+    #   ==================================================
+    #   Revoked token ids are kept in `blacklist:{jit}` and the time of the last
+    #   "logout all devices" of a user in `logout_all_devices:{user_id}`. Every
+    #   change is also published on `REVOCATION_CHANNEL`, so that each process can
+    #   cache the state of the tokens it has seen and skip Redis for them.
+
+    REVOCATION_CHANNEL = "revocations"
 
     def add_to_blacklist(self, jit: str, expires_in: int = None) -> bool:
         """
@@ -24,68 +185,423 @@ class RedisClient:
         Returns:
             bool: True if successfully added, False otherwise
         """
+        self._revoked_jtis.set(jit, True)
+        self._active_jtis.delete(jit)
         try:
+            pipe = self.redis_client.pipeline()
             if expires_in:
-                return self.redis_client.setex(f"blacklist:{jit}", expires_in, "1")
+                pipe.setex(f"blacklist:{jit}", expires_in, "1")
             else:
-                return self.redis_client.set(f"blacklist:{jit}", "1")
+                pipe.set(f"blacklist:{jit}", "1")
+            pipe.publish(self.REVOCATION_CHANNEL, f"jit:{jit}")
+            return pipe.execute()[0]
+        except Exception as e:
+            logger.warning(f"Error adding to blacklist: {e}")
+            return False
+
+    def logout_all_devices(self, user_id: str) -> bool:
+        """
+        Add a user ID to the logout all devices list. Mark the time of logout all devices.
+        Args:
+            user_id: User ID to add
+        Returns:
+            bool: True if successfully added, False otherwise
+        """
+        logout_at = int(datetime.now().timestamp())
+        self._logout_all_at.set(str(user_id), logout_at)
+        try:
+            expires_in = int(settings.JWT_REFRESH_TOKEN_EXPIRES)
+            pipe = self.redis_client.pipeline()
+            pipe.setex(f"logout_all_devices:{user_id}", expires_in, logout_at)
+            pipe.publish(self.REVOCATION_CHANNEL, f"logout_all:{user_id}:{logout_at}")
+            return pipe.execute()[0]
         except Exception as e:
-            print(f"Error adding to blacklist: {e}")
+            logger.warning(f"Error adding to logout all devices: {e}")
             return False
 
-    def is_blacklisted(self, jit: str) -> bool:
+    def is_revoked(self, jit: str, user_id: str, iat: int) -> bool:
         """
-        Check if a JWT token ID is blacklisted
+        Check if a token is revoked, either blacklisted or issued before the last
+        logout of all devices of its user. Known revoked tokens are answered from
+        memory; while the revocation listener runs, so are tokens (and users)
+        checked in the last `REVOCATION_CACHE_TTL` seconds. Otherwise both checks
+        are sent in a single pipelined round trip.
 
         Args:
-            jit: JWT ID to check
+            jit: JWT ID of the token
+            user_id: Identity of the token
+            iat: Time the token was issued at
 
         Returns:
-            bool: True if blacklisted, False otherwise
+            bool: True if the token must be rejected, False otherwise
         """
+        if self._revoked_jtis.get(jit):
+            return True
+        user_id = str(user_id)
+        if self._revocation_listening:
+            logout_at = self._logout_all_at.get(user_id)
+            if self._active_jtis.get(jit) and logout_at is not None:
+                return logout_at > iat
+
         try:
-            return self.redis_client.exists(f"blacklist:{jit}")
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.exists(f"blacklist:{jit}")
+            pipe.get(f"logout_all_devices:{user_id}")
+            blacklisted, logout_at = pipe.execute()
         except Exception as e:
-            print(f"Error checking blacklist: {e}")
+            logger.warning(f"Error checking token revocation: {e}")
             return False
+        logout_at = int(logout_at or 0)
+        if blacklisted:
+            self._revoked_jtis.set(jit, True)
+            return True
+        if self._revocation_listening:
+            #   A newer logout may have been received meanwhile
+            logout_at = max(logout_at, self._logout_all_at.get(user_id, 0))
+            self._active_jtis.set(jit, True)
+            self._logout_all_at.set(user_id, logout_at)
+        return logout_at > iat
 
-    def logout_all_devices(self, user_id: str) -> bool:
+    def _on_revocation(self, message: str) -> None:
+        kind, _, value = message.partition(":")
+        if kind == "jit":
+            self._revoked_jtis.set(value, True)
+            self._active_jtis.delete(value)
+        elif kind == "logout_all":
+            user_id, _, logout_at = value.partition(":")
+            self._logout_all_at.set(user_id, int(logout_at))
+
+    def _listen_revocations(self) -> None:
+        while True:
+            try:
+                pubsub = self.pubsub_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.REVOCATION_CHANNEL)
+                self._revocation_listening = True
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._on_revocation(message["data"])
+            except Exception as e:
+                logger.warning(f"Error listening to revocations: {e}")
+            #   Messages may have been missed, forget what was learned from them
+            self._revocation_listening = False
+            self._active_jtis.clear()
+            self._logout_all_at.clear()
+            time.sleep(1)
+
+    def start_revocation_listener(self) -> None:
+        """Keep the revocation caches of this process fresh, from a daemon thread"""
+        threading.Thread(
+            target=self._listen_revocations, name="revocation-listener", daemon=True
+        ).start()
+
+    #   ==================================================
+    #   ================ Like write buffer ===============
+    #   ==================================================
+    #   Likes and unlikes are written to Redis first and flushed to the `likes` table
+    #   in batches. Per post, `likes:pending:{post_id}` maps user ids to the latest
+    #   pending state ("1" liked, "0" unliked) and `likes:delta:{post_id}` holds the
+    #   pending change of the like count. While a batch is written to the database,
+    #   its entries are moved to the `likes:flushing*` keys and still read from there.
+
+    LIKES_DIRTY_KEY = "likes:dirty"
+    LIKES_FLUSHING_KEY = "likes:flushing"
+
+    _BUFFER_LIKE_SCRIPT = """
+    local state = redis.call('HGET', KEYS[1], ARGV[1])
+    if not state then state = redis.call('HGET', KEYS[3], ARGV[1]) end
+    if not state then state = ARGV[3] end
+    if state == ARGV[2] then return 0 end
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    if ARGV[2] == '1' then redis.call('INCR', KEYS[2]) else redis.call('DECR', KEYS[2]) end
+    redis.call('SADD', KEYS[5], ARGV[4])
+    return 1
+    """
+
+    _CLAIM_LIKES_SCRIPT = """
+    local ops = redis.call('HGETALL', KEYS[1])
+    for i = 1, #ops, 2 do redis.call('HSET', KEYS[3], ops[i], ops[i + 1]) end
+    redis.call('INCRBY', KEYS[4], tonumber(redis.call('GET', KEYS[2]) or '0'))
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return {redis.call('HGETALL', KEYS[3]), redis.call('GET', KEYS[4])}
+    """
+
+    @staticmethod
+    def _like_keys(post_id: int) -> list[str]:
+        return [
+            f"likes:pending:{post_id}",
+            f"likes:delta:{post_id}",
+            f"likes:flushing:{post_id}",
+            f"likes:flushing_delta:{post_id}",
+        ]
+
+    def get_like_state(self, post_id: int, user_id: int) -> bool | None:
         """
-        Add a user ID to the logout all devices list. Mark the time of logout all devices.
+        Get the buffered like state of a user on a post
+
         Args:
-            user_id: User ID to add
+            post_id: Post ID
+            user_id: User ID
+
         Returns:
-            bool: True if successfully added, False otherwise
+            bool | None: Buffered state, None if nothing is buffered (read the database)
         """
         try:
-            expires_in = int(settings.JWT_REFRESH_TOKEN_EXPIRES)
-            return self.redis_client.setex(
-                f"logout_all_devices:{user_id}",
-                expires_in,
-                int(datetime.now().timestamp()),
+            pending, _, flushing, _ = self._like_keys(post_id)
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hget(pending, user_id)
+            pipe.hget(flushing, user_id)
+            state = next((state for state in pipe.execute() if state), None)
+            return None if state is None else state == "1"
+        except Exception as e:
+            logger.warning(f"Error getting like state: {e}")
+            return None
+
+    def buffer_like(
+        self, post_id: int, user_id: int, liked: bool, known_state: bool
+    ) -> bool | None:
+        """
+        Buffer a like (or unlike) of a user on a post
+
+        Args:
+            post_id: Post ID
+            user_id: User ID
+            liked: True to like, False to unlike
+            known_state: Current state in the database, used if nothing is buffered
+
+        Returns:
+            bool | None: True if buffered, False if the post is already in that state,
+                None if Redis is unavailable (write to the database instead)
+        """
+        try:
+            pending, delta, flushing, flushing_delta = self._like_keys(post_id)
+            return bool(
+                self.redis_client.eval(
+                    self._BUFFER_LIKE_SCRIPT,
+                    5,
+                    pending,
+                    delta,
+                    flushing,
+                    flushing_delta,
+                    self.LIKES_DIRTY_KEY,
+                    user_id,
+                    int(liked),
+                    int(known_state),
+                    post_id,
+                )
             )
         except Exception as e:
-            print(f"Error adding to logout all devices: {e}")
-            return False
+            logger.warning(f"Error buffering like: {e}")
+            return None
 
-    def is_logout_all_devices(self, user_id: str, iat: int) -> bool:
+    def get_pending_likes(
+        self, post_ids: list[int], user_id: int = None
+    ) -> tuple[dict, dict]:
         """
-        Check if a user ID is in the logout all devices list
+        Get the buffered like count changes of posts and buffered likes of a user
+
         Args:
-            user_id: User ID to check
-            iat: time of created_at of the token
+            post_ids: Post IDs
+            user_id: User ID (optional)
+
         Returns:
-            bool: True if the current token is created before the last logout all devices, False otherwise
+            tuple[dict, dict]: Like count change per post ID, buffered like state per post ID
         """
         try:
-            last_logout_all_devices = self.redis_client.get(
-                f"logout_all_devices:{user_id}"
+            pipe = self.redis_client.pipeline(transaction=False)
+            for post_id in post_ids:
+                pending, delta, flushing, flushing_delta = self._like_keys(post_id)
+                pipe.mget(delta, flushing_delta)
+                if user_id:
+                    pipe.hget(pending, user_id)
+                    pipe.hget(flushing, user_id)
+            results = iter(pipe.execute())
+            deltas, states = {}, {}
+            for post_id in post_ids:
+                deltas[post_id] = sum(int(delta or 0) for delta in next(results))
+                if user_id:
+                    pending_state, flushing_state = next(results), next(results)
+                    state = pending_state or flushing_state
+                    if state is not None:
+                        states[post_id] = state == "1"
+            return deltas, states
+        except Exception as e:
+            logger.warning(f"Error getting pending likes: {e}")
+            return {}, {}
+
+    def claim_pending_likes(self, batch_size: int) -> dict:
+        """
+        Move a batch of buffered likes to the flushing keys, to be written to the database
+
+        Args:
+            batch_size: Max number of posts to claim
+
+        Returns:
+            dict: Post ID -> ({user ID: liked}, like count change)
+        """
+        post_ids = set(self.redis_client.smembers(self.LIKES_FLUSHING_KEY))
+        post_ids |= set(self.redis_client.spop(self.LIKES_DIRTY_KEY, batch_size) or [])
+        claimed = {}
+        for post_id in post_ids:
+            self.redis_client.sadd(self.LIKES_FLUSHING_KEY, post_id)
+            ops, delta = self.redis_client.eval(
+                self._CLAIM_LIKES_SCRIPT, 4, *self._like_keys(post_id)
+            )
+            claimed[int(post_id)] = (
+                {int(ops[i]): ops[i + 1] == "1" for i in range(0, len(ops), 2)},
+                int(delta or 0),
+            )
+        return claimed
+
+    def complete_pending_likes(self, post_ids: list[int]) -> None:
+        """Drop flushed likes once they are committed to the database"""
+        pipe = self.redis_client.pipeline()
+        for post_id in post_ids:
+            _, _, flushing, flushing_delta = self._like_keys(post_id)
+            pipe.delete(flushing, flushing_delta)
+            pipe.srem(self.LIKES_FLUSHING_KEY, post_id)
+        pipe.execute()
+
+    #   ==================================================
+    #   ============== Bounded sorted sets ===============
+    #   ==================================================
+    #   Post ids scored by creation time (home timelines, tag posting lists), kept
+    #   to their newest members and rebuilt from the database when missing. A set
+    #   is rebuilt under `{key}:building`, which also receives the members added
+    #   meanwhile, then renamed in: readers never see it empty, and the additions
+    #   made during the rebuild are not lost. The sentinel member (score 0) keeps
+    #   an empty but built set alive, readers skip it.
+
+    SORTED_SET_SENTINEL = "0"
+    #   Seconds a rebuild can take before the members added meanwhile are dropped
+    SORTED_SET_BUILD_TTL = 60
+    _SORTED_SET_CHUNK_SIZE = 1000
+
+    _ADD_TO_SORTED_SETS_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call('EXISTS', key) == 1 then
+            redis.call('ZADD', key, ARGV[1], ARGV[2])
+            redis.call('ZREMRANGEBYRANK', key, 0, -(tonumber(ARGV[3]) + 1))
+        end
+    end
+    return 1
+    """
+
+    _REPLACE_SORTED_SET_SCRIPT = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('ZUNIONSTORE', KEYS[1], 2, KEYS[1], KEYS[2], 'AGGREGATE', 'MAX')
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[1]) + 1))
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+    return 1
+    """
+
+    @staticmethod
+    def _building_key(key: str) -> str:
+        return f"{key}:building"
+
+    def start_sorted_set_build(self, key: str) -> None:
+        """Collect the members added to a sorted set while it is rebuilt"""
+        building_key = self._building_key(key)
+        pipe = self.redis_client.pipeline()
+        pipe.zadd(building_key, {self.SORTED_SET_SENTINEL: 0})
+        pipe.expire(building_key, self.SORTED_SET_BUILD_TTL)
+        pipe.execute()
+
+    def store_sorted_set(
+        self, key: str, members: dict, max_length: int, expires_in: int
+    ) -> None:
+        """
+        Replace a sorted set with its rebuilt members, and the members added since
+        `start_sorted_set_build`. Merged with the set of a concurrent rebuild, if
+        one finished first.
+
+        Args:
+            key: Key of the sorted set
+            members: Member -> score
+            max_length: Max members kept, the newest ones
+            expires_in: Time in seconds until the set expires
+        """
+        building_key = self._building_key(key)
+        items = list(members.items())
+        pipe = self.redis_client.pipeline(transaction=False)
+        #   Again, in case the set being built expired in the meantime
+        pipe.zadd(building_key, {self.SORTED_SET_SENTINEL: 0})
+        for start in range(0, len(items), self._SORTED_SET_CHUNK_SIZE):
+            pipe.zadd(
+                building_key, dict(items[start : start + self._SORTED_SET_CHUNK_SIZE])
+            )
+        pipe.execute()
+        self.redis_client.eval(
+            self._REPLACE_SORTED_SET_SCRIPT,
+            2,
+            building_key,
+            key,
+            max_length,
+            expires_in,
+        )
+
+    def add_to_sorted_sets(
+        self, keys: list[str], member: str, score: int, max_length: int
+    ) -> None:
+        """
+        Add a member to the given sorted sets which are built, or being built, and
+        trim them to `max_length` members. Missing sets are left to be rebuilt.
+        """
+        keys = [name for key in keys for name in (key, self._building_key(key))]
+        for start in range(0, len(keys), self._SORTED_SET_CHUNK_SIZE):
+            chunk = keys[start : start + self._SORTED_SET_CHUNK_SIZE]
+            self.redis_client.eval(
+                self._ADD_TO_SORTED_SETS_SCRIPT,
+                len(chunk),
+                *chunk,
+                score,
+                member,
+                max_length,
+            )
+
+    def remove_from_sorted_sets(self, keys: list[str], member: str) -> None:
+        """Remove a member from the given sorted sets, and the ones being built"""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrem(key, member)
+            pipe.zrem(self._building_key(key), member)
+        pipe.execute()
+
+    def acquire_lock(self, name: str, expires_in: int) -> str | None:
+        """
+        Acquire a named lock shared by all instances
+
+        Args:
+            name: Lock name
+            expires_in: Time in seconds after which the lock is released anyway
+
+        Returns:
+            str | None: Lock token to release the lock with, None if already held
+        """
+        try:
+            token = str(uuid.uuid4())
+            if self.redis_client.set(f"lock:{name}", token, nx=True, ex=expires_in):
+                return token
+            return None
+        except Exception as e:
+            logger.warning(f"Error acquiring lock {name}: {e}")
+            return None
+
+    def release_lock(self, name: str, token: str) -> bool:
+        """Release a named lock if it is still held with the given token"""
+        try:
+            return bool(
+                self.redis_client.eval(
+                    "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+                    "return redis.call('DEL', KEYS[1]) else return 0 end",
+                    1,
+                    f"lock:{name}",
+                    token,
+                )
             )
-            if last_logout_all_devices and int(last_logout_all_devices) > iat:
-                return int(last_logout_all_devices) > iat
-            return False
         except Exception as e:
-            print(f"Error checking logout all devices: {e}")
+            logger.warning(f"Error releasing lock {name}: {e}")
             return False
 
 
@@ -0,0 +1,254 @@
+#   References: https://cloud.google.com/storage/docs/access-control/signed-urls
+
+import io
+import os
+import time
+import uuid
+import hmac
+import hashlib
+import logging
+import datetime
+import threading
+from abc import ABC, abstractmethod
+from urllib.parse import urlencode, quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from google.cloud import storage
+from google.api_core.exceptions import NotFound
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+_COPY_CHUNK_SIZE = 64 * 1024
+
+
+class StorageBackend(ABC):
+    """
+    Object storage used for the uploaded images. Objects are named by their
+    path in the bucket, clients read and write them directly with signed urls.
+    """
+
+    @abstractmethod
+    def sign_put_url(self, path: str, content_type: str, expires_at: int) -> str:
+        """Url to upload an object with a PUT request until `expires_at`"""
+
+    @abstractmethod
+    def sign_get_url(self, path: str, expires_at: int) -> str:
+        """Url to read an object until `expires_at`"""
+
+    @abstractmethod
+    def read(self, path: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def write(self, path: str, data: bytes, content_type: str) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, path: str) -> bool:
+        """Delete an object, False when it did not exist"""
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        pass
+
+    def delete_many(self, paths: list[str], max_workers: int) -> list[str]:
+        """
+        Delete objects with concurrent requests. A failed delete is logged and
+        does not stop the others.
+
+        Args:
+            paths: Paths of the objects
+            max_workers: Max number of concurrent requests
+
+        Returns:
+            list[str]: Paths which are confirmed gone (deleted, or already missing)
+        """
+        deleted = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self.delete, path): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    deleted.append(futures[future])
+                except Exception as error:
+                    logger.warning(f"Error while deleting {futures[future]}: {error}")
+        return deleted
+
+
+class GCSStorage(StorageBackend):
+    """Google Cloud Storage bucket, the client is created on first use"""
+
+    def __init__(self, bucket_name: str, project: str):
+        self.bucket_name = bucket_name
+        self.project = project
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                client = storage.Client(project=self.project)
+                self._bucket = client.bucket(self.bucket_name)
+            return self._bucket
+
+    def sign_put_url(self, path: str, content_type: str, expires_at: int) -> str:
+        return self.bucket.blob(path).generate_signed_url(
+            version="v4",
+            method="PUT",
+            expiration=datetime.datetime.fromtimestamp(
+                expires_at, datetime.timezone.utc
+            ),
+            content_type=content_type,
+        )
+
+    def sign_get_url(self, path: str, expires_at: int) -> str:
+        return self.bucket.blob(path).generate_signed_url(
+            version="v4",
+            method="GET",
+            expiration=datetime.datetime.fromtimestamp(
+                expires_at, datetime.timezone.utc
+            ),
+            response_disposition="inline",  # Prevent download image
+        )
+
+    def read(self, path: str) -> bytes:
+        return self.bucket.blob(path).download_as_bytes()
+
+    def write(self, path: str, data: bytes, content_type: str) -> None:
+        self.bucket.blob(path).upload_from_string(data, content_type=content_type)
+
+    def delete(self, path: str) -> bool:
+        try:
+            #   A single request, no existence check first
+            self.bucket.blob(path).delete()
+            return True
+        except NotFound:
+            return False
+
+    def exists(self, path: str) -> bool:
+        return self.bucket.blob(path).exists()
+
+
+class LocalStorage(StorageBackend):
+    """
+    Directory of the local filesystem, for development and offline load tests.
+    Files are served by the `storage` blueprint with HMAC signed urls.
+    """
+
+    def __init__(self, root: str, base_url: str, secret_key: str):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self._secret_key = secret_key.encode()
+
+    def _signature(
+        self, method: str, path: str, expires_at: int, content_type: str
+    ) -> str:
+        message = f"{method}\n{path}\n{expires_at}\n{content_type}".encode()
+        return hmac.new(self._secret_key, message, hashlib.sha256).hexdigest()
+
+    def _sign_url(
+        self, method: str, path: str, expires_at: int, content_type: str = ""
+    ) -> str:
+        query = urlencode(
+            {
+                "expires": expires_at,
+                "signature": self._signature(method, path, expires_at, content_type),
+            }
+        )
+        return f"{self.base_url}/{quote(path)}?{query}"
+
+    def verify(
+        self,
+        method: str,
+        path: str,
+        expires_at: int,
+        signature: str,
+        content_type: str = "",
+    ) -> bool:
+        """
+        Whether a signed url is authentic and not expired. Like Google Cloud
+        Storage, an upload must send the content type it was signed for.
+        """
+        if expires_at < time.time():
+            return False
+        return hmac.compare_digest(
+            self._signature(method, path, expires_at, content_type), signature
+        )
+
+    def file_path(self, path: str) -> str | None:
+        """Path of an object on disk, None if it would be outside of the root"""
+        file_path = os.path.abspath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, file_path]) != self.root:
+            return None
+        return file_path
+
+    def sign_put_url(self, path: str, content_type: str, expires_at: int) -> str:
+        return self._sign_url("PUT", path, expires_at, content_type)
+
+    def sign_get_url(self, path: str, expires_at: int) -> str:
+        return self._sign_url("GET", path, expires_at)
+
+    def _checked_file_path(self, path: str) -> str:
+        file_path = self.file_path(path)
+        if file_path is None:
+            raise FileNotFoundError(path)
+        return file_path
+
+    def read(self, path: str) -> bytes:
+        with open(self._checked_file_path(path), "rb") as file:
+            return file.read()
+
+    def write(self, path: str, data: bytes, content_type: str) -> None:
+        self.write_stream(path, io.BytesIO(data))
+
+    def write_stream(self, path: str, stream, max_size: int = None) -> None:
+        """
+        Write a file from a stream, readers never see a partial file.
+
+        Raises:
+            ValueError: The stream is longer than `max_size` bytes, nothing is written
+        """
+        file_path = self._checked_file_path(path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            size = 0
+            with open(tmp_path, "wb") as file:
+                while chunk := stream.read(_COPY_CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"File {path} is over {max_size} bytes.")
+                    file.write(chunk)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, path: str) -> bool:
+        file_path = self.file_path(path)
+        if file_path is None:
+            return False
+        try:
+            os.remove(file_path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def exists(self, path: str) -> bool:
+        file_path = self.file_path(path)
+        return file_path is not None and os.path.isfile(file_path)
+
+
+def create_storage_backend() -> StorageBackend:
+    """Create the storage backend selected by `STORAGE_BACKEND`"""
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStorage(
+            root=settings.LOCAL_STORAGE_ROOT,
+            base_url=settings.LOCAL_STORAGE_URL,
+            secret_key=settings.SECRET_KEY,
+        )
+    return GCSStorage(
+        bucket_name=settings.BUCKET_NAME, project=settings.GOOGLE_CLOUD_PROJECT
+    )
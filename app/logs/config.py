@@ -20,6 +20,85 @@ REQUEST_LATENCY = Histogram(
     ["method", "endpoint"],
 )
 
+#   Cost of a request, labelled by route template like the request metrics
+_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_SQL_STATEMENTS = Histogram(
+    "sydegram_http_request_sql_statements",
+    "SQL statements executed per HTTP request",
+    ["method", "endpoint"],
+    buckets=_COUNT_BUCKETS,
+)
+
+REQUEST_SQL_DURATION = Histogram(
+    "sydegram_http_request_sql_duration_seconds",
+    "Time spent executing SQL statements per HTTP request",
+    ["method", "endpoint"],
+    buckets=_DURATION_BUCKETS,
+)
+
+REQUEST_REDIS_CALLS = Histogram(
+    "sydegram_http_request_redis_calls",
+    "Redis commands (or pipelines) sent per HTTP request",
+    ["method", "endpoint"],
+    buckets=_COUNT_BUCKETS,
+)
+
+REQUEST_REDIS_DURATION = Histogram(
+    "sydegram_http_request_redis_duration_seconds",
+    "Time spent waiting on Redis per HTTP request",
+    ["method", "endpoint"],
+    buckets=_DURATION_BUCKETS,
+)
+
+STORAGE_CALL_LATENCY = Histogram(
+    "sydegram_storage_call_duration_seconds",
+    "Storage backend call latency, endpoint is `background` outside of requests",
+    ["operation", "endpoint"],
+    buckets=_DURATION_BUCKETS,
+)
+
+QUERY_BUDGET_EXCEEDED = Counter(
+    "sydegram_query_budget_exceeded_total",
+    "HTTP requests which ran more SQL statements than the budget of their endpoint",
+    ["method", "endpoint"],
+)
+
+REDIS_COMMAND_LATENCY = Histogram(
+    "sydegram_redis_command_duration_seconds",
+    "Redis command (or pipeline) latency",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+REDIS_COMMAND_ERRORS = Counter(
+    "sydegram_redis_command_errors_total",
+    "Redis commands which failed, or were rejected by the circuit breaker",
+    ["command", "error"],
+)
+
+REDIS_POOL_CONNECTIONS = Gauge(
+    "sydegram_redis_pool_connections",
+    "Connections of the Redis pool",
+    ["state"],
+)
+
+REDIS_CIRCUIT_OPEN = Gauge(
+    "sydegram_redis_circuit_open",
+    "1 while the Redis circuit breaker rejects calls, 0 otherwise",
+)
+
+PASSWORD_HASH_IN_FLIGHT = Gauge(
+    "sydegram_password_hash_in_flight",
+    "Password hashes and checks running or queued in the hashing pool",
+)
+
+PASSWORD_HASH_REJECTED = Counter(
+    "sydegram_password_hash_rejected_total",
+    "Password hashes and checks rejected because the hashing pool was saturated",
+)
+
 
 def init_logging(app):
     log_dir = "app/logs"
@@ -0,0 +1,229 @@
+#   References: https://docs.sqlalchemy.org/en/20/core/events.html#sqlalchemy.events.ConnectionEvents
+
+import re
+import time
+import random
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import InternalServerError
+
+from app.core.config import settings
+from app.logs.config import (
+    QUERY_BUDGET_EXCEEDED,
+    REQUEST_SQL_STATEMENTS,
+    REQUEST_SQL_DURATION,
+    REQUEST_REDIS_CALLS,
+    REQUEST_REDIS_DURATION,
+    STORAGE_CALL_LATENCY,
+)
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|(?<![:\w]):\w+")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(InternalServerError):
+    """Raised in `raise` mode when a request runs more SQL statements than allowed"""
+
+
+def normalize_statement(statement: str) -> str:
+    """
+    Shape of a SQL statement: literals and bound parameters become `?` and value
+    lists `(?, ?, ...)` a single `(?)`, so the queries of an N+1 loop, or an IN
+    clause of any length, have the same shape.
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return _VALUE_LIST.sub("(?)", statement)
+
+
+class RequestCost:
+    """
+    SQL statements and Redis calls made while serving the current request. The
+    shape of each statement is only recorded when `statements` is a Counter.
+    """
+
+    __slots__ = (
+        "sql_statements",
+        "unbudgeted_statements",
+        "unbudgeted_depth",
+        "sql_duration",
+        "redis_calls",
+        "redis_duration",
+        "statements",
+    )
+
+    def __init__(self, record_statements: bool = False):
+        self.sql_statements = 0
+        #   Statements run by `outside_query_budget` blocks, see there
+        self.unbudgeted_statements = 0
+        self.unbudgeted_depth = 0
+        self.sql_duration = 0.0
+        self.redis_calls = 0
+        self.redis_duration = 0.0
+        self.statements = Counter() if record_statements else None
+
+    def repeated_statements(self, threshold: int) -> list[tuple[str, int]]:
+        """Statement shapes run at least `threshold` times, most repeated first"""
+        if self.statements is None:
+            return []
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+def _record_statements() -> bool:
+    #   Every request in development and tests, a sample of them in production
+    if settings.QUERY_BUDGET_MODE == "raise":
+        return True
+    return random.random() < settings.QUERY_SAMPLE_RATE
+
+
+def get_request_cost() -> RequestCost | None:
+    """
+    Cost of the current request, created on first use: the rate limiter and the
+    auth context already query Redis before the app `before_request` hooks run.
+    None outside of a request (schedulers, background threads, CLI commands).
+    """
+    if not has_request_context():
+        return None
+    if "request_cost" not in g:
+        g.request_cost = RequestCost(record_statements=_record_statements())
+    return g.request_cost
+
+
+def request_endpoint() -> str:
+    """
+    Route template of the current request (e.g. `/api/v1/posts/<int:post_id>`),
+    which keeps one time series per route instead of one per url. `unmatched`
+    when no route matched, `background` outside of a request.
+    """
+    if not has_request_context():
+        return "background"
+    if request.url_rule is None:
+        return "unmatched"
+    return request.url_rule.rule
+
+
+def observe_request_cost(method: str, endpoint: str) -> None:
+    """Record the cost of the current request, zeros included"""
+    cost = get_request_cost() or RequestCost()
+    REQUEST_SQL_STATEMENTS.labels(method, endpoint).observe(cost.sql_statements)
+    REQUEST_SQL_DURATION.labels(method, endpoint).observe(cost.sql_duration)
+    REQUEST_REDIS_CALLS.labels(method, endpoint).observe(cost.redis_calls)
+    REQUEST_REDIS_DURATION.labels(method, endpoint).observe(cost.redis_duration)
+
+
+def _format_repeated(repeated: list[tuple[str, int]]) -> str:
+    return "; ".join(f"{count}x {statement}" for statement, count in repeated)
+
+
+@contextmanager
+def outside_query_budget():
+    """
+    Leave the SQL statements run inside out of the query budget of the current
+    request (they are still in its metrics): cache fills on a miss, and
+    fallbacks while Redis is down. They only run on cold or degraded requests,
+    while the budget of an endpoint is sized for its warm path.
+    """
+    cost = get_request_cost()
+    if cost is None:
+        yield
+        return
+    cost.unbudgeted_depth += 1
+    try:
+        yield
+    finally:
+        cost.unbudgeted_depth -= 1
+
+
+def check_query_budget(max_statements: int) -> None:
+    """
+    Check the SQL statements run so far by the current request, apart from
+    `outside_query_budget` ones, against the budget of its endpoint. Exceeding
+    it raises `QueryBudgetExceeded` in `raise` mode, otherwise it is counted,
+    and logged for the sampled requests.
+    """
+    cost = get_request_cost()
+    if cost is None:
+        return
+    statements = cost.sql_statements - cost.unbudgeted_statements
+    if statements <= max_statements:
+        return
+    endpoint = request_endpoint()
+    QUERY_BUDGET_EXCEEDED.labels(request.method, endpoint).inc()
+    message = (
+        f"{request.method} {endpoint} ran {statements} SQL statements, "
+        f"over its budget of {max_statements}."
+    )
+    repeated = cost.repeated_statements(settings.QUERY_REPEAT_THRESHOLD)
+    if repeated:
+        message += f" Repeated: {_format_repeated(repeated)}"
+    if settings.QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(message)
+    if cost.statements is not None:
+        current_app.logger.warning(message)
+
+
+def report_repeated_statements(method: str, endpoint: str) -> None:
+    """Log the statement shapes repeated by the current request, likely N+1"""
+    cost = get_request_cost()
+    if cost is None:
+        return
+    repeated = cost.repeated_statements(settings.QUERY_REPEAT_THRESHOLD)
+    if repeated:
+        current_app.logger.warning(
+            f"Possible N+1 queries in {method} {endpoint}: {_format_repeated(repeated)}"
+        )
+
+
+def record_redis_call(duration: float) -> None:
+    cost = get_request_cost()
+    if cost is not None:
+        cost.redis_calls += 1
+        cost.redis_duration += duration
+
+
+@contextmanager
+def storage_timer(operation: str):
+    """Time a call to the storage backend, failed calls included"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STORAGE_CALL_LATENCY.labels(operation, request_endpoint()).observe(
+            time.perf_counter() - start
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    #   Kept on the execution context, a failed statement leaves nothing behind
+    context._request_cost_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    cost = get_request_cost()
+    if cost is not None:
+        cost.sql_statements += 1
+        if cost.unbudgeted_depth:
+            cost.unbudgeted_statements += 1
+        cost.sql_duration += time.perf_counter() - context._request_cost_start
+        if cost.statements is not None:
+            cost.statements[normalize_statement(statement)] += 1
+
+
+def register_sql_events() -> None:
+    """Count the SQL statements of every engine, once per process"""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -11,9 +11,12 @@ from app.core.extensions import register_extensions, jwt
 from app.v1.routes.auth import authRoute
 from app.v1.routes.user import userRoute
 from app.v1.routes.post import postRoute
+from app.v1.routes.storage import storageRoute
+from app.v1.routes.admin import adminRoute
 from app.logs.config import init_logging
 from app.v1.utils import register_dependencies
-from app.v1.schedulers import scheduler_delete_image
+from app.v1.schedulers import scheduler_delete_image, scheduler_flush_likes
+from app.v1.commands import register_commands
 from app.core.redis_client import redis_client
 
 
@@ -43,6 +46,9 @@ def create_app():
     rootRoute.register_blueprint(authRoute)
     rootRoute.register_blueprint(userRoute)
     rootRoute.register_blueprint(postRoute)
+    rootRoute.register_blueprint(adminRoute)
+    if settings.STORAGE_BACKEND == "local":
+        rootRoute.register_blueprint(storageRoute)
     app.register_blueprint(rootRoute)
 
     #   Register error handlers
@@ -54,22 +60,25 @@ def create_app():
     # Setup JWT
     @jwt.token_in_blocklist_loader
     def token_in_blocklist_callback(jwt_header, jwt_data):
-        jit = jwt_data["jit"]
-        identity = jwt_data["sub"]
-        iat = jwt_data["iat"]
-        if redis_client.is_blacklisted(jit) or redis_client.is_logout_all_devices(
-            identity, iat
-        ):
-            return True
-        return False
+        return redis_client.is_revoked(
+            jit=jwt_data["jit"], user_id=jwt_data["sub"], iat=jwt_data["iat"]
+        )
 
     register_dependencies(app)
+    register_commands(app)
     app.wsgi_app = DispatcherMiddleware(
         app.wsgi_app, {"/metrics": make_wsgi_app(REGISTRY)}
     )
 
     #   Register background schedulers
     scheduler.add_job(scheduler_delete_image, "interval", days=1, kwargs={"app": app})
+    scheduler.add_job(
+        scheduler_flush_likes,
+        "interval",
+        seconds=settings.LIKE_FLUSH_INTERVAL,
+        kwargs={"app": app},
+    )
     scheduler.start()
+    redis_client.start_revocation_listener()
 
     return app
@@ -0,0 +1,202 @@
+import click
+from flask import Flask, current_app
+from sqlalchemy import select, func, update, or_
+from sqlalchemy.orm import Session
+
+from app.core.database import db_session
+from app.core.redis_client import redis_client
+from app.v1.enums import ImageProcessingEnum
+from app.v1.models import Post, User, Like, Comment, Follow, ImageCron
+from app.v1.services.image import process_image
+from app.v1.services.user_search import READY_KEY, index_users
+
+
+def _reconcile_reply_counts(session: Session, batch_size: int) -> int:
+    """
+    Fix `comments.reply_count`. MySQL cannot read the updated table in a subquery,
+    so replies are counted per primary key range and drifted rows updated by key.
+    """
+    fixed = 0
+    max_id = session.query(func.max(Comment.id)).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size - 1
+        reply_counts = dict(
+            session.query(Comment.parent_comment_id, func.count())
+            .filter(Comment.parent_comment_id.between(start, end))
+            .group_by(Comment.parent_comment_id)
+            .all()
+        )
+        drifted = [
+            {"id": comment_id, "reply_count": reply_counts.get(comment_id, 0)}
+            for comment_id, reply_count in session.query(
+                Comment.id, Comment.reply_count
+            ).filter(Comment.id.between(start, end))
+            if reply_count != reply_counts.get(comment_id, 0)
+        ]
+        if drifted:
+            session.execute(update(Comment), drifted)
+        session.commit()
+        fixed += len(drifted)
+    return fixed
+
+
+def reconcile_counters(batch_size: int = 1000) -> dict:
+    """
+    Recompute the denormalized counters from the source tables and fix drifted rows.
+    Rows are processed in primary key ranges to keep each UPDATE (and its locks) short.
+
+    Args:
+        batch_size: Number of primary keys per UPDATE statement
+
+    Returns:
+        dict: Number of fixed rows per table
+    """
+    targets = [
+        (
+            Post,
+            {
+                Post.like_count: select(func.count())
+                .where(Like.post_id == Post.id)
+                .scalar_subquery(),
+                Post.comment_count: select(func.count())
+                .where(Comment.post_id == Post.id)
+                .scalar_subquery(),
+            },
+        ),
+        (
+            User,
+            {
+                User.follower_count: select(func.count())
+                .where(Follow.following_id == User.id)
+                .scalar_subquery(),
+                User.following_count: select(func.count())
+                .where(Follow.follower_id == User.id)
+                .scalar_subquery(),
+            },
+        ),
+    ]
+    fixed = {}
+    with db_session() as session:
+        fixed[Comment.__tablename__] = _reconcile_reply_counts(
+            session=session, batch_size=batch_size
+        )
+        for model, values in targets:
+            fixed[model.__tablename__] = 0
+            max_id = session.query(func.max(model.id)).scalar() or 0
+            drifted = or_(*[column != value for column, value in values.items()])
+            for start in range(0, max_id + 1, batch_size):
+                result = session.execute(
+                    update(model)
+                    .where(model.id.between(start, start + batch_size - 1), drifted)
+                    .values(values)
+                    .execution_options(synchronize_session=False)
+                )
+                session.commit()
+                fixed[model.__tablename__] += result.rowcount
+    return fixed
+
+
+def index_all_users(batch_size: int = 1000) -> int:
+    """
+    (Re)build the user search index from the users table, by primary key batches,
+    then mark it as ready to be read by the user search.
+
+    Args:
+        batch_size: Number of users per batch
+
+    Returns:
+        int: Number of indexed users
+    """
+    indexed, last_id = 0, 0
+    with db_session() as session:
+        while True:
+            users = (
+                session.query(User.id, User.username)
+                .filter(User.id > last_id)
+                .order_by(User.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not users:
+                break
+            index_users([(user_id, username) for user_id, username in users])
+            indexed += len(users)
+            last_id = users[-1][0]
+    redis_client.redis_client.set(READY_KEY, 1)
+    return indexed
+
+
+def process_pending_images(batch_size: int = 100, retry_failed: bool = False) -> dict:
+    """
+    Make the resized variants of the images still pending: uploaded before the
+    image pipeline, or left over when the background queue was full.
+
+    Args:
+        batch_size: Number of images read per batch
+        retry_failed: Also retry the images whose processing failed
+
+    Returns:
+        dict: Number of processed and failed images
+    """
+    statuses = [ImageProcessingEnum.pending.value]
+    if retry_failed:
+        statuses.append(ImageProcessingEnum.failed.value)
+    counts, last_id = {"processed": 0, "failed": 0}, 0
+    with db_session() as session:
+        while True:
+            image_ids = [
+                image_id
+                for (image_id,) in session.query(ImageCron.id)
+                .filter(
+                    ImageCron.id > last_id,
+                    ImageCron.processing_status.in_(statuses),
+                )
+                .order_by(ImageCron.id)
+                .limit(batch_size)
+            ]
+            if not image_ids:
+                break
+            for image_id in image_ids:
+                try:
+                    process_image(image_id=image_id, session=session)
+                    counts["processed"] += 1
+                except Exception as error:
+                    current_app.logger.warning(
+                        f"Process image {image_id} failed: {error}"
+                    )
+                    counts["failed"] += 1
+            last_id = image_ids[-1]
+    return counts
+
+
+def register_commands(app: Flask):
+
+    @app.cli.command("reconcile-counters")
+    @click.option("--batch-size", default=1000, help="Primary keys per UPDATE.")
+    def reconcile_counters_command(batch_size: int):
+        """Fix drift of like, comment, reply, follower and following counters."""
+        fixed = reconcile_counters(batch_size=batch_size)
+        for table, count in fixed.items():
+            current_app.logger.info(f"Reconciled {count} rows of table {table}.")
+            click.echo(f"{table}: {count} rows fixed")
+
+    @app.cli.command("index-users")
+    @click.option("--batch-size", default=1000, help="Users per batch.")
+    def index_users_command(batch_size: int):
+        """Build the user search index."""
+        indexed = index_all_users(batch_size=batch_size)
+        current_app.logger.info(f"Indexed {indexed} users for search.")
+        click.echo(f"{indexed} users indexed")
+
+    @app.cli.command("process-images")
+    @click.option("--batch-size", default=100, help="Images per batch.")
+    @click.option("--retry-failed", is_flag=True, help="Retry failed images too.")
+    def process_images_command(batch_size: int, retry_failed: bool):
+        """Make the resized variants of pending images."""
+        counts = process_pending_images(
+            batch_size=batch_size, retry_failed=retry_failed
+        )
+        current_app.logger.info(
+            f"Processed {counts['processed']} images, {counts['failed']} failed."
+        )
+        click.echo(f"{counts['processed']} images processed, {counts['failed']} failed")
@@ -9,3 +9,15 @@ class PostStatus(str, Enum):
 class ImageCronEnum(str, Enum):
     used = "used"
     unused = "unused"
+
+
+class ImageProcessingEnum(str, Enum):
+    pending = "pending"
+    ready = "ready"
+    failed = "failed"
+
+
+class ImageVariantEnum(str, Enum):
+    thumbnail = "thumbnail"  #   Profile grids
+    feed = "feed"  #   Feed tiles
+    full = "full"  #   Post page
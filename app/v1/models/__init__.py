@@ -1,6 +1,6 @@
 from .base import TimeMixin, BaseModel
 from .user import User
-from .post import Post, PostTag, ImageCron
+from .post import Post, PostTag, ImageCron, ImageVariant
 from .tag import Tag
 from .follow import Follow
 from .like import Like
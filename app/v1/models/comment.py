@@ -4,6 +4,16 @@ from app.v1.models.base import BaseModel
 
 class Comment(BaseModel):
     __tablename__ = "comments"
+    __table_args__ = (
+        #   Keyset pagination of the comments (or replies) of a post
+        db.Index(
+            "ix_comments_post_parent_created",
+            "post_id",
+            "parent_comment_id",
+            "created_at",
+            "id",
+        ),
+    )
 
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), nullable=False)
@@ -11,6 +21,8 @@ class Comment(BaseModel):
         db.Integer, db.ForeignKey("comments.id"), nullable=True
     )
     content = db.Column(db.Text)
+    #   Denormalized number of direct replies, kept in sync on write
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return f"{self.content}"
@@ -1,12 +1,14 @@
 from werkzeug.exceptions import NotFound
 
+from app.core.config import settings
 from app.core.extensions import db
 from app.v1.models.base import BaseModel, TimeMixin
-from app.v1.enums import PostStatus
+from app.v1.enums import PostStatus, ImageProcessingEnum
 from app.v1.models.user import User
 from app.v1.models.like import Like
-from app.v1.models.comment import Comment
 from app.core.database import db_session
+from app.core.redis_client import redis_client
+from app.v1.storage import _generate_get_singed_urls
 
 
 class Post(BaseModel):
@@ -16,6 +18,9 @@ class Post(BaseModel):
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     deleted = db.Column(db.Boolean, default=False, nullable=False)
     status = db.Column(db.String(20), nullable=False, default=PostStatus.draft.value)
+    #   Denormalized counters, kept in sync on write and by `flask reconcile-counters`
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return f"{self.caption}"
@@ -26,46 +31,144 @@ class Post(BaseModel):
         include_user: bool = False,
         include_like: bool = False,
         include_comment: bool = False,
+        include_image_url: bool = False,
+        image_variant: str = None,
     ) -> dict:
-        post_dict = {
-            "id": self.id,
-            "created_at": self.created_at,
-            "modified_at": self.modified_at,
-            "caption": self.caption,
-            "status": self.status,
-            "deleted": self.deleted,
-        }
+        return Post.bulk_to_dict(
+            posts=[self],
+            current_user=current_user,
+            include_user=include_user,
+            include_like=include_like,
+            include_comment=include_comment,
+            include_image_url=include_image_url,
+            image_variant=image_variant,
+        )[0]
+
+    @classmethod
+    def bulk_to_dict(
+        cls,
+        posts: list["Post"],
+        current_user: User = None,
+        include_user: bool = False,
+        include_like: bool = False,
+        include_comment: bool = False,
+        include_image_url: bool = False,
+        image_variant: str = None,
+    ) -> list[dict]:
+        """
+        Serialize a list of posts with a fixed number of set-based queries,
+        no matter how many posts are given (one query per included relation).
+        Like and comment counts are read from the denormalized counters.
+
+        Args:
+            posts: Posts to serialize, output keeps the same order
+            current_user: Viewer, used to compute `liked_by_me`
+            include_user: Attach the author of each post
+            include_like: Attach `like_count` and `liked_by_me`
+            include_comment: Attach `comment_count`
+            include_image_url: Attach `image_url` (signed GET url of the image)
+                and `image_url_expires_in`
+            image_variant: Size of the image to point at (`ImageVariantEnum`), in
+                the first available format of `IMAGE_VARIANT_FORMATS`, with its
+                `image_width` and `image_height`. The original is used while the
+                variants are not made, or when None.
+
+        Returns:
+            list[dict]: Serialized posts
+        """
+        if not posts:
+            return []
+        post_ids = [post.id for post in posts]
         with db_session() as session:
-            image_id = (
-                session.query(ImageCron.id)
-                .filter(ImageCron.post_id == self.id)
-                .scalar()
+            #   1. Images attached to the posts
+            images = {
+                post_id: (image_id, image_name)
+                for post_id, image_id, image_name in session.query(
+                    ImageCron.post_id, ImageCron.id, ImageCron.image_name
+                ).filter(ImageCron.post_id.in_(post_ids))
+            }
+            #   2. Resized variants of the images, by image id
+            variants = {}
+            if include_image_url and image_variant:
+                rank = {f: i for i, f in enumerate(settings.IMAGE_VARIANT_FORMATS)}
+                image_ids = [image_id for image_id, _ in images.values()]
+                rows = session.query(ImageVariant).filter(
+                    ImageVariant.image_id.in_(image_ids),
+                    ImageVariant.variant == image_variant,
+                    ImageVariant.format.in_(rank),
+                )
+                #   Preferred format last, so that it wins
+                for variant in sorted(rows, key=lambda v: rank[v.format], reverse=True):
+                    variants[variant.image_id] = variant
+            #   3. Authors
+            users = {}
+            if include_user:
+                user_ids = {post.user_id for post in posts}
+                users = {
+                    user.id: user.to_dict()
+                    for user in session.query(User).filter(User.id.in_(user_ids))
+                }
+            #   4. Likes of the viewer
+            liked_post_ids = set()
+            if include_like and current_user:
+                liked_post_ids = {
+                    post_id
+                    for (post_id,) in session.query(Like.post_id).filter(
+                        Like.post_id.in_(post_ids),
+                        Like.user_id == current_user.id,
+                    )
+                }
+        #   Likes buffered in Redis and not flushed to the database yet
+        like_deltas, buffered_likes = {}, {}
+        if include_like:
+            like_deltas, buffered_likes = redis_client.get_pending_likes(
+                post_ids=post_ids, user_id=current_user.id if current_user else None
             )
-            if not image_id:
-                raise NotFound(f"Cannot find image for post {self.id}")
-            post_dict["image_id"] = image_id
+        #   Signed urls of all the images, signed at most once per time window
+        image_urls = {}
+        if include_image_url:
+            image_names = {
+                image_id: (
+                    variants[image_id].image_name if image_id in variants else name
+                )
+                for image_id, name in images.values()
+            }
+            image_urls = _generate_get_singed_urls(filenames=list(image_names.values()))
+
+        post_dicts = []
+        for post in posts:
+            if post.id not in images:
+                raise NotFound(f"Cannot find image for post {post.id}")
+            post_dict = {
+                "id": post.id,
+                "created_at": post.created_at,
+                "modified_at": post.modified_at,
+                "caption": post.caption,
+                "status": post.status,
+                "deleted": post.deleted,
+                "image_id": images[post.id][0],
+            }
             if include_user:
-                user = session.query(User).where(User.id == self.user_id).first()
-                if not user:
-                    raise NotFound(f"User with id {self.user_id} not found")
-                post_dict["user"] = user.to_dict()
+                if post.user_id not in users:
+                    raise NotFound(f"User with id {post.user_id} not found")
+                post_dict["user"] = users[post.user_id]
             if include_like:
-                like_count = session.query(Like).filter_by(post_id=self.id).count()
-                liked_by_me = False
-                if current_user:
-                    liked_by_me = (
-                        session.query(Like)
-                        .filter_by(post_id=self.id, user_id=current_user.id)
-                        .first()
-                        is not None
-                    )
-                post_dict["like_count"] = like_count
-                post_dict["liked_by_me"] = liked_by_me
-            if include_comment:
-                post_dict["comment_count"] = (
-                    session.query(Comment).where(Comment.post_id == self.id).count()
+                post_dict["like_count"] = post.like_count + like_deltas.get(post.id, 0)
+                post_dict["liked_by_me"] = buffered_likes.get(
+                    post.id, post.id in liked_post_ids
                 )
-        return post_dict
+            if include_comment:
+                post_dict["comment_count"] = post.comment_count
+            if include_image_url:
+                image_id = images[post.id][0]
+                image_url = image_urls[image_names[image_id]]
+                post_dict["image_url"] = image_url["singed_url"]
+                post_dict["image_url_expires_in"] = image_url["expires_in"]
+                if image_id in variants:
+                    post_dict["image_width"] = variants[image_id].width
+                    post_dict["image_height"] = variants[image_id].height
+            post_dicts.append(post_dict)
+        return post_dicts
 
 
 class PostTag(TimeMixin):
@@ -82,6 +185,31 @@ class PostTag(TimeMixin):
 class ImageCron(BaseModel):
     __table_name__ = "image_crons"
 
-    image_name = db.Column(db.String(255), nullable=False)
+    image_name = db.Column(db.String(255), nullable=False, index=True)
     status = db.Column(db.String(20), nullable=False, default="unused")
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), nullable=True)
+    #   SHA-256 of the original, identical uploads share the files of the first one
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    #   Resized variants, made in background after the upload (`ImageProcessingEnum`)
+    processing_status = db.Column(
+        db.String(20),
+        nullable=False,
+        default=ImageProcessingEnum.pending.value,
+        server_default=ImageProcessingEnum.pending.value,
+    )
+
+
+class ImageVariant(BaseModel):
+    __tablename__ = "image_variants"
+    __table_args__ = (
+        db.UniqueConstraint(
+            "image_id", "variant", "format", name="uq_image_variants_image_variant"
+        ),
+    )
+
+    image_id = db.Column(db.Integer, db.ForeignKey("image_cron.id"), nullable=False)
+    variant = db.Column(db.String(20), nullable=False)  #   `ImageVariantEnum`
+    format = db.Column(db.String(10), nullable=False)  #   webp, jpeg
+    image_name = db.Column(db.String(255), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
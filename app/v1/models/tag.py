@@ -5,6 +5,7 @@ from app.v1.models.base import BaseModel
 
 class Tag(BaseModel):
     __tablename__ = "tags"
+    __table_args__ = (db.UniqueConstraint("tag_name", name="uq_tags_tag_name"),)
 
     tag_name = db.Column(db.String(50), nullable=False)
 
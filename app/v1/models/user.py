@@ -1,5 +1,5 @@
 from app.core.extensions import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.core.password_hasher import password_hasher
 from datetime import datetime
 
 from app.v1.models.base import BaseModel
@@ -15,15 +15,25 @@ class User(BaseModel):
     fullname = db.Column(db.String(100))
     bio = db.Column(db.Text)
     profile_picture = db.Column(db.String(255), default="default.jpg")
+    #   Denormalized counters, kept in sync on write and by `flask reconcile-counters`
+    follower_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
 
     def __repr__(self):
         return f"User {self.username}"
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self) -> bool:
+        return password_hasher.needs_rehash(self.password_hash)
 
     def to_dict(self, viewer=None, excludes: list[str] = None) -> dict:
         user_dict = {
@@ -38,12 +48,8 @@ class User(BaseModel):
         }
         if viewer:
             # user_dict["posts"] = None
-            user_dict["num_to_follow"] = Follow.query.filter_by(
-                follower_id=self.id
-            ).count()
-            user_dict["num_followed"] = Follow.query.filter_by(
-                following_id=self.id
-            ).count()
+            user_dict["num_to_follow"] = self.following_count
+            user_dict["num_followed"] = self.follower_count
             user_dict["is_following"] = (
                 Follow.query.filter_by(
                     follower_id=viewer.id, following_id=self.id
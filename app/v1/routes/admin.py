@@ -0,0 +1,101 @@
+from flask import Blueprint, Response, request, current_app
+from werkzeug.exceptions import BadRequest
+
+from app.core.config import settings
+from app.v1.schemas.user import Principal
+from app.v1.services.profiler import (
+    PROFILE_HEADER,
+    sign_profile_token,
+    get_profiling_windows,
+    enable_profiling_window,
+    get_profile,
+    delete_profile,
+)
+from app.v1.utils import api_response, admin_required
+
+adminRoute = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+def _get_duration_arg(name: str, default: int) -> int:
+    duration = request.form.get(name, default, type=int)
+    if not 0 < duration <= settings.PROFILER_MAX_WINDOW:
+        raise BadRequest(
+            f"{name} must be between 1 and {settings.PROFILER_MAX_WINDOW} seconds."
+        )
+    return duration
+
+
+def _get_endpoint_args(args) -> tuple[str, str]:
+    """Method and route template (e.g. `/api/v1/posts/<int:post_id>`) of an endpoint"""
+    method = args.get("method", "GET", type=str).upper()
+    endpoint = args.get("endpoint", "", type=str)
+    for rule in current_app.url_map.iter_rules():
+        if rule.rule == endpoint and method in rule.methods:
+            return method, endpoint
+    raise BadRequest(f"Unknown endpoint {method} {endpoint}.")
+
+
+@adminRoute.route("/profiler/token", methods=["POST"])
+@admin_required
+def create_profile_token(current_user: Principal):
+    """Token of the `X-Profile` header, profiling the requests which send it"""
+    expires_in = _get_duration_arg("expires_in", default=300)
+    current_app.logger.info(f"Profile token created by {current_user.username}.")
+    return api_response(
+        data={
+            "header": PROFILE_HEADER,
+            "token": sign_profile_token(expires_in=expires_in),
+            "expires_in": expires_in,
+        },
+        message="Profile token created successfully.",
+        status=201,
+    )
+
+
+@adminRoute.route("/profiler/windows", methods=["GET"])
+@admin_required
+def list_profiling_windows(current_user: Principal):
+    return api_response(
+        data=get_profiling_windows(),
+        message="Get profiling windows successfully.",
+    )
+
+
+@adminRoute.route("/profiler/windows", methods=["POST"])
+@admin_required
+def create_profiling_window(current_user: Principal):
+    """Profile every request of an endpoint, in all processes, for a while"""
+    method, endpoint = _get_endpoint_args(request.form)
+    duration = _get_duration_arg("duration", default=300)
+    expires_at = enable_profiling_window(
+        method=method, endpoint=endpoint, duration=duration
+    )
+    current_app.logger.info(
+        f"Profiling of {method} {endpoint} enabled by {current_user.username}."
+    )
+    return api_response(
+        data={"method": method, "endpoint": endpoint, "expires_at": expires_at},
+        message="Profiling window created successfully.",
+        status=201,
+    )
+
+
+@adminRoute.route("/profiler/profile", methods=["GET"])
+@admin_required
+def view_endpoint_profile(current_user: Principal):
+    """
+    Sampled stacks of an endpoint in the collapsed format, one `stack count` per
+    line: pipe to flamegraph.pl, or open in speedscope.
+    """
+    method, endpoint = _get_endpoint_args(request.args)
+    return Response(
+        get_profile(method=method, endpoint=endpoint), mimetype="text/plain"
+    )
+
+
+@adminRoute.route("/profiler/profile", methods=["DELETE"])
+@admin_required
+def delete_endpoint_profile(current_user: Principal):
+    method, endpoint = _get_endpoint_args(request.args)
+    delete_profile(method=method, endpoint=endpoint)
+    return api_response(message="Profile deleted successfully.")
@@ -17,14 +17,16 @@ from app.core.extensions import limiter
 from app.core.database import db_session
 from app.core.config import settings
 from app.v1.utils import api_response
-from app.v1.schemas.user import UserCreate, UserRead, UserLoginResponse
+from app.v1.schemas.user import UserCreate, UserRead, UserLoginResponse, Principal
 from app.v1.services.user import create_user
+from app.v1.services.user_search import index_user
+from app.v1.services.principal import invalidate_principal
 from app.v1.services.auth import _check_user_register, _check_user_login
-from app.v1.utils import user_or_ip_key
+from app.v1.utils import user_or_ip_key, get_auth_context
 from app.core.redis_client import redis_client
-from app.v1.utils import token_required
+from app.v1.utils import token_required, principal_required
 from app.v1.models.user import User
-from werkzeug.exceptions import Unauthorized
+from werkzeug.exceptions import BadRequest, Unauthorized
 
 
 authRoute = Blueprint("auth", __name__, url_prefix="/auth")
@@ -47,6 +49,7 @@ def register():
         created_user = create_user(data=parsed_data, session=session)
         session.commit()
         session.refresh(created_user)
+        index_user(user=created_user)
 
     #   3. Deserialize User DB model to JSON response, convert from ORM-object to Pydantic object
     registerd_user = UserRead.model_validate(created_user)
@@ -70,9 +73,12 @@ def login():
     """
     Login user with username and password
     """
-    json_data = request.get_json()
+    #   Already parsed for the rate limit key
+    json_data = get_auth_context().body
     username = json_data.get("username")
     password = json_data.get("password")
+    if not isinstance(username, str) or not isinstance(password, str):
+        raise BadRequest("A JSON body with a username and a password is required.")
 
     user = _check_user_login(username=username, password=password)
     #   Generate a random JIT and just for both access and refresh token
@@ -164,6 +170,7 @@ def change_password(current_user: User):
         current_user.set_password(password)
         session.commit()
         session.refresh(current_user)
+    invalidate_principal(user_id=current_user.id)
     #   Logout all devices
     redis_client.logout_all_devices(user_id=current_user.id)
     return api_response(
@@ -199,8 +206,8 @@ def logout():
 
 
 @authRoute.route("/logout-all", methods=["POST"])
-@token_required
-def logout_all_devices(current_user: User):
+@principal_required
+def logout_all_devices(current_user: Principal):
     """
     Logout user from all devices
     """
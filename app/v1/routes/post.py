@@ -1,33 +1,60 @@
+import re
 from pydantic import ValidationError
 from flask import Blueprint, current_app, request
 from werkzeug.exceptions import BadRequest, NotFound, Conflict, Forbidden
 from flask_limiter.util import get_remote_address
 from flask_jwt_extended import jwt_required
+from sqlalchemy import or_
 
+from app.core.config import settings
 from app.core.extensions import limiter
 from app.core.database import db_session
-from app.v1.models import Post, User, Like, ImageCron, Comment, PostTag, Tag
-from app.v1.schemas.base import Pagination
+from app.v1.models import Post, Like, ImageCron, Comment
 from app.v1.schemas.post import PostCreate, PostEdit, PostReadList
-from app.v1.schemas.comment import CommentReadList, CommentTree
-from app.v1.services.post import create_post, update_post
-from app.v1.services.tag import create_tags
-from app.v1.enums import PostStatus, ImageCronEnum
-from app.v1.storage import _generate_put_singed_url, _generate_get_singed_url
-from app.v1.services.comment import get_base_comment_and_count
+from app.v1.schemas.user import Principal
+from app.v1.schemas.comment import CommentReadList, CommentTree, CommentNode
+from app.v1.services.post import create_post, update_post, update_post_counts
+from app.v1.services.tag import (
+    create_tags,
+    index_post_tags,
+    unindex_post_tags,
+    search_posts_by_tags,
+)
+from app.v1.services.like import set_like
+from app.v1.services.image import image_processor, find_shared_image, share_image
+from app.v1.services.timeline import fan_out_post, get_home_timeline
+from app.v1.services.trending import WINDOWS, get_trending_tags
+from app.v1.enums import PostStatus, ImageCronEnum, ImageVariantEnum
+from app.v1.storage import (
+    _generate_put_singed_url,
+    _generate_get_singed_url,
+    _generate_get_singed_urls,
+)
+from app.v1.services.comment import (
+    get_base_comment_and_count,
+    get_comment_tree,
+    update_reply_count,
+)
 from app.v1.utils import user_id_from_token_key
 from app.v1.utils import (
     api_response,
-    token_required,
+    principal_required,
+    get_pagination_args,
+    get_bool_arg,
+    get_id_list_arg,
+    paginate_query,
+    query_budget,
 )
 
 
 postRoute = Blueprint("posts", __name__, url_prefix="/posts")
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
 
 
 @postRoute.route("/<int:post_id>", methods=["GET"])
-@token_required
-def get_post(post_id: int, current_user: User):
+@query_budget(6)
+@principal_required
+def get_post(post_id: int, current_user: Principal):
     with db_session() as session:
         post = Post.query.get(post_id)
         if not post:
@@ -37,6 +64,8 @@ def get_post(post_id: int, current_user: User):
             include_user=True,
             include_like=True,
             include_comment=True,
+            include_image_url=get_bool_arg("include_image_url"),
+            image_variant=ImageVariantEnum.full.value,
         )
         current_app.logger.info(f"Post with id {post_id} retrieved successfully.")
         return api_response(
@@ -47,33 +76,33 @@ def get_post(post_id: int, current_user: User):
 
 
 @postRoute.route("/news-feed", methods=["GET"])
-@token_required
-def view_news_feed(current_user: User):
+@query_budget(6)
+@principal_required
+def view_news_feed(current_user: Principal):
 
     # Get pagination parameters from query string
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
+    page, per_page, cursor = get_pagination_args()
+    include_image_url = get_bool_arg("include_image_url")
 
     with db_session() as session:
-        posts = (
-            Post.query.filter_by(status=PostStatus.public.value, deleted=False)
-            .order_by(Post.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+        posts, pagination = get_home_timeline(
+            user_id=current_user.id,
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+            session=session,
         )
 
         news_feed = PostReadList(
-            posts=[
-                post.to_dict(
-                    current_user=current_user, include_user=True, include_like=True
-                )
-                for post in posts
-            ],
-            pagination=Pagination(
-                total=posts.total,
-                page=posts.page,
-                per_page=posts.per_page,
-                pages=posts.pages,
+            posts=Post.bulk_to_dict(
+                posts=posts,
+                current_user=current_user,
+                include_user=True,
+                include_like=True,
+                include_image_url=include_image_url,
+                image_variant=ImageVariantEnum.feed.value,
             ),
+            pagination=pagination,
         )
         current_app.logger.info("View news feed successfully.")
         return api_response(
@@ -84,14 +113,29 @@ def view_news_feed(current_user: User):
 
 
 @postRoute.route("/sign-url", methods=["POST"])
-@token_required
-def get_signed_url(current_user: User):
+@principal_required
+def get_signed_url(current_user: Principal):
     #   1. Validate also prepare data
     filename = request.form.get("filename", "default.png", type=str)
     expiration = request.form.get("expiration", 60, type=int)
+    content_hash = request.form.get("sha256", "", type=str).lower()
+    if content_hash and not SHA256_PATTERN.fullmatch(content_hash):
+        raise BadRequest("sha256 must be a hex encoded SHA-256 digest.")
+
+    #   2. Skip the upload of a content already stored: save the returned filename
+    if content_hash:
+        with db_session() as session:
+            shared_image = find_shared_image(session=session, content_hash=content_hash)
+            if shared_image:
+                return api_response(
+                    message="Image already uploaded.",
+                    data={"exists": True, "filename": shared_image.image_name},
+                    status=200,
+                )
 
-    #   2. Get presigned url information
+    #   3. Get presigned url information
     presigned_dict = _generate_put_singed_url(filename=filename, expiration=expiration)
+    presigned_dict["exists"] = False
 
     return api_response(
         message="Get signed url successfully.",
@@ -101,8 +145,8 @@ def get_signed_url(current_user: User):
 
 
 @postRoute.route("/save-image", methods=["POST"])
-@token_required
-def save_image(current_user: User):
+@principal_required
+def save_image(current_user: Principal):
     #   1. Validate also prepare data
     filename = request.form.get("filename", "default.png", type=str)
     if not filename:
@@ -115,7 +159,16 @@ def save_image(current_user: User):
             status=ImageCronEnum.unused.value,
         )
         session.add(image)
+        session.flush()
+        shared_image = find_shared_image(session=session, image_name=filename)
+        if shared_image:
+            share_image(image=image, source=shared_image, session=session)
         session.commit()
+        #   Resized variants are made in background, served once ready
+        if not shared_image:
+            image_processor.submit(
+                app=current_app._get_current_object(), image_id=image.id
+            )
 
         return api_response(
             message="Save image successfully.",
@@ -125,8 +178,8 @@ def save_image(current_user: User):
 
 
 @postRoute.route("/get-image", methods=["GET"])
-@token_required
-def get_image(current_user: User):
+@principal_required
+def get_image(current_user: Principal):
     image_id = request.form.get("image_id", type=int)
     with db_session() as session:
         image = session.query(ImageCron).filter(ImageCron.id == image_id).first()
@@ -136,14 +189,58 @@ def get_image(current_user: User):
     return api_response(message="Get image successfully.", status=200, data=singed_url)
 
 
+@postRoute.route("/images", methods=["GET"])
+@query_budget(4)
+@principal_required
+def get_images(current_user: Principal):
+    """Get signed urls of many images at once, by image ids and/or post ids"""
+    image_ids = get_id_list_arg("image_ids", max_length=settings.MAX_BATCH_IMAGES)
+    post_ids = get_id_list_arg("post_ids", max_length=settings.MAX_BATCH_IMAGES)
+    if not image_ids and not post_ids:
+        raise BadRequest("image_ids or post_ids is required.")
+    if len(image_ids) + len(post_ids) > settings.MAX_BATCH_IMAGES:
+        raise BadRequest(f"At most {settings.MAX_BATCH_IMAGES} images are allowed.")
+
+    #   1. Load all the images with a single query
+    with db_session() as session:
+        images = (
+            session.query(ImageCron.id, ImageCron.post_id, ImageCron.image_name)
+            .filter(or_(ImageCron.id.in_(image_ids), ImageCron.post_id.in_(post_ids)))
+            .all()
+        )
+
+    #   2. Sign (or reuse the signatures of) all the images
+    singed_urls = _generate_get_singed_urls(
+        filenames=[image_name for _, _, image_name in images]
+    )
+    by_id = {image_id: image_name for image_id, _, image_name in images}
+    by_post_id = {post_id: image_name for _, post_id, image_name in images if post_id}
+    return api_response(
+        message="Get images successfully.",
+        status=200,
+        data={
+            "images": {
+                image_id: singed_urls[by_id[image_id]]
+                for image_id in image_ids
+                if image_id in by_id
+            },
+            "posts": {
+                post_id: singed_urls[by_post_id[post_id]]
+                for post_id in post_ids
+                if post_id in by_post_id
+            },
+        },
+    )
+
+
 @postRoute.route("/draft", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "10/hour",
     key_func=user_id_from_token_key,
     error_message="Too many create draft post attempts. Please try again later.",
 )
-def create_draft_post(current_user: User):
+def create_draft_post(current_user: Principal):
 
     with db_session() as session:
         #   1. Validate also prepare data
@@ -172,7 +269,7 @@ def create_draft_post(current_user: User):
         image.status = ImageCronEnum.used.value
 
         #   4. Create tag and attach tag to a post
-        create_tags(post=create_post, session=session)
+        create_tags(post=draft_post, session=session)
 
         session.commit()
         current_app.logger.info("Draft post created successfully.")
@@ -187,13 +284,13 @@ def create_draft_post(current_user: User):
 
 
 @postRoute.route("/", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "10/hour",
     key_func=user_id_from_token_key,
     error_message="Too many create post attempts. Please try again later.",
 )
-def create_post_public(current_user: User):
+def create_post_public(current_user: Principal):
 
     with db_session() as session:
         json_data = request.get_json()
@@ -223,6 +320,8 @@ def create_post_public(current_user: User):
         create_tags(post=created_post, session=session)
 
         session.commit()
+        fan_out_post(post=created_post, session=session)
+        index_post_tags(post=created_post, session=session)
         current_app.logger.info("Post created successfully.")
 
         return api_response(
@@ -233,13 +332,13 @@ def create_post_public(current_user: User):
 
 
 @postRoute.route("/<int:post_id>", methods=["PUT"])
-@token_required
+@principal_required
 @limiter.limit(
     "10/hour",
     key_func=user_id_from_token_key,
     error_message="Too many update post attempts. Please try again later.",
 )
-def update_post_public(post_id: int, current_user: User):
+def update_post_public(post_id: int, current_user: Principal):
 
     with db_session() as session:
         existing_post = Post.query.get(post_id)
@@ -278,6 +377,9 @@ def update_post_public(post_id: int, current_user: User):
         image.post_id = updated_post.id
         image.status = ImageCronEnum.used.value
         session.commit()
+        if updated_post.status == PostStatus.public.value:
+            fan_out_post(post=updated_post, session=session)
+            index_post_tags(post=updated_post, session=session)
 
         #   4. Deserialize User DB model to JSON response, convert from ORM-object to Pydantic object
         current_app.logger.info("Post updated successfully.")
@@ -289,13 +391,13 @@ def update_post_public(post_id: int, current_user: User):
 
 
 @postRoute.route("/<int:post_id>", methods=["DELETE"])
-@token_required
+@principal_required
 @limiter.limit(
     "10/hour",
     key_func=user_id_from_token_key,
     error_message="Too many delete post attempts. Please try again later.",
 )
-def delete_post(post_id: int, current_user: User):
+def delete_post(post_id: int, current_user: Principal):
 
     with db_session() as session:
         existing_post = session.get(Post, post_id)
@@ -307,6 +409,7 @@ def delete_post(post_id: int, current_user: User):
         #   Delete post
         existing_post.deleted = True
         session.commit()
+        unindex_post_tags(post=existing_post, session=session)
         return api_response(
             message="Post deleted successfully.",
             status=200,
@@ -314,25 +417,20 @@ def delete_post(post_id: int, current_user: User):
 
 
 @postRoute.route("/<int:post_id>/likes", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "60/minute",
     key_func=user_id_from_token_key,
     error_message="Too many like post attempts. Please try again later.",
 )
-def like_post(post_id: int, current_user: User):
+def like_post(post_id: int, current_user: Principal):
 
     with db_session() as session:
         post = Post.query.get(post_id)
         if not post:
             raise NotFound(f"Post {post_id} not found.")
-        is_like = Like.query.filter_by(user_id=current_user.id, post_id=post_id).first()
-        if is_like:
-            raise Conflict("You have already liked this post.")
         #   Like a post
-        like = Like(user_id=current_user.id, post_id=post_id)
-        session.add(like)
-        session.commit()
+        set_like(post_id=post_id, user_id=current_user.id, liked=True, session=session)
         current_app.logger.info(
             f"User {current_user.id} liked post {post_id} successfully."
         )
@@ -340,23 +438,19 @@ def like_post(post_id: int, current_user: User):
 
 
 @postRoute.route("/<int:post_id>/unlikes", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "60/minute",
     key_func=user_id_from_token_key,
     error_message="Too many unlike post attempts. Please try again later.",
 )
-def unlike_post(post_id: int, current_user: User):
+def unlike_post(post_id: int, current_user: Principal):
     with db_session() as session:
         post = Post.query.get(post_id)
         if not post:
             raise NotFound(f"Post {post_id} not found.")
-        is_like = Like.query.filter_by(user_id=current_user.id, post_id=post_id).first()
-        if not is_like:
-            raise Conflict("You have not liked this post yet.")
         #   Unlike a post
-        session.delete(is_like)
-        session.commit()
+        set_like(post_id=post_id, user_id=current_user.id, liked=False, session=session)
         current_app.logger.info(
             f"User {current_user.id} unliked post {post_id} successfully."
         )
@@ -364,58 +458,64 @@ def unlike_post(post_id: int, current_user: User):
 
 
 @postRoute.route("/<int:post_id>/comments", methods=["GET"])
-@token_required
-def list_base_comments(post_id: int, current_user: User):
+@query_budget(5)
+@principal_required
+def list_base_comments(post_id: int, current_user: Principal):
 
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
+    page, per_page, cursor = get_pagination_args()
 
     with db_session() as session:
         post = session.query(Post).where(Post.id == post_id).first()
         if not post:
             raise NotFound(f"Post {post_id} not found!")
 
-        comments = get_base_comment_and_count(post_id=post_id, session=session)
+        results, pagination = get_base_comment_and_count(
+            post_id=post_id,
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+            session=session,
+        )
+        comments = CommentReadList(
+            comment_tree=[CommentTree.model_validate(result) for result in results],
+            pagination=pagination,
+        )
 
         current_app.logger.info(f"View all comments for post {post_id} successfully.")
         return api_response(
-            data=comments, message="View comments successfully.", status=200
+            data=comments.model_dump(),
+            message="View comments successfully.",
+            status=200,
         )
 
 
 @postRoute.route("/<int:post_id>/comments/<int:comment_id>", methods=["GET"])
-@token_required
-def list_child_comments(post_id: int, comment_id: int, current_user: User):
+@query_budget(5)
+@principal_required
+def list_child_comments(post_id: int, comment_id: int, current_user: Principal):
 
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
+    page, per_page, cursor = get_pagination_args()
 
     with db_session() as session:
         post = session.query(Post).where(Post.id == post_id).first()
         if not post:
             raise NotFound(f"Post {post_id} not found!")
 
-        results = (
-            session.query(Comment)
-            .where(
+        results, pagination = paginate_query(
+            query=session.query(Comment).where(
                 Comment.parent_comment_id == comment_id,
                 Comment.post_id == post_id,
                 Comment.parent_comment_id is not None,
-            )
-            .order_by(Comment.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+            ),
+            columns=(Comment.created_at, Comment.id),
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
         )
-        if not results:
-            raise NotFound("Comments not found!")
-
+        #   An empty page (no replies, or past the last page) is not an error
         comments = CommentReadList(
             comment_tree=[CommentTree.model_validate(result) for result in results],
-            pagination=Pagination(
-                total=results.total,
-                page=results.page,
-                per_page=results.per_page,
-                pages=results.pages,
-            ),
+            pagination=pagination,
         )
         current_app.logger.info(
             f"View child comments of comment {comment_id} successfully."
@@ -427,15 +527,44 @@ def list_child_comments(post_id: int, comment_id: int, current_user: User):
         )
 
 
+@postRoute.route("/<int:post_id>/comments/<int:comment_id>/tree", methods=["GET"])
+@query_budget(5)
+@principal_required
+def view_comment_tree(post_id: int, comment_id: int, current_user: Principal):
+
+    depth = request.args.get("depth", 3, type=int)
+    breadth = request.args.get("breadth", 10, type=int)
+    if depth < 0 or breadth < 1:
+        raise BadRequest("depth must be positive and breadth greater than 0.")
+
+    with db_session() as session:
+        tree = get_comment_tree(
+            post_id=post_id,
+            comment_id=comment_id,
+            depth=min(depth, settings.COMMENT_TREE_MAX_DEPTH),
+            breadth=min(breadth, settings.COMMENT_TREE_MAX_BREADTH),
+            session=session,
+        )
+        if not tree:
+            raise NotFound(f"Comment {comment_id} not found!")
+
+        current_app.logger.info(f"View comment tree {comment_id} successfully.")
+        return api_response(
+            data=CommentNode.model_validate(tree).model_dump(),
+            message="View comment tree successfully.",
+            status=200,
+        )
+
+
 @postRoute.route("/<int:post_id>/comments", methods=["POST"])
 @postRoute.route("/<int:post_id>/comments/<int:comment_id>", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "30/hour",
     key_func=user_id_from_token_key,
     error_message="Too many comment on post attempts. Please try again later.",
 )
-def comment_on_post(post_id: int, current_user: User, comment_id: int = None):
+def comment_on_post(post_id: int, current_user: Principal, comment_id: int = None):
     json_data = request.get_json()
 
     content = json_data.get("content").strip()
@@ -455,9 +584,18 @@ def comment_on_post(post_id: int, current_user: User, comment_id: int = None):
             "content": content,
         }
         if comment_id:
+            parent_comment = (
+                session.query(Comment)
+                .where(Comment.id == comment_id, Comment.post_id == post_id)
+                .first()
+            )
+            if not parent_comment:
+                raise NotFound(f"Comment {comment_id} not found!")
             comment_to_add["parent_comment_id"] = comment_id
+            update_reply_count(comment_id=comment_id, delta=1, session=session)
         comment = Comment(**comment_to_add)
         session.add(comment)
+        update_post_counts(post_id=post_id, comment_delta=1, session=session)
         session.commit()
 
         current_app.logger.info(f"Comment on post {post_id} successfully.")
@@ -465,13 +603,13 @@ def comment_on_post(post_id: int, current_user: User, comment_id: int = None):
 
 
 @postRoute.route("/<int:post_id>/comments/<int:comment_id>", methods=["PUT"])
-@token_required
+@principal_required
 @limiter.limit(
     "30/hour",
     key_func=user_id_from_token_key,
     error_message="Too many update comment attempts. Please try again later.",
 )
-def update_comment(post_id: int, current_user: User, comment_id: int = None):
+def update_comment(post_id: int, current_user: Principal, comment_id: int = None):
 
     json_data = request.get_json()
 
@@ -497,13 +635,13 @@ def update_comment(post_id: int, current_user: User, comment_id: int = None):
 
 
 @postRoute.route("/<int:post_id>/comments/<int:comment_id>", methods=["DELETE"])
-@token_required
+@principal_required
 @limiter.limit(
     "30/hour",
     key_func=user_id_from_token_key,
     error_message="Too many delete comment attempts. Please try again later.",
 )
-def delete_comment_from_post(post_id: int, comment_id: int, current_user: User):
+def delete_comment_from_post(post_id: int, comment_id: int, current_user: Principal):
 
     with db_session() as session:
         post = session.query(Post).where(Post.id == post_id).first()
@@ -516,48 +654,81 @@ def delete_comment_from_post(post_id: int, comment_id: int, current_user: User):
             raise NotFound(f"Comment {comment_id} not found!")
         #   Delete comment
         session.delete(comment)
+        update_post_counts(post_id=comment.post_id, comment_delta=-1, session=session)
+        if comment.parent_comment_id:
+            update_reply_count(
+                comment_id=comment.parent_comment_id, delta=-1, session=session
+            )
         session.commit()
         current_app.logger.info(f"Delete comment {comment_id} successfully.")
         return api_response(message="Delete comment successfully.")
 
 
+@postRoute.route("/tags/trending", methods=["GET"])
+@query_budget(3)
+@principal_required
+def view_trending_tags(current_user: Principal):
+    window = request.args.get("window", None, type=str)
+    limit = request.args.get("limit", 10, type=int)
+    if window is not None and window not in WINDOWS:
+        raise BadRequest(f"window must be one of {', '.join(WINDOWS)}.")
+    if limit < 1:
+        raise BadRequest("limit must be a positive integer.")
+
+    windows = [window] if window else list(WINDOWS)
+    trending_tags = {
+        name: get_trending_tags(
+            window=name, limit=min(limit, settings.TRENDING_TOP_SIZE)
+        )
+        for name in windows
+    }
+    current_app.logger.info("View trending tags successfully.")
+    return api_response(
+        data=trending_tags, message="View trending tags successfully.", status=200
+    )
+
+
 @postRoute.route("/search", methods=["GET"])
-@token_required
+@query_budget(5)
+@principal_required
 @limiter.limit(
     "10/minute",
     key_func=user_id_from_token_key,
     error_message="Too many search post attempts. Please try again later.",
 )
-def search_post(current_user: User):
-    tag = request.args.get("tag", "", type=str)
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
+def search_post(current_user: Principal):
+    #   One tag (`tag=sun`) or many (`tags=sun,beach`), `match=any` for OR searches
+    tag = request.args.get("tags", request.args.get("tag", ""), type=str)
+    tag_names = [name.strip().lower() for name in tag.split(",") if name.strip()]
+    tag_names = list(dict.fromkeys(tag_names))
+    if not tag_names:
+        raise BadRequest("Tag is required.")
+    if len(tag_names) > settings.TAG_SEARCH_MAX_TAGS:
+        raise BadRequest(f"At most {settings.TAG_SEARCH_MAX_TAGS} tags are allowed.")
+    match_all = request.args.get("match", "all", type=str) != "any"
+    page, per_page, cursor = get_pagination_args()
+    include_image_url = get_bool_arg("include_image_url")
     with db_session() as session:
-        posts = (
-            session.query(Post)
-            .join(PostTag, Post.id == PostTag.post_id)
-            .join(Tag, Tag.id == PostTag.tag_id)
-            .filter(Tag.tag_name == tag)
-            .order_by(Post.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+        posts, pagination = search_posts_by_tags(
+            tag_names=tag_names,
+            match_all=match_all,
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+            session=session,
         )
 
         posts_by_tag = PostReadList(
-            posts=[
-                post.to_dict(
-                    current_user=current_user,
-                    include_user=True,
-                    include_like=True,
-                    include_comment=True,
-                )
-                for post in posts
-            ],
-            pagination=Pagination(
-                total=posts.total,
-                page=posts.page,
-                per_page=posts.per_page,
-                pages=posts.pages,
+            posts=Post.bulk_to_dict(
+                posts=posts,
+                current_user=current_user,
+                include_user=True,
+                include_like=True,
+                include_comment=True,
+                include_image_url=include_image_url,
+                image_variant=ImageVariantEnum.feed.value,
             ),
+            pagination=pagination,
         )
         current_app.logger.info(f"Search post by tag {tag} successfully.")
         return api_response(
@@ -0,0 +1,44 @@
+import os
+import time
+
+from flask import Blueprint, request, send_file
+from werkzeug.exceptions import Forbidden, NotFound, RequestEntityTooLarge
+
+from app.core.config import settings
+from app.core.extensions import limiter
+from app.v1.storage import backend
+
+storageRoute = Blueprint("storage", __name__, url_prefix="/storage")
+
+
+@storageRoute.route("/<path:path>", methods=["GET", "PUT"])
+@limiter.exempt
+def local_file(path: str):
+    """
+    Read (GET) or upload (PUT) a file of the local storage backend, with the
+    signed urls it generates in place of Google Cloud Storage ones
+    """
+    expires_at = request.args.get("expires", 0, type=int)
+    signature = request.args.get("signature", "", type=str)
+    content_type = (request.content_type or "") if request.method == "PUT" else ""
+    if not backend.verify(request.method, path, expires_at, signature, content_type):
+        raise Forbidden("Invalid or expired signature.")
+    file_path = backend.file_path(path)
+    if file_path is None:
+        raise NotFound(f"File {path} not found!")
+
+    if request.method == "GET":
+        if not os.path.isfile(file_path):
+            raise NotFound(f"File {path} not found!")
+        return send_file(
+            file_path, conditional=True, max_age=max(expires_at - int(time.time()), 0)
+        )
+
+    max_size = settings.LOCAL_STORAGE_MAX_SIZE
+    if (request.content_length or 0) > max_size:
+        raise RequestEntityTooLarge(f"File {path} is over {max_size} bytes.")
+    try:
+        backend.write_stream(path, request.stream, max_size=max_size)
+    except ValueError as error:
+        raise RequestEntityTooLarge(str(error))
+    return "", 200
@@ -7,21 +7,25 @@ from flask_jwt_extended import jwt_required
 from app.core.extensions import limiter
 from app.v1.utils import user_id_from_token_key
 from app.core.database import db_session
-from app.v1.utils import api_response, token_required, cprofile
+from app.v1.utils import api_response, token_required, principal_required
+from app.v1.utils import get_pagination_args, get_bool_arg, paginate_query
+from app.v1.utils import query_budget
 from app.v1.models import User, Post, Follow
-from app.v1.schemas.base import Pagination
-from app.v1.schemas.user import UserEdit, UserRead, UserReadList
-from app.v1.schemas.post import PostReadList, PostRead
+from app.v1.schemas.user import UserEdit, UserRead, UserReadList, Principal
+from app.v1.schemas.post import PostReadList
 from app.v1.schemas.follow import FollowUser
 from app.v1.services.user import check_user_edit
-from app.v1.services.follow import create_follow_user
+from app.v1.services.follow import create_follow_user, delete_follow_user
+from app.v1.services.timeline import invalidate_timeline
+from app.v1.services.user_search import index_user, search_users
+from app.v1.services.principal import invalidate_principal
+from app.v1.enums import ImageVariantEnum
 
 userRoute = Blueprint("users", __name__, url_prefix="/users")
 
 
 @userRoute.route("/me", methods=["GET"])
 @token_required
-@cprofile
 def view_profile(current_user: User):
     try:
         user_profile = current_user.to_dict(
@@ -58,6 +62,9 @@ def edit_profile(current_user: User):
         ).items():
             setattr(current_user, field_to_update, value)
         session.commit()
+        invalidate_principal(user_id=current_user.id)
+        if parsed_data.username:
+            index_user(user=current_user)
 
         current_app.logger.info(
             f"User {current_user.username} updated profile successfully."
@@ -71,8 +78,9 @@ def edit_profile(current_user: User):
 
 
 @userRoute.route("/<int:user_id>/profile", methods=["GET"])
-@token_required
-def view_other_profile(user_id: int, current_user: User):
+@query_budget(4)
+@principal_required
+def view_other_profile(user_id: int, current_user: Principal):
     user = User.query.get(user_id)
     if not user:
         raise NotFound(f"User with id {user_id} not found.")
@@ -81,26 +89,31 @@ def view_other_profile(user_id: int, current_user: User):
 
 
 @userRoute.route("/<int:user_id>/posts", methods=["GET"])
-@token_required
-def get_list_post(user_id: int, current_user: User):
+@query_budget(7)
+@principal_required
+def get_list_post(user_id: int, current_user: Principal):
     with db_session() as session:
         # Get pagination parameters from query string
-        page = request.args.get("page", 1, type=int)
-        per_page = request.args.get("per_page", 10, type=int)
-        posts = (
-            Post.query.filter(Post.user_id == user_id, Post.deleted == False)
-            .order_by(Post.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+        page, per_page, cursor = get_pagination_args()
+        posts, pagination = paginate_query(
+            query=Post.query.filter(Post.user_id == user_id, Post.deleted == False),
+            columns=(Post.created_at, Post.id),
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
         )
 
         post_list = PostReadList(
-            posts=[PostRead.from_post(post, include_user=True) for post in posts.items],
-            pagination=Pagination(
-                page=posts.page,
-                per_page=posts.per_page,
-                total=posts.total,
-                pages=posts.pages,
+            posts=Post.bulk_to_dict(
+                posts=posts,
+                current_user=current_user,
+                include_user=True,
+                include_like=True,
+                include_comment=True,
+                include_image_url=get_bool_arg("include_image_url"),
+                image_variant=ImageVariantEnum.thumbnail.value,
             ),
+            pagination=pagination,
         )
         current_app.logger.info(
             f"Retrieved all posts for user {current_user.id} successfully."
@@ -113,13 +126,13 @@ def get_list_post(user_id: int, current_user: User):
 
 
 @userRoute.route("/<int:user_id>/follow", methods=["POST"])
-@token_required
+@principal_required
 @limiter.limit(
     "20/hour",
     key_func=user_id_from_token_key,
     error_message="Too many follow user attempts. Please try again later.",
 )
-def follow_user(user_id: int, current_user: User):
+def follow_user(user_id: int, current_user: Principal):
 
     with db_session() as session:
         user = User.query.get(user_id)
@@ -138,18 +151,19 @@ def follow_user(user_id: int, current_user: User):
             session=session,
         )
         session.commit()
+        invalidate_timeline(user_id=current_user.id)
         current_app.logger.info(f"You followed user {user.username} successfully.")
         return api_response(message="Follow user successfully.")
 
 
 @userRoute.route("/<int:user_id>/unfollow", methods=["DELETE"])
-@token_required
+@principal_required
 @limiter.limit(
     "20/hour",
     key_func=user_id_from_token_key,
     error_message="Too many unfollow user attempts. Please try again later.",
 )
-def unfollow_user(user_id: int, current_user: User):
+def unfollow_user(user_id: int, current_user: Principal):
 
     with db_session() as session:
         user = User.query.get(user_id)
@@ -163,43 +177,41 @@ def unfollow_user(user_id: int, current_user: User):
         if not is_following:
             raise Conflict("You have not followed this user yet.")
 
-        session.delete(is_following)
+        delete_follow_user(follow=is_following, session=session)
         session.commit()
+        invalidate_timeline(user_id=current_user.id)
         current_app.logger.info(f"You unfollowed user {user.username} successfully.")
         return api_response(message="Unfollow user successfully.")
 
 
 @userRoute.route("/<int:user_id>/followers", methods=["GET"])
-@jwt_required
+@query_budget(5)
+@jwt_required()
 def get_follower(user_id: int):
     """Get all users who follow the user {user_id}"""
 
     with db_session() as session:
 
         # Get pagination parameters from query string
-        page = request.args.get("page", 1, type=int)
-        per_page = request.args.get("per_page", 10, type=int)
+        page, per_page, cursor = get_pagination_args()
 
         user = User.query.get(user_id)
         if not user:
             raise NotFound("Follower not found!")
 
-        results = (
-            session.query(User)
+        results, pagination = paginate_query(
+            query=session.query(User)
             .join(Follow, Follow.follower_id == User.id)
-            .filter(Follow.following_id == user_id)
-            .order_by(User.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+            .filter(Follow.following_id == user_id),
+            columns=(User.created_at, User.id),
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
         )
 
         followers = UserReadList(
             users=[UserRead.model_validate(result) for result in results],
-            pagination=Pagination(
-                page=results.page,
-                per_page=results.per_page,
-                total=results.total,
-                pages=results.pages,
-            ),
+            pagination=pagination,
         )
         current_app.logger.info(
             f"Retrieved all followers for user {user.id} successfully."
@@ -212,35 +224,32 @@ def get_follower(user_id: int):
 
 
 @userRoute.route("/<int:user_id>/followings", methods=["GET"])
-@token_required
-def get_following(user_id: int, current_user: User):
+@query_budget(5)
+@principal_required
+def get_following(user_id: int, current_user: Principal):
     """Get all users who the user {user_id} followed"""
 
     with db_session() as session:
         # Get pagination parameters from query string
-        page = request.args.get("page", 1, type=int)
-        per_page = request.args.get("per_page", 10, type=int)
+        page, per_page, cursor = get_pagination_args()
 
         user = User.query.get(user_id)
         if not user:
             raise NotFound("Follower not found!")
 
-        results = (
-            session.query(User)
+        results, pagination = paginate_query(
+            query=session.query(User)
             .join(Follow, Follow.following_id == User.id)
-            .filter(Follow.follower_id == user_id)
-            .order_by(User.created_at.desc())
-            .paginate(page=page, per_page=per_page)
+            .filter(Follow.follower_id == user_id),
+            columns=(User.created_at, User.id),
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
         )
 
         followers = UserReadList(
             users=[UserRead.model_validate(result) for result in results],
-            pagination=Pagination(
-                page=results.page,
-                per_page=results.per_page,
-                total=results.total,
-                pages=results.pages,
-            ),
+            pagination=pagination,
         )
         current_app.logger.info(
             f"Retrieved all followings for user {user.id} successfully."
@@ -253,28 +262,27 @@ def get_following(user_id: int, current_user: User):
 
 
 @userRoute.route("/search", methods=["GET"])
-@token_required
+@query_budget(4)
+@principal_required
 @limiter.limit(
     "30/minute",
     key_func=user_id_from_token_key,
     error_message="Too many search user attempts. Please try again later.",
 )
-def search_user(current_user: User):
+def search_user(current_user: Principal):
     search_query = request.args.get("search", "", type=str)
-    page = request.args.get("page", 1, type=int)
-    per_page = request.args.get("per_page", 10, type=int)
+    page, per_page, cursor = get_pagination_args()
     with db_session() as session:
-        users = User.query.filter(User.username.like(f"%{search_query}%")).paginate(
-            page=page, per_page=per_page
+        users, pagination = search_users(
+            query=search_query,
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+            session=session,
         )
         results = UserReadList(
             users=[UserRead.model_validate(user) for user in users],
-            pagination=Pagination(
-                total=users.total,
-                page=users.page,
-                per_page=users.per_page,
-                pages=users.pages,
-            ),
+            pagination=pagination,
         )
         return api_response(
             data=results.model_dump(), message="Search user successfully.", status=200
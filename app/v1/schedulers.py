@@ -1,41 +1,132 @@
-import os
-from sqlalchemy import delete
+import time
+from sqlalchemy import delete, select
 
 from app.core.config import settings
-from app.v1.models import ImageCron
+from app.v1.models import ImageCron, ImageVariant
 from app.v1.enums import ImageCronEnum
-from app.v1.storage import _storage_delete
+from app.v1.storage import _storage_delete_many
 from app.core.database import db_session
+from app.core.redis_client import redis_client
+from app.v1.services.like import flush_likes
 
 
 def scheduler_delete_image(app):
     """
-    Delete all unused image uploaded by users
-    - Delete in Database: ImageCron table.
-    - Delete on Google Cloud Storage.
+    Delete unused images uploaded by users (and their resized variants), older
+    than `IMAGE_GC_MIN_AGE`.
+    Only one instance runs at a time. Images are read by primary key batches,
+    their files deleted on Google Cloud Storage concurrently, then only the rows
+    of the confirmed deletes are removed from the ImageCron table: failed files
+    are retried by the next run.
     """
     with app.app_context():
+        token = redis_client.acquire_lock(
+            "delete_images", expires_in=settings.IMAGE_GC_LOCK_TTL
+        )
+        if not token:
+            return
+        try:
+            #   Stop before the lock expires, the next run goes on from the start
+            deadline = time.monotonic() + settings.IMAGE_GC_LOCK_TTL * 0.8
+            cutoff = int(time.time()) - settings.IMAGE_GC_MIN_AGE
+            last_id, deleted, failed = 0, 0, 0
+            while time.monotonic() < deadline:
+                with db_session() as session:
+                    images = (
+                        session.query(ImageCron.id, ImageCron.image_name)
+                        .filter(
+                            ImageCron.id > last_id,
+                            ImageCron.status == ImageCronEnum.unused.value,
+                            ImageCron.created_at < cutoff,
+                        )
+                        .order_by(ImageCron.id)
+                        .limit(settings.IMAGE_GC_BATCH_SIZE)
+                        .all()
+                    )
+                if not images:
+                    break
+                last_id = images[-1].id
 
-        with db_session() as session:
-            image_names = (
-                session.query(ImageCron.image_name)
-                .filter(ImageCron.status == ImageCronEnum.unused.value)
-                .all()
-            )
+                with db_session() as session:
+                    files = {image.id: [image.image_name] for image in images}
+                    for image_id, image_name in session.query(
+                        ImageVariant.image_id, ImageVariant.image_name
+                    ).filter(ImageVariant.image_id.in_(files)):
+                        files[image_id].append(image_name)
+                    #   Files are shared by identical uploads: they are deleted
+                    #   with the last image referencing them
+                    shared_names = {
+                        image_name
+                        for (image_name,) in session.query(ImageCron.image_name)
+                        .filter(
+                            ImageCron.image_name.in_(
+                                [image.image_name for image in images]
+                            ),
+                            ImageCron.id.notin_(files),
+                        )
+                        .distinct()
+                    }
+                for image in images:
+                    if image.image_name in shared_names:
+                        files[image.id] = []
 
-            # Get IDs or names of successfully deleted images
-            deleted_image_names = []
+                #   No transaction is kept open during the requests to the bucket
+                deleted_names = set(
+                    _storage_delete_many(
+                        filenames=[name for names in files.values() for name in names],
+                        max_workers=settings.IMAGE_GC_WORKERS,
+                    )
+                )
+                #   Rows are kept until the original and all its variants are gone
+                deleted_ids = [
+                    image_id
+                    for image_id, names in files.items()
+                    if deleted_names.issuperset(names)
+                ]
+                if deleted_ids:
+                    unused_ids = select(ImageCron.id).where(
+                        ImageCron.id.in_(deleted_ids),
+                        ImageCron.status == ImageCronEnum.unused.value,
+                    )
+                    with db_session() as session:
+                        session.execute(
+                            delete(ImageVariant).where(
+                                ImageVariant.image_id.in_(unused_ids)
+                            )
+                        )
+                        session.execute(
+                            delete(ImageCron).where(
+                                ImageCron.id.in_(deleted_ids),
+                                ImageCron.status == ImageCronEnum.unused.value,
+                            )
+                        )
+                        session.commit()
+                deleted += len(deleted_ids)
+                failed += len(images) - len(deleted_ids)
+            app.logger.info(f"Deleted {deleted} unused images, {failed} failed.")
+        finally:
+            redis_client.release_lock("delete_images", token)
 
-            #   Delete on the Google Cloud Storage
-            for image_name in image_names:
-                gcs_filename = os.path.join(settings.BUCKET_FOLDER, image_name[0])
-                _storage_delete(gcs_filename)
-                deleted_image_names.append(image_name[0])
 
-            #   Delete in Database (Only delete images that have been successfully deleted on GCS)
-            if deleted_image_names:
-                statement = delete(ImageCron).where(
-                    ImageCron.image_name.in_(deleted_image_names)
-                )
-                session.execute(statement)
+def scheduler_flush_likes(app):
+    """
+    Write likes buffered in Redis to the database in batches.
+    Only one instance flushes at a time, batches left by a failed run are retried.
+    """
+    with app.app_context():
+        token = redis_client.acquire_lock("flush_likes", expires_in=60)
+        if not token:
+            return
+        try:
+            claimed = redis_client.claim_pending_likes(
+                batch_size=settings.LIKE_FLUSH_BATCH_SIZE
+            )
+            if not claimed:
+                return
+            with db_session() as session:
+                flush_likes(likes=claimed, session=session)
                 session.commit()
+            redis_client.complete_pending_likes(post_ids=list(claimed))
+            app.logger.info(f"Flushed buffered likes of {len(claimed)} posts.")
+        finally:
+            redis_client.release_lock("flush_likes", token)
@@ -6,3 +6,8 @@ class Pagination(BaseModel):
     per_page: int
     total: int
     pages: int
+
+
+class CursorPagination(BaseModel):
+    per_page: int
+    next_cursor: str | None = None
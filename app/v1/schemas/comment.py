@@ -2,7 +2,7 @@ from datetime import datetime
 
 from pydantic import BaseModel
 
-from app.v1.schemas.base import Pagination
+from app.v1.schemas.base import Pagination, CursorPagination
 
 
 class CommentTree(BaseModel):
@@ -13,10 +13,16 @@ class CommentTree(BaseModel):
     post_id: int
     content: str
     parent_comment_id: int | None = None
+    reply_count: int = 0
 
     model_config = {"from_attributes": True}
 
 
+class CommentNode(CommentTree):
+    #   Newest replies first, `reply_count` tells if some were left out
+    replies: list["CommentNode"] = []
+
+
 class CommentReadList(BaseModel):
     comment_tree: list[CommentTree]
-    pagination: Pagination
+    pagination: Pagination | CursorPagination
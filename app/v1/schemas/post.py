@@ -5,7 +5,7 @@ from werkzeug.exceptions import NotFound
 
 from app.v1.schemas.user import UserRead
 from app.v1.models import User, Post
-from app.v1.schemas.base import Pagination
+from app.v1.schemas.base import Pagination, CursorPagination
 from app.v1.enums import PostStatus
 
 
@@ -48,7 +48,7 @@ class PostRead(BaseModel):
 
 class PostReadList(BaseModel):
     posts: list
-    pagination: Pagination
+    pagination: Pagination | CursorPagination
 
 
 class PostEdit(BaseModel):
@@ -6,7 +6,7 @@ from werkzeug.exceptions import BadRequest
 
 from app.v1.models.follow import Follow
 from app.v1.models.user import User
-from app.v1.schemas.base import Pagination
+from app.v1.schemas.base import Pagination, CursorPagination
 
 
 class UserCreate(BaseModel):
@@ -47,6 +47,18 @@ class UserRead(BaseModel):
     }  #   Accept input as ORM-object, not just from a dict
 
 
+class Principal(BaseModel):
+    """Authenticated user, enough for handlers that do not need the whole row"""
+
+    id: int
+    username: str
+    email: str
+    fullname: str | None = None
+    profile_picture: str | None = None
+
+    model_config = {"from_attributes": True, "frozen": True}
+
+
 class UserLoginResponse(BaseModel):
     access_token: str
     refresh_token: str
@@ -62,4 +74,4 @@ class UserEdit(BaseModel):
 
 class UserReadList(BaseModel):
     users: list[UserRead]
-    pagination: Pagination
+    pagination: Pagination | CursorPagination
@@ -1,4 +1,7 @@
-from werkzeug.exceptions import Conflict, Unauthorized
+from flask import current_app
+from werkzeug.exceptions import Conflict, Unauthorized, ServiceUnavailable
+
+from app.core.database import db_session
 
 from app.v1.schemas.user import UserCreate
 from app.v1.models.user import User
@@ -19,4 +22,14 @@ def _check_user_login(username: str, password: str) -> User:
     user = User.query.filter_by(username=username).first()
     if not user or not user.check_password(password):
         raise Unauthorized(f"Incorrect username or password!")
+    #   The password is only known at login: upgrade hashes made with outdated
+    #   parameters now, a busy hashing pool just delays it to a next login
+    if user.password_needs_rehash():
+        try:
+            with db_session() as session:
+                user.set_password(password)
+                session.commit()
+                session.refresh(user)
+        except ServiceUnavailable as error:
+            current_app.logger.warning(f"Rehash password of user {user.id}: {error}")
     return user
@@ -1,36 +1,117 @@
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-
-
-def get_base_comment_and_count(post_id: int, session: Session):
-    raw_sql = text(
-        """
-        WITH child_cte AS (
-            SELECT 
-                parent_comment_id,
-                COUNT(*) AS reply_count
-            FROM comments
-            WHERE parent_comment_id IS NOT NULL
-            GROUP BY parent_comment_id
-        )
-        SELECT 
-            base.id,
-            base.created_at,
-            base.modified_at,
-            base.content,
-            base.user_id,
-            base.post_id,
-            base.parent_comment_id,
-            COALESCE(child_cte.reply_count, 0) AS reply_count
-        FROM comments AS base
-        LEFT JOIN child_cte ON base.id = child_cte.parent_comment_id
-        WHERE 
-            base.parent_comment_id IS NULL 
-        AND
-            base.post_id = :post_id;
+from sqlalchemy import select, func, literal
+from sqlalchemy.orm import Session, aliased
+
+from app.v1.models import Comment
+from app.v1.schemas.base import Pagination, CursorPagination
+from app.v1.utils import paginate_query
+
+
+def get_base_comment_and_count(
+    post_id: int, page: int, per_page: int, session: Session, cursor: str = None
+) -> tuple[list[Comment], Pagination | CursorPagination]:
+    """
+    Get a page of the base (top level) comments of a post, newest first, with the
+    number of replies of each one read from the `reply_count` counter.
+
+    Args:
+        post_id: Post of the comments
+        page: Page number, starts at 1 (page mode)
+        per_page: Number of comments per page
+        session: Database session
+        cursor: Cursor of the page (cursor mode)
+
+    Returns:
+        tuple[list[Comment], Pagination | CursorPagination]: Comments and pagination info
+    """
+    return paginate_query(
+        query=session.query(Comment).filter(
+            Comment.post_id == post_id, Comment.parent_comment_id.is_(None)
+        ),
+        columns=(Comment.created_at, Comment.id),
+        page=page,
+        per_page=per_page,
+        cursor=cursor,
+    )
+
+
+def update_reply_count(comment_id: int, delta: int, session: Session) -> None:
+    """Atomically shift the denormalized reply counter of a comment"""
+    session.query(Comment).filter(Comment.id == comment_id).update(
+        {Comment.reply_count: Comment.reply_count + delta}, synchronize_session=False
+    )
+
+
+def _tree_columns(model) -> list:
+    return [
+        model.id,
+        model.created_at,
+        model.modified_at,
+        model.user_id,
+        model.post_id,
+        model.content,
+        model.parent_comment_id,
+        model.reply_count,
+    ]
+
+
+def get_comment_tree(
+    post_id: int, comment_id: int, depth: int, breadth: int, session: Session
+) -> dict | None:
     """
+    Get the subtree of a comment with a single recursive query.
+
+    The recursive CTE walks the replies down to `depth` levels, then ROW_NUMBER
+    keeps the `breadth` newest replies of each comment (MySQL does not allow
+    window functions inside the recursive part). Replies of a dropped comment
+    are dropped too when the tree is assembled.
+
+    Args:
+        post_id: Post of the comment
+        comment_id: Root of the subtree
+        depth: Number of reply levels below the root
+        breadth: Max number of replies per comment
+        session: Database session
+
+    Returns:
+        dict | None: Root comment with nested `replies`, None if not found
+    """
+    tree = (
+        select(*_tree_columns(Comment), literal(0).label("depth"))
+        .where(Comment.id == comment_id, Comment.post_id == post_id)
+        .cte("comment_tree", recursive=True)
     )
+    reply = aliased(Comment)
+    tree = tree.union_all(
+        select(*_tree_columns(reply), tree.c.depth + 1)
+        .join(tree, reply.parent_comment_id == tree.c.id)
+        .where(tree.c.depth < depth)
+    )
+    ranked = select(
+        tree,
+        func.row_number()
+        .over(
+            partition_by=tree.c.parent_comment_id,
+            order_by=(tree.c.created_at.desc(), tree.c.id.desc()),
+        )
+        .label("position"),
+    ).subquery()
+    rows = session.execute(
+        select(ranked)
+        .where(ranked.c.position <= breadth)
+        .order_by(ranked.c.depth, ranked.c.position)
+    ).all()
 
-    result = session.execute(raw_sql, {"post_id": post_id})
-    comments = result.fetchall()
-    return [dict(row._mapping) for row in comments]
+    #   Rows come level by level, so parents are always seen before their replies
+    nodes, root = {}, None
+    for row in rows:
+        node = dict(row._mapping)
+        node["replies"] = []
+        if node.pop("depth") == 0:
+            root = node
+        elif node["parent_comment_id"] in nodes:
+            nodes[node["parent_comment_id"]]["replies"].append(node)
+        else:
+            continue
+        node.pop("position")
+        nodes[node["id"]] = node
+    return root
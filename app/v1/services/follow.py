@@ -1,13 +1,38 @@
 from sqlalchemy.orm import Session
 
-from app.v1.models import Follow
+from app.v1.models import Follow, User
 from app.v1.schemas.follow import FollowUser
 
 
+def _update_follow_counts(data: FollowUser, delta: int, session: Session) -> None:
+    #   Atomic in-place increments, no read-modify-write on the user rows
+    session.query(User).filter(User.id == data.follower_id).update(
+        {User.following_count: User.following_count + delta},
+        synchronize_session=False,
+    )
+    session.query(User).filter(User.id == data.following_id).update(
+        {User.follower_count: User.follower_count + delta},
+        synchronize_session=False,
+    )
+
+
 def create_follow_user(data: FollowUser, session: Session) -> None:
     follow = Follow(**data.model_dump())
     session.add(follow)
     session.flush()
+    _update_follow_counts(data=data, delta=1, session=session)
+
+
+def delete_follow_user(follow: Follow, session: Session) -> None:
+    session.delete(follow)
+    session.flush()
+    _update_follow_counts(
+        data=FollowUser(
+            follower_id=follow.follower_id, following_id=follow.following_id
+        ),
+        delta=-1,
+        session=session,
+    )
 
 
 def get_list_followers(user_id: int):
@@ -0,0 +1,236 @@
+#   References: https://pillow.readthedocs.io/en/stable/reference/ImageOps.html
+
+import io
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from PIL import Image, ImageOps
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import db_session
+from app.v1.enums import ImageProcessingEnum, ImageCronEnum
+from app.v1.models import ImageCron, ImageVariant
+from app.v1.storage import _storage_read, _storage_write, _storage_delete_many
+
+
+#   Pillow format name and file extension of each variant format
+_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+
+def render_variants(data: bytes) -> list[dict]:
+    """
+    Resize an image into every variant of `IMAGE_VARIANT_SIZES` and format of
+    `IMAGE_VARIANT_FORMATS`. The EXIF orientation is applied to the pixels, then
+    all metadata (EXIF, GPS, XMP, ...) is dropped, only the color profile is kept.
+    Images are never upscaled.
+
+    Args:
+        data: Content of the original image
+
+    Returns:
+        list[dict]: {"variant", "format", "extension", "data", "width", "height"}
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        icc_profile = original.info.get("icc_profile")
+    has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    variants = []
+    for variant, size in settings.IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        resized.info = {}
+        for format in settings.IMAGE_VARIANT_FORMATS:
+            pillow_format, extension = _FORMATS[format]
+            output = resized
+            if pillow_format == "JPEG" and output.mode != "RGB":
+                #   No transparency in JPEG, flatten on white
+                output = Image.new("RGB", resized.size, "white")
+                output.paste(resized, mask=resized.getchannel("A"))
+            buffer = io.BytesIO()
+            output.save(
+                buffer,
+                format=pillow_format,
+                quality=settings.IMAGE_VARIANT_QUALITY,
+                optimize=pillow_format == "JPEG",
+                icc_profile=icc_profile,
+            )
+            variants.append(
+                {
+                    "variant": variant,
+                    "format": format,
+                    "extension": extension,
+                    "data": buffer.getvalue(),
+                    "width": resized.width,
+                    "height": resized.height,
+                }
+            )
+    return variants
+
+
+def find_shared_image(
+    session: Session, content_hash: str = None, image_name: str = None
+) -> ImageCron | None:
+    """
+    Find a processed image of a post by content (SHA-256 hex digest) or by file,
+    which new uploads of the same content can share. Images of posts are never
+    garbage collected, so the shared files outlive the new references.
+    """
+    query = session.query(ImageCron).filter(
+        ImageCron.status == ImageCronEnum.used.value,
+        ImageCron.processing_status == ImageProcessingEnum.ready.value,
+        ImageCron.content_hash.isnot(None),
+    )
+    if content_hash is not None:
+        query = query.filter(ImageCron.content_hash == content_hash)
+    if image_name is not None:
+        query = query.filter(ImageCron.image_name == image_name)
+    return query.order_by(ImageCron.id).first()
+
+
+def share_image(image: ImageCron, source: ImageCron, session: Session) -> None:
+    """Point an image at the files (original and variants) of an identical one"""
+    image.image_name = source.image_name
+    image.content_hash = source.content_hash
+    image.processing_status = ImageProcessingEnum.ready.value
+    session.query(ImageVariant).filter(ImageVariant.image_id == image.id).delete()
+    session.add_all(
+        ImageVariant(
+            image_id=image.id,
+            variant=variant.variant,
+            format=variant.format,
+            image_name=variant.image_name,
+            width=variant.width,
+            height=variant.height,
+        )
+        for variant in session.query(ImageVariant).filter(
+            ImageVariant.image_id == source.id
+        )
+    )
+
+
+def process_image(image_id: int, session: Session) -> list[ImageVariant]:
+    """
+    Make the resized variants of an uploaded image: read the original from the
+    bucket, write its variants next to it and record them (replacing the ones of
+    a previous run). The image is marked ready, or failed if anything goes wrong.
+
+    Uploads are deduplicated by content: when the SHA-256 of the original matches
+    an image already shared by a post, the image is pointed at its files and the
+    uploaded copy is deleted, nothing is rendered.
+
+    No transaction is left open while the bucket is called or the image rendered:
+    the rows are read and written in short transactions around them.
+
+    Args:
+        image_id: Id of the ImageCron row
+        session: Database session
+
+    Returns:
+        list[ImageVariant]: Recorded variants
+    """
+    image = session.get(ImageCron, image_id)
+    if not image:
+        return []
+    image_name = image.image_name
+    session.commit()
+    try:
+        data = _storage_read(image_name)
+        content_hash = hashlib.sha256(data).hexdigest()
+        source = find_shared_image(session=session, content_hash=content_hash)
+        if source is not None and source.image_name != image_name:
+            share_image(image=image, source=source, session=session)
+            session.commit()
+            referenced = session.query(
+                session.query(ImageCron)
+                .filter(ImageCron.image_name == image_name)
+                .exists()
+            ).scalar()
+            session.commit()
+            if not referenced:
+                _storage_delete_many(filenames=[image_name], max_workers=1)
+            return (
+                session.query(ImageVariant)
+                .filter(ImageVariant.image_id == image_id)
+                .all()
+            )
+        session.commit()
+
+        rendered = render_variants(data)
+        stem = os.path.splitext(image_name)[0]
+        variants = []
+        for variant in rendered:
+            variant_name = f"{stem}_{variant['variant']}.{variant['extension']}"
+            _storage_write(variant_name, variant["data"])
+            variants.append(
+                ImageVariant(
+                    image_id=image_id,
+                    variant=variant["variant"],
+                    format=variant["format"],
+                    image_name=variant_name,
+                    width=variant["width"],
+                    height=variant["height"],
+                )
+            )
+    except Exception:
+        session.rollback()
+        image.processing_status = ImageProcessingEnum.failed.value
+        session.commit()
+        raise
+    session.query(ImageVariant).filter(ImageVariant.image_id == image_id).delete()
+    session.add_all(variants)
+    image.content_hash = content_hash
+    image.processing_status = ImageProcessingEnum.ready.value
+    session.commit()
+    return variants
+
+
+class ImageProcessor:
+    """
+    Background pool processing images off the request path. Pillow releases the
+    GIL while decoding, resizing and encoding, so a few threads are enough and keep
+    the app context at hand. When `IMAGE_PROCESS_QUEUE_SIZE` images are waiting,
+    new ones are left pending for `flask process-images`.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.max_pending = workers + queue_size
+        self._pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _run(self, app: Flask, image_id: int) -> None:
+        try:
+            with app.app_context():
+                with db_session() as session:
+                    process_image(image_id=image_id, session=session)
+        except Exception as error:
+            app.logger.warning(f"Process image {image_id} failed: {error}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def submit(self, app: Flask, image_id: int) -> bool:
+        """Queue an image, False if the queue is full"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image-processor"
+                )
+        self._executor.submit(self._run, app, image_id)
+        return True
+
+
+image_processor = ImageProcessor(
+    workers=settings.IMAGE_PROCESS_WORKERS,
+    queue_size=settings.IMAGE_PROCESS_QUEUE_SIZE,
+)
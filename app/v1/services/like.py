@@ -0,0 +1,102 @@
+from datetime import datetime
+
+from sqlalchemy import delete, tuple_, update, select, func
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import Conflict
+
+from app.core.redis_client import redis_client
+from app.v1.models import Like, Post
+from app.v1.services.post import update_post_counts
+
+
+def set_like(post_id: int, user_id: int, liked: bool, session: Session) -> None:
+    """
+    Like (or unlike) a post. The change is buffered in Redis and written to the
+    database later by `scheduler_flush_likes`, falling back to a direct write
+    when Redis is unavailable.
+
+    Args:
+        post_id: Post to like
+        user_id: User who likes the post
+        liked: True to like, False to unlike
+        session: Database session
+    """
+    current_state = redis_client.get_like_state(post_id=post_id, user_id=user_id)
+    if current_state is None:
+        current_state = (
+            session.query(Like.post_id)
+            .filter_by(user_id=user_id, post_id=post_id)
+            .first()
+            is not None
+        )
+    buffered = redis_client.buffer_like(
+        post_id=post_id, user_id=user_id, liked=liked, known_state=current_state
+    )
+    if buffered is None:
+        #   Redis unavailable, write through
+        if current_state == liked:
+            buffered = False
+        else:
+            if liked:
+                session.add(Like(user_id=user_id, post_id=post_id))
+            else:
+                session.query(Like).filter_by(user_id=user_id, post_id=post_id).delete()
+            update_post_counts(
+                post_id=post_id, like_delta=1 if liked else -1, session=session
+            )
+            session.commit()
+    if buffered is False:
+        if liked:
+            raise Conflict("You have already liked this post.")
+        raise Conflict("You have not liked this post yet.")
+
+
+def flush_likes(likes: dict, session: Session) -> None:
+    """
+    Write a batch of buffered likes with multi-row statements, then recount the
+    likes of the posts. Writing the states is idempotent, and so is the recount:
+    a batch replayed after its commit (e.g. `complete_pending_likes` failed) does
+    not count its likes twice, as adding the claimed deltas would.
+
+    Args:
+        likes: Post ID -> ({user ID: liked}, like count change)
+        session: Database session
+    """
+    now = int(datetime.now().timestamp())
+    to_like, to_unlike = [], []
+    for post_id, (states, _) in likes.items():
+        for user_id, liked in states.items():
+            if liked:
+                to_like.append(
+                    {
+                        "user_id": user_id,
+                        "post_id": post_id,
+                        "created_at": now,
+                        "modified_at": now,
+                    }
+                )
+            else:
+                to_unlike.append((user_id, post_id))
+
+    if to_like:
+        statement = insert(Like).values(to_like)
+        session.execute(
+            statement.on_duplicate_key_update(
+                modified_at=statement.inserted.modified_at
+            )
+        )
+    if to_unlike:
+        session.execute(
+            delete(Like).where(tuple_(Like.user_id, Like.post_id).in_(to_unlike))
+        )
+    session.execute(
+        update(Post)
+        .where(Post.id.in_(list(likes)))
+        .values(
+            like_count=select(func.count())
+            .where(Like.post_id == Post.id)
+            .scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
+    )
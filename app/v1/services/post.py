@@ -35,3 +35,18 @@ def update_post(post: Post, data: PostEdit) -> None:
     ).items():
         setattr(post, field_to_update, value)
     return post
+
+
+def update_post_counts(
+    post_id: int, session: Session, like_delta: int = 0, comment_delta: int = 0
+) -> None:
+    """Atomically shift the denormalized like/comment counters of a post"""
+    values = {}
+    if like_delta:
+        values[Post.like_count] = Post.like_count + like_delta
+    if comment_delta:
+        values[Post.comment_count] = Post.comment_count + comment_delta
+    if values:
+        session.query(Post).filter(Post.id == post_id).update(
+            values, synchronize_session=False
+        )
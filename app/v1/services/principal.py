@@ -0,0 +1,90 @@
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import db_session
+from app.core.redis_client import redis_client
+from app.logs.request_cost import outside_query_budget
+from app.v1.models import User
+from app.v1.schemas.user import Principal
+
+#   User id -> Principal, in front of the `principal:{user_id}` Redis hashes
+_principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+_FIELDS = list(Principal.model_fields)
+
+
+def _principal_key(user_id: int) -> str:
+    return f"principal:{user_id}"
+
+
+@outside_query_budget()
+def _load_principal(user_id: int) -> Principal | None:
+    with db_session() as session:
+        row = (
+            session.query(*[getattr(User, field) for field in _FIELDS])
+            .filter(User.id == user_id)
+            .first()
+        )
+    return Principal(**row._mapping) if row else None
+
+
+def get_principal(user_id: int) -> Principal | None:
+    """
+    Resolve the authenticated user: from the process-local LRU, else from its
+    Redis hash, else from the database (then cached in both).
+
+    Args:
+        user_id: Id of the token identity
+
+    Returns:
+        Principal | None: None if the user does not exist
+    """
+    principal = _principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    key = _principal_key(user_id)
+    try:
+        fields = redis_client.redis_client.hgetall(key)
+    except RedisError as error:
+        current_app.logger.warning(f"Get principal {user_id} failed: {error}")
+        fields = None
+    if fields:
+        principal = Principal(
+            **{field: value or None for field, value in fields.items()}
+        )
+    else:
+        principal = _load_principal(user_id)
+        if principal is None:
+            return None
+        if fields is not None:
+            try:
+                pipe = redis_client.redis_client.pipeline()
+                pipe.hset(
+                    key,
+                    mapping={
+                        field: "" if value is None else value
+                        for field, value in principal.model_dump().items()
+                    },
+                )
+                pipe.expire(key, settings.PRINCIPAL_REDIS_TTL)
+                pipe.execute()
+            except RedisError as error:
+                current_app.logger.warning(f"Set principal {user_id} failed: {error}")
+    _principal_cache.set(user_id, principal)
+    return principal
+
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Drop the cached principal after the user row changed. Copies held by other
+    processes expire within `PRINCIPAL_CACHE_TTL` seconds.
+    """
+    _principal_cache.delete(user_id)
+    try:
+        redis_client.redis_client.delete(_principal_key(user_id))
+    except RedisError as error:
+        current_app.logger.warning(f"Invalidate principal {user_id} failed: {error}")
@@ -0,0 +1,154 @@
+import hmac
+import time
+import hashlib
+from collections import Counter
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+#   Request header enabling the profiler for a single request
+PROFILE_HEADER = "X-Profile"
+#   "{method} {endpoint}" -> expiry timestamp of its profiling window
+WINDOWS_KEY = "profiler:windows"
+#   Profiling windows, re-read from Redis every `PROFILER_REFRESH_INTERVAL`
+_windows_cache = TTLCache(maxsize=1, ttl=settings.PROFILER_REFRESH_INTERVAL)
+
+#   Set a window, drop the expired ones, the hash expires with its last window
+_ENABLE_WINDOW_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+local expires_at = tonumber(ARGV[2])
+local windows = redis.call('HGETALL', KEYS[1])
+for i = 1, #windows, 2 do
+    local window_expires_at = tonumber(windows[i + 1])
+    if window_expires_at <= tonumber(ARGV[3]) then
+        redis.call('HDEL', KEYS[1], windows[i])
+    elseif window_expires_at > expires_at then
+        expires_at = window_expires_at
+    end
+end
+redis.call('EXPIREAT', KEYS[1], expires_at)
+return 1
+"""
+_enable_window_script = redis_client.redis_client.register_script(_ENABLE_WINDOW_SCRIPT)
+
+
+def _profile_key(method: str, endpoint: str) -> str:
+    return f"profile:{method} {endpoint}"
+
+
+def _token_signature(expires_at: int) -> str:
+    message = f"profile\n{expires_at}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def sign_profile_token(expires_in: int) -> str:
+    """Token of the `X-Profile` header, profiling any request until it expires"""
+    expires_at = int(time.time()) + expires_in
+    return f"{expires_at}.{_token_signature(expires_at)}"
+
+
+def verify_profile_token(token: str) -> bool:
+    expires_at, _, signature = token.partition(".")
+    if not (expires_at.isascii() and expires_at.isdigit()):
+        return False
+    if int(expires_at) < time.time():
+        return False
+    return hmac.compare_digest(_token_signature(int(expires_at)), signature)
+
+
+def get_profiling_windows() -> dict[str, int]:
+    """
+    Endpoints being profiled, shared by every process through Redis.
+
+    Returns:
+        dict: "{method} {endpoint}" -> expiry timestamp
+    """
+    windows = _windows_cache.get(WINDOWS_KEY)
+    if windows is None:
+        try:
+            windows = {
+                name: int(expires_at)
+                for name, expires_at in redis_client.redis_client.hgetall(
+                    WINDOWS_KEY
+                ).items()
+            }
+        except RedisError as error:
+            current_app.logger.warning(f"Get profiling windows failed: {error}")
+            windows = {}
+        _windows_cache.set(WINDOWS_KEY, windows)
+    now = time.time()
+    return {
+        name: expires_at for name, expires_at in windows.items() if expires_at > now
+    }
+
+
+def enable_profiling_window(method: str, endpoint: str, duration: int) -> int:
+    """
+    Profile every request of an endpoint for `duration` seconds. Other processes
+    start within `PROFILER_REFRESH_INTERVAL` seconds.
+
+    Returns:
+        int: Expiry timestamp of the window
+    """
+    now = int(time.time())
+    expires_at = now + duration
+    _enable_window_script(
+        keys=[WINDOWS_KEY], args=[f"{method} {endpoint}", expires_at, now]
+    )
+    _windows_cache.clear()
+    return expires_at
+
+
+def should_profile(method: str, endpoint: str, token: str | None) -> bool:
+    """Whether a request has a valid profile token or is in a profiling window"""
+    if token:
+        return verify_profile_token(token)
+    return f"{method} {endpoint}" in get_profiling_windows()
+
+
+def save_profile(method: str, endpoint: str, stacks: Counter) -> None:
+    """
+    Merge the sampled stacks of a request into the profile of its endpoint. A
+    profile expires `PROFILER_RETENTION` seconds after its last request, and
+    keeps at most `PROFILER_MAX_STACKS` distinct stacks: new ones are dropped
+    once it is full.
+    """
+    if not stacks:
+        return
+    key = _profile_key(method, endpoint)
+    try:
+        if redis_client.redis_client.hlen(key) >= settings.PROFILER_MAX_STACKS:
+            stored = redis_client.redis_client.hmget(key, list(stacks))
+            stacks = {
+                stack: count
+                for (stack, count), value in zip(stacks.items(), stored)
+                if value is not None
+            }
+        pipe = redis_client.redis_client.pipeline(transaction=False)
+        for stack, count in stacks.items():
+            pipe.hincrby(key, stack, count)
+        pipe.expire(key, settings.PROFILER_RETENTION)
+        pipe.execute()
+    except RedisError as error:
+        current_app.logger.warning(
+            f"Save profile of {method} {endpoint} failed: {error}"
+        )
+
+
+def get_profile(method: str, endpoint: str) -> str:
+    """Profile of an endpoint as collapsed stacks, one `stack count` per line"""
+    stacks = redis_client.redis_client.hgetall(_profile_key(method, endpoint))
+    return "\n".join(
+        f"{stack} {count}"
+        for stack, count in sorted(
+            stacks.items(), key=lambda item: int(item[1]), reverse=True
+        )
+    )
+
+
+def delete_profile(method: str, endpoint: str) -> None:
+    redis_client.redis_client.delete(_profile_key(method, endpoint))
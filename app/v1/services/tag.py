@@ -1,10 +1,29 @@
 #   References: https://iamyogesh.medium.com/what-is-the-best-approach-to-store-hashtags-in-a-database-caa796d714d4
 
 import re
+import math
+from datetime import datetime
 
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert
 from sqlalchemy.orm import Session
 
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.logs.request_cost import outside_query_budget
+from app.v1.enums import PostStatus
 from app.v1.models import Tag, PostTag, Post
+from app.v1.schemas.base import Pagination, CursorPagination
+from app.v1.services.trending import record_trending_tags
+from app.v1.utils import decode_cursor, encode_cursor, paginate_query
+
+#   Tag name -> tag id, tags are never renamed
+_tag_id_cache = TTLCache(
+    maxsize=settings.TAG_ID_CACHE_SIZE, ttl=settings.TAG_ID_CACHE_TTL
+)
 
 
 def extract_tags(caption: str) -> list[str]:
@@ -15,39 +34,310 @@ def extract_tags(caption: str) -> list[str]:
         caption (str): The text of the post caption.
 
     Returns:
-        List[str]: A list of extracted hashtags without the '#' symbol.
+        List[str]: A list of unique, lowercased hashtags without the '#' symbol.
     """
     if not caption:
         return []
 
     # Regular expression to match hashtags (e.g. #sunset, #hello_world)
-    return re.findall(r"#(\w+)", caption)
+    tags = re.findall(r"#(\w+)", caption)
+    #   Tag names are unique case-insensitively (MySQL collation), keep one spelling
+    return list(dict.fromkeys(tag.lower() for tag in tags))
+
+
+def resolve_tag_ids(tag_names: list[str], session: Session) -> dict[str, int]:
+    """
+    Get the ids of tags by name, creating the missing ones. Ids are read from a
+    process-local LRU first, the others are upserted with a single multi-row
+    INSERT ... ON DUPLICATE KEY UPDATE and read back with one locking SELECT
+    (a plain SELECT would not see tags committed since the transaction started).
+
+    Args:
+        tag_names: Lowercased tag names
+        session: Database session
+
+    Returns:
+        dict[str, int]: Tag name -> tag id
+    """
+    tag_ids = {}
+    for tag_name in tag_names:
+        tag_id = _tag_id_cache.get(tag_name)
+        if tag_id is not None:
+            tag_ids[tag_name] = tag_id
+    #   Sorted, so that concurrent posts lock the same tag rows in the same order
+    missing = sorted(tag_name for tag_name in tag_names if tag_name not in tag_ids)
+    if not missing:
+        return tag_ids
+
+    now = int(datetime.now().timestamp())
+    statement = insert(Tag).values(
+        [
+            {"tag_name": tag_name, "created_at": now, "modified_at": now}
+            for tag_name in missing
+        ]
+    )
+    session.execute(
+        statement.on_duplicate_key_update(tag_name=statement.inserted.tag_name)
+    )
+    rows = (
+        session.query(Tag.id, Tag.tag_name, Tag.created_at)
+        .filter(Tag.tag_name.in_(missing))
+        .order_by(Tag.tag_name)
+        .with_for_update(read=True)
+    )
+    for tag_id, tag_name, created_at in rows:
+        tag_ids[tag_name] = tag_id
+        #   Tags created now may still be rolled back, a later call caches them
+        if created_at != now:
+            _tag_id_cache.set(tag_name, tag_id)
+    return tag_ids
 
 
 def create_tags(post: Post, session: Session):
     """
     1. Extract tags from post's caption
-    2. Save tags to database
-    3. Attach tags to post
+    2. Resolve (create if needed) their ids
+    3. Attach tags to post with a single multi-row insert
     """
     extracted_tags = extract_tags(caption=post.caption)
-    #   Fetch all existing tags
-    existing_tags = session.query(Tag).where(Tag.tag_name.in_(extracted_tags)).all()
-    existing_tag_names = {existing_tag.tag_name for existing_tag in existing_tags}
-    #   Determine tags to create newly
-    new_tag_names = set(extracted_tags) - existing_tag_names
+    if not extracted_tags:
+        return
 
     try:
-        tags = [Tag(tag_name=tag_name) for tag_name in new_tag_names]
-        session.add_all(tags)
-        session.flush()
+        tag_ids = resolve_tag_ids(tag_names=extracted_tags, session=session)
     except Exception as error:
         raise ValueError(f"Tags created error: {error}")
 
     try:
-        tag_to_post = [*tags, *existing_tags]
-        post_tags = [PostTag(tag_id=tag.id, post_id=post.id) for tag in tag_to_post]
-        session.add_all(post_tags)
-        session.flush()
+        now = int(datetime.now().timestamp())
+        session.execute(
+            insert(PostTag).values(
+                [
+                    {
+                        "post_id": post.id,
+                        "tag_id": tag_id,
+                        "created_at": now,
+                        "modified_at": now,
+                    }
+                    for tag_id in tag_ids.values()
+                ]
+            )
+        )
     except Exception as error:
         raise ValueError(f"Attached tag to post {post.id} error: {error}")
+
+
+def _tag_posts_key(tag_name: str) -> str:
+    return f"tag_posts:{tag_name}"
+
+
+def _tag_search_key(tag_names: list[str], match_all: bool) -> str:
+    return f"tag_search:{'all' if match_all else 'any'}:{','.join(sorted(tag_names))}"
+
+
+def _post_tag_names(post: Post, session: Session) -> list[str]:
+    return [
+        tag_name
+        for (tag_name,) in session.query(Tag.tag_name)
+        .join(PostTag, PostTag.tag_id == Tag.id)
+        .filter(PostTag.post_id == post.id)
+    ]
+
+
+@outside_query_budget()
+def _build_tag_posts(tag_name: str, session: Session) -> None:
+    """
+    Rebuild the posting list of a tag from the database (cold start), keeping its
+    newest `TAG_POSTS_MAX_LENGTH` posts. Posts indexed meanwhile are kept.
+    """
+    key = _tag_posts_key(tag_name)
+    redis_client.start_sorted_set_build(key)
+    rows = (
+        session.query(Post.id, Post.created_at)
+        .join(PostTag, PostTag.post_id == Post.id)
+        .join(Tag, Tag.id == PostTag.tag_id)
+        .filter(
+            Tag.tag_name == tag_name,
+            Post.status == PostStatus.public.value,
+            Post.deleted == False,
+        )
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(settings.TAG_POSTS_MAX_LENGTH)
+        .all()
+    )
+    redis_client.store_sorted_set(
+        key,
+        members={str(post_id): created_at for post_id, created_at in rows},
+        max_length=settings.TAG_POSTS_MAX_LENGTH,
+        expires_in=settings.TAG_POSTS_TTL,
+    )
+
+
+def index_post_tags(post: Post, session: Session) -> None:
+    """Add a published post to the posting lists of its tags, and count its tags"""
+    tag_names = _post_tag_names(post, session)
+    try:
+        redis_client.add_to_sorted_sets(
+            [_tag_posts_key(tag_name) for tag_name in tag_names],
+            member=post.id,
+            score=post.created_at,
+            max_length=settings.TAG_POSTS_MAX_LENGTH,
+        )
+    except RedisError as error:
+        current_app.logger.warning(f"Index tags of post {post.id} failed: {error}")
+    record_trending_tags(tag_names=tag_names)
+
+
+def unindex_post_tags(post: Post, session: Session) -> None:
+    """Remove a post from the posting lists of its tags (e.g. once deleted)"""
+    try:
+        redis_client.remove_from_sorted_sets(
+            [_tag_posts_key(tag_name) for tag_name in _post_tag_names(post, session)],
+            member=post.id,
+        )
+    except RedisError as error:
+        current_app.logger.warning(f"Unindex tags of post {post.id} failed: {error}")
+
+
+def _search_key(tag_names: list[str], match_all: bool, session: Session) -> str:
+    """Build the missing posting lists and combine them when there are many tags"""
+    pipe = redis_client.redis_client.pipeline(transaction=False)
+    for tag_name in tag_names:
+        pipe.exists(_tag_posts_key(tag_name))
+    for tag_name, exists in zip(tag_names, pipe.execute()):
+        if not exists:
+            _build_tag_posts(tag_name=tag_name, session=session)
+    if len(tag_names) == 1:
+        return _tag_posts_key(tag_names[0])
+
+    key = _tag_search_key(tag_names, match_all)
+    if not redis_client.redis_client.exists(key):
+        keys = [_tag_posts_key(tag_name) for tag_name in tag_names]
+        pipe = redis_client.redis_client.pipeline()
+        if match_all:
+            pipe.zinterstore(key, keys, aggregate="MAX")
+        else:
+            pipe.zunionstore(key, keys, aggregate="MAX")
+        pipe.expire(key, settings.TAG_SEARCH_TTL)
+        pipe.execute()
+    return key
+
+
+def _read_posting_list(
+    key: str, page: int, per_page: int, cursor: str | None
+) -> tuple[list[int], Pagination | CursorPagination]:
+    if cursor is None:
+        pipe = redis_client.redis_client.pipeline(transaction=False)
+        pipe.zrevrangebyscore(
+            key, "+inf", "(0", start=(page - 1) * per_page, num=per_page
+        )
+        pipe.zcount(key, "(0", "+inf")
+        members, total = pipe.execute()
+        return [int(member) for member in members], Pagination(
+            total=total,
+            page=page,
+            per_page=per_page,
+            pages=math.ceil(total / per_page),
+        )
+
+    #   Members with the same score are ordered by Redis as strings, so entries are
+    #   re-sorted by (created_at, id) and ties around page boundaries read in full
+    position = decode_cursor(cursor)
+    pipe = redis_client.redis_client.pipeline(transaction=False)
+    if position:
+        pipe.zrevrangebyscore(key, position[0], position[0], withscores=True)
+    maximum = f"({position[0]}" if position else "+inf"
+    pipe.zrevrangebyscore(
+        key, maximum, "(0", start=0, num=per_page + 1, withscores=True
+    )
+    results = pipe.execute()
+    rows = [row for result in results for row in result]
+    if len(results[-1]) == per_page + 1:
+        last_score = results[-1][-1][1]
+        rows += redis_client.redis_client.zrevrangebyscore(
+            key, last_score, last_score, withscores=True
+        )
+    entries = sorted(
+        {(int(member), int(score)) for member, score in rows},
+        key=lambda entry: (-entry[1], -entry[0]),
+    )
+    if position:
+        entries = [
+            entry
+            for entry in entries
+            if entry[1] < position[0] or entry[0] < position[1]
+        ]
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        next_cursor = encode_cursor(created_at=entries[-1][1], id=entries[-1][0])
+    return [post_id for post_id, _ in entries], CursorPagination(
+        per_page=per_page, next_cursor=next_cursor
+    )
+
+
+def search_posts_by_tags(
+    tag_names: list[str],
+    page: int,
+    per_page: int,
+    session: Session,
+    match_all: bool = True,
+    cursor: str = None,
+) -> tuple[list[Post], Pagination | CursorPagination]:
+    """
+    Get a page of the public posts having all (or any) of the given tags, newest
+    first. Post ids are read from the per tag posting lists kept in Redis sorted
+    sets (combined with ZINTERSTORE / ZUNIONSTORE for many tags), the database
+    is only hit to load the posts of the page. Only the newest
+    `TAG_POSTS_MAX_LENGTH` posts of each tag are searched.
+
+    Args:
+        tag_names: Tags to search for
+        page: Page number, starts at 1 (page mode)
+        per_page: Number of posts per page
+        session: Database session
+        match_all: Posts must have all the tags, else any of them
+        cursor: Cursor of the page (cursor mode)
+
+    Returns:
+        tuple[list[Post], Pagination | CursorPagination]: Posts and pagination info
+    """
+    try:
+        key = _search_key(tag_names=tag_names, match_all=match_all, session=session)
+        post_ids, pagination = _read_posting_list(
+            key=key, page=page, per_page=per_page, cursor=cursor
+        )
+    except RedisError as error:
+        #   Degrade to searching straight from the database
+        current_app.logger.warning(f"Search tags {tag_names} failed: {error}")
+        query = (
+            session.query(Post)
+            .join(PostTag, PostTag.post_id == Post.id)
+            .join(Tag, Tag.id == PostTag.tag_id)
+            .filter(
+                Tag.tag_name.in_(tag_names),
+                Post.status == PostStatus.public.value,
+                Post.deleted == False,
+            )
+            .group_by(Post.id)
+        )
+        if match_all:
+            query = query.having(func.count(Tag.id) == len(tag_names))
+        with outside_query_budget():
+            return paginate_query(
+                query=query,
+                columns=(Post.created_at, Post.id),
+                page=page,
+                per_page=per_page,
+                cursor=cursor,
+            )
+
+    posts = {
+        post.id: post
+        for post in session.query(Post).filter(
+            Post.id.in_(post_ids),
+            Post.status == PostStatus.public.value,
+            Post.deleted == False,
+        )
+    }
+    return [posts[post_id] for post_id in post_ids if post_id in posts], pagination
@@ -0,0 +1,265 @@
+#   References: https://redis.io/docs/latest/develop/data-types/sorted-sets/
+
+import math
+import heapq
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.logs.request_cost import outside_query_budget
+from app.v1.enums import PostStatus
+from app.v1.models import Post, Follow
+from app.v1.schemas.base import Pagination, CursorPagination
+from app.v1.utils import decode_cursor, encode_cursor, paginate_query
+
+
+#   Accounts with too many followers to fan out to, their posts are pulled on read
+CELEBRITIES_KEY = "timeline:celebrities"
+
+
+def _timeline_key(user_id: int) -> str:
+    return f"timeline:{user_id}"
+
+
+def _user_posts_key(user_id: int) -> str:
+    return f"timeline:user_posts:{user_id}"
+
+
+def _public_posts(session: Session):
+    return session.query(Post.id, Post.created_at).filter(
+        Post.status == PostStatus.public.value, Post.deleted == False
+    )
+
+
+def _store(key: str, rows: list) -> None:
+    """Replace a sorted set with (post_id, created_at) rows, see `store_sorted_set`"""
+    redis_client.store_sorted_set(
+        key,
+        members={str(post_id): score for post_id, score in rows},
+        max_length=settings.TIMELINE_MAX_LENGTH,
+        expires_in=settings.TIMELINE_TTL,
+    )
+
+
+@outside_query_budget()
+def _build_user_posts(user_id: int, session: Session) -> None:
+    redis_client.start_sorted_set_build(_user_posts_key(user_id))
+    rows = (
+        _public_posts(session)
+        .filter(Post.user_id == user_id)
+        .order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(settings.TIMELINE_MAX_LENGTH)
+        .all()
+    )
+    _store(_user_posts_key(user_id), rows)
+
+
+@outside_query_budget()
+def _build_timeline(user_id: int, session: Session) -> None:
+    """Rebuild a home timeline from the database (cold start or after follow changes)"""
+    redis_client.start_sorted_set_build(_timeline_key(user_id))
+    celebrity_ids = {
+        int(uid) for uid in redis_client.redis_client.smembers(CELEBRITIES_KEY)
+    } - {user_id}
+    following_ids = (
+        session.query(Follow.following_id)
+        .filter(Follow.follower_id == user_id)
+        .subquery()
+    )
+    query = _public_posts(session).filter(
+        or_(Post.user_id == user_id, Post.user_id.in_(following_ids))
+    )
+    if celebrity_ids:
+        query = query.filter(Post.user_id.notin_(celebrity_ids))
+    rows = (
+        query.order_by(Post.created_at.desc(), Post.id.desc())
+        .limit(settings.TIMELINE_MAX_LENGTH)
+        .all()
+    )
+    _store(_timeline_key(user_id), rows)
+
+
+def _push(keys: list[str], post: Post) -> None:
+    redis_client.add_to_sorted_sets(
+        keys,
+        member=post.id,
+        score=post.created_at,
+        max_length=settings.TIMELINE_MAX_LENGTH,
+    )
+
+
+def fan_out_post(post: Post, session: Session) -> None:
+    """
+    Push a published post into the home timeline of its author and followers.
+    Authors with more than `TIMELINE_FANOUT_LIMIT` followers are not fanned out,
+    their followers pull the post from the author's own list at read time.
+    """
+    try:
+        if not redis_client.redis_client.exists(_user_posts_key(post.user_id)):
+            _build_user_posts(user_id=post.user_id, session=session)
+        _push([_user_posts_key(post.user_id), _timeline_key(post.user_id)], post)
+
+        follower_ids = [
+            follower_id
+            for (follower_id,) in session.query(Follow.follower_id)
+            .filter(Follow.following_id == post.user_id)
+            .limit(settings.TIMELINE_FANOUT_LIMIT + 1)
+        ]
+        if len(follower_ids) > settings.TIMELINE_FANOUT_LIMIT:
+            redis_client.redis_client.sadd(CELEBRITIES_KEY, post.user_id)
+            return
+        redis_client.redis_client.srem(CELEBRITIES_KEY, post.user_id)
+        _push([_timeline_key(follower_id) for follower_id in follower_ids], post)
+    except RedisError as error:
+        current_app.logger.warning(f"Fan out post {post.id} failed: {error}")
+
+
+def invalidate_timeline(user_id: int) -> None:
+    """Drop a home timeline so that it is rebuilt on next read (e.g. after follow changes)"""
+    try:
+        redis_client.redis_client.delete(_timeline_key(user_id))
+    except RedisError as error:
+        current_app.logger.warning(f"Invalidate timeline {user_id} failed: {error}")
+
+
+def _read_timeline(
+    user_id: int, page: int, per_page: int, cursor: str | None, session: Session
+) -> tuple[list[int], Pagination | CursorPagination]:
+    key = _timeline_key(user_id)
+    if not redis_client.redis_client.exists(key):
+        _build_timeline(user_id=user_id, session=session)
+    redis_client.redis_client.expire(key, settings.TIMELINE_TTL)
+
+    #   Followed accounts which are not fanned out
+    celebrity_ids = [
+        int(uid) for uid in redis_client.redis_client.smembers(CELEBRITIES_KEY)
+    ]
+    if celebrity_ids:
+        celebrity_ids = [
+            following_id
+            for (following_id,) in session.query(Follow.following_id).filter(
+                Follow.follower_id == user_id, Follow.following_id.in_(celebrity_ids)
+            )
+        ]
+    for celebrity_id in celebrity_ids:
+        if not redis_client.redis_client.exists(_user_posts_key(celebrity_id)):
+            _build_user_posts(user_id=celebrity_id, session=session)
+
+    #   Read the head of every source: from the top in page mode, or just below
+    #   the cursor position (ties on created_at are read separately) in cursor mode
+    keys = [key, *[_user_posts_key(celebrity_id) for celebrity_id in celebrity_ids]]
+    position = decode_cursor(cursor) if cursor is not None else None
+    limit = per_page + 1 if cursor is not None else page * per_page
+    pipe = redis_client.redis_client.pipeline(transaction=False)
+    for source in keys:
+        if position:
+            pipe.zrevrangebyscore(source, position[0], position[0], withscores=True)
+            pipe.zrevrangebyscore(
+                source, f"({position[0]}", "(0", start=0, num=limit, withscores=True
+            )
+        else:
+            pipe.zrevrangebyscore(
+                source, "+inf", "(0", start=0, num=limit, withscores=True
+            )
+        if cursor is None:
+            pipe.zcount(source, "(0", "+inf")
+    results = iter(pipe.execute())
+    sources, total = [], 0
+    for _ in keys:
+        entries = [(int(member), int(score)) for member, score in next(results)]
+        if position:
+            ties = [entry for entry in entries if entry[0] < position[1]]
+            entries = sorted(ties, reverse=True) + [
+                (int(member), int(score)) for member, score in next(results)
+            ]
+        if cursor is None:
+            total += next(results)
+        sources.append(entries)
+
+    #   Merge the sources, newest first
+    entries = []
+    for post_id, created_at in heapq.merge(
+        *sources, key=lambda entry: (-entry[1], -entry[0])
+    ):
+        if not entries or entries[-1][0] != post_id:
+            entries.append((post_id, created_at))
+        if len(entries) == limit:
+            break
+
+    if cursor is None:
+        post_ids = [post_id for post_id, _ in entries[(page - 1) * per_page :]]
+        return post_ids, Pagination(
+            total=total,
+            page=page,
+            per_page=per_page,
+            pages=math.ceil(total / per_page),
+        )
+    next_cursor = None
+    if len(entries) > per_page:
+        entries = entries[:per_page]
+        next_cursor = encode_cursor(created_at=entries[-1][1], id=entries[-1][0])
+    return [post_id for post_id, _ in entries], CursorPagination(
+        per_page=per_page, next_cursor=next_cursor
+    )
+
+
+def get_home_timeline(
+    user_id: int, page: int, per_page: int, session: Session, cursor: str = None
+) -> tuple[list[Post], Pagination | CursorPagination]:
+    """
+    Get a page of the home timeline: own posts and posts of followed users.
+
+    Args:
+        user_id: Owner of the timeline
+        page: Page number, starts at 1 (page mode)
+        per_page: Number of posts per page
+        session: Database session
+        cursor: Cursor of the page (cursor mode)
+
+    Returns:
+        tuple[list[Post], Pagination | CursorPagination]: Posts of the page (newest
+            first) and pagination info. In page mode, the total is an upper bound
+            when followed accounts are pulled on read.
+    """
+    try:
+        post_ids, pagination = _read_timeline(
+            user_id=user_id,
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+            session=session,
+        )
+    except RedisError as error:
+        #   Degrade to reading the timeline straight from the database
+        current_app.logger.warning(f"Read timeline {user_id} failed: {error}")
+        following_ids = (
+            session.query(Follow.following_id)
+            .filter(Follow.follower_id == user_id)
+            .subquery()
+        )
+        with outside_query_budget():
+            return paginate_query(
+                query=Post.query.filter(
+                    Post.status == PostStatus.public.value,
+                    Post.deleted == False,
+                    or_(Post.user_id == user_id, Post.user_id.in_(following_ids)),
+                ),
+                columns=(Post.created_at, Post.id),
+                page=page,
+                per_page=per_page,
+                cursor=cursor,
+            )
+
+    posts = {
+        post.id: post
+        for post in session.query(Post).filter(
+            Post.id.in_(post_ids),
+            Post.status == PostStatus.public.value,
+            Post.deleted == False,
+        )
+    }
+    return [posts[post_id] for post_id in post_ids if post_id in posts], pagination
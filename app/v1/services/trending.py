@@ -0,0 +1,91 @@
+#   References: https://redis.io/docs/latest/commands/zunionstore/
+
+import time
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+
+#   Window -> (bucket size in seconds, number of buckets)
+WINDOWS = {
+    "hour": (5 * 60, 12),
+    "day": (3600, 24),
+    "week": (24 * 3600, 7),
+}
+#   Bucket sizes, every tag use is counted once per size
+_BUCKET_SIZES = sorted({size for size, _ in WINDOWS.values()})
+
+
+def _bucket_key(size: int, start: int) -> str:
+    return f"trending:{size}:{start}"
+
+
+def _top_key(window: str) -> str:
+    return f"trending:top:{window}"
+
+
+def _bucket_ttl(size: int) -> int:
+    """Keep a bucket as long as the longest window which reads it"""
+    count = max(count for bucket_size, count in WINDOWS.values() if bucket_size == size)
+    return size * (count + 1)
+
+
+def record_trending_tags(tag_names: list[str]) -> None:
+    """Count one use of every tag in the current bucket of every size"""
+    if not tag_names:
+        return
+    now = int(time.time())
+    try:
+        pipe = redis_client.redis_client.pipeline(transaction=False)
+        for size in _BUCKET_SIZES:
+            key = _bucket_key(size, now - now % size)
+            for tag_name in tag_names:
+                pipe.zincrby(key, 1, tag_name)
+            pipe.expire(key, _bucket_ttl(size))
+        pipe.execute()
+    except RedisError as error:
+        current_app.logger.warning(f"Record trending tags failed: {error}")
+
+
+def _build_top(window: str) -> None:
+    """
+    Sum the buckets of a window into its top list, kept `TRENDING_CACHE_TTL`
+    seconds. Closed buckets do not change anymore, they are trimmed to their
+    `TRENDING_BUCKET_SIZE` best tags to bound memory.
+    """
+    size, count = WINDOWS[window]
+    now = int(time.time())
+    current = now - now % size
+    keys = [_bucket_key(size, current - i * size) for i in range(count)]
+    pipe = redis_client.redis_client.pipeline()
+    for key in keys[1:]:
+        pipe.zremrangebyrank(key, 0, -(settings.TRENDING_BUCKET_SIZE + 1))
+    pipe.zunionstore(_top_key(window), keys)
+    pipe.zremrangebyrank(_top_key(window), 0, -(settings.TRENDING_TOP_SIZE + 1))
+    pipe.expire(_top_key(window), settings.TRENDING_CACHE_TTL)
+    pipe.execute()
+
+
+def get_trending_tags(window: str, limit: int) -> list[dict]:
+    """
+    Get the most used tags of a window.
+
+    Args:
+        window: One of `WINDOWS` (hour, day, week)
+        limit: Number of tags, at most `TRENDING_TOP_SIZE`
+
+    Returns:
+        list[dict]: Tags with their number of uses, most used first
+    """
+    try:
+        if not redis_client.redis_client.exists(_top_key(window)):
+            _build_top(window)
+        tags = redis_client.redis_client.zrevrange(
+            _top_key(window), 0, limit - 1, withscores=True
+        )
+    except RedisError as error:
+        current_app.logger.warning(f"Get trending tags failed: {error}")
+        return []
+    return [{"tag_name": tag_name, "count": int(count)} for tag_name, count in tags]
@@ -0,0 +1,172 @@
+#   References: https://redis.io/docs/latest/commands/zrangebylex/
+
+import math
+
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import BadRequest
+
+from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.v1.models import User
+from app.v1.schemas.base import Pagination, CursorPagination
+from app.v1.utils import decode_cursor, encode_cursor, paginate_query
+
+
+#   user id -> username, to unindex the old username on change
+NAMES_KEY = "user_search:names"
+#   "{lowercased username}:{user id}" members, all scored 0, for ZRANGEBYLEX
+PREFIX_KEY = "user_search:prefix"
+#   Set by the backfill command, the index is not read before it is complete
+READY_KEY = "user_search:ready"
+_GRAM_SIZE = 3
+
+
+def _gram_key(gram: str) -> str:
+    return f"user_search:gram:{gram}"
+
+
+def _grams(name: str) -> set[str]:
+    return {name[i : i + _GRAM_SIZE] for i in range(len(name) - _GRAM_SIZE + 1)}
+
+
+def index_users(users: list[tuple[int, str]]) -> None:
+    """
+    Add (or move) users in the search index: the prefix set and the posting
+    set of every trigram of their lowercased username.
+
+    Args:
+        users: (user_id, username) pairs
+    """
+    previous = redis_client.redis_client.hmget(
+        NAMES_KEY, [user_id for user_id, _ in users]
+    )
+    pipe = redis_client.redis_client.pipeline()
+    for (user_id, username), old_username in zip(users, previous):
+        if old_username is not None:
+            old_name = old_username.lower()
+            pipe.zrem(PREFIX_KEY, f"{old_name}:{user_id}")
+            for gram in _grams(old_name):
+                pipe.srem(_gram_key(gram), user_id)
+        name = username.lower()
+        pipe.hset(NAMES_KEY, user_id, username)
+        pipe.zadd(PREFIX_KEY, {f"{name}:{user_id}": 0})
+        for gram in _grams(name):
+            pipe.sadd(_gram_key(gram), user_id)
+    pipe.execute()
+
+
+def index_user(user: User) -> None:
+    """Update the search index after a user is created or renamed"""
+    try:
+        index_users([(user.id, user.username)])
+    except RedisError as error:
+        current_app.logger.warning(f"Index user {user.id} failed: {error}")
+
+
+def _rank(user_ids: list[int], names: list[str], query: str) -> list[int]:
+    """Exact match first, then prefix matches, then other substring matches"""
+    ranked = []
+    for user_id, name in zip(user_ids, names):
+        if name is None:
+            continue
+        name = name.lower()
+        position = name.find(query)
+        if position < 0:
+            continue
+        boost = 0 if name == query else 1 if position == 0 else 2
+        ranked.append(((boost, position, len(name), name, user_id), user_id))
+    return [user_id for _, user_id in sorted(ranked)]
+
+
+def _search_index(query: str) -> list[int]:
+    limit = settings.USER_SEARCH_MAX_RESULTS
+    pipe = redis_client.redis_client.pipeline(transaction=False)
+    pipe.zrangebylex(
+        PREFIX_KEY, b"[" + query.encode(), b"[" + query.encode() + b"\xff", 0, limit
+    )
+    if len(query) >= _GRAM_SIZE:
+        pipe.sinter([_gram_key(gram) for gram in _grams(query)])
+    results = pipe.execute()
+
+    #   Prefix matches come with their name, trigram matches are only candidates
+    #   (all trigrams found, maybe not in a row) checked against their name
+    matches = {}
+    for member in results[0]:
+        name, user_id = member.rsplit(":", 1)
+        matches[int(user_id)] = name
+    candidates = []
+    if len(results) > 1:
+        candidates = sorted(
+            int(user_id) for user_id in results[1] if int(user_id) not in matches
+        )[:limit]
+    if candidates:
+        names = redis_client.redis_client.hmget(NAMES_KEY, candidates)
+        matches.update(zip(candidates, names))
+    return _rank(list(matches), list(matches.values()), query)[:limit]
+
+
+def search_users(
+    query: str, page: int, per_page: int, session: Session, cursor: str = None
+) -> tuple[list[User], Pagination | CursorPagination]:
+    """
+    Search users whose username contains `query`, best matches first.
+
+    Usernames are matched with the index kept in Redis: a lexicographic sorted set
+    for prefixes (autocomplete) and trigram posting sets for substrings, at most
+    `USER_SEARCH_MAX_RESULTS` results are ranked. In cursor mode, the cursor holds
+    the offset of the next page in the ranked results. Falls back to a LIKE scan
+    of the database while the index is not built or Redis is down.
+
+    Args:
+        query: Part of the username to search for
+        page: Page number, starts at 1 (page mode)
+        per_page: Number of users per page
+        session: Database session
+        cursor: Cursor of the page (cursor mode)
+
+    Returns:
+        tuple[list[User], Pagination | CursorPagination]: Users and pagination info
+    """
+    query = query.strip().lower()
+    user_ids = None
+    try:
+        if query and redis_client.redis_client.exists(READY_KEY):
+            user_ids = _search_index(query)
+    except RedisError as error:
+        current_app.logger.warning(f"Search users {query} failed: {error}")
+    if user_ids is None:
+        return paginate_query(
+            query=session.query(User).filter(User.username.like(f"%{query}%")),
+            columns=(User.created_at, User.id),
+            page=page,
+            per_page=per_page,
+            cursor=cursor,
+        )
+
+    if cursor is None:
+        start = (page - 1) * per_page
+        pagination = Pagination(
+            total=len(user_ids),
+            page=page,
+            per_page=per_page,
+            pages=math.ceil(len(user_ids) / per_page),
+        )
+    else:
+        position = decode_cursor(cursor)
+        start = position[0] if position else 0
+        #   The cursor holds an offset in the ranked results, not a creation time
+        if start < 0:
+            raise BadRequest("Invalid cursor.")
+        next_cursor = None
+        if start + per_page < len(user_ids):
+            next_cursor = encode_cursor(
+                created_at=start + per_page, id=user_ids[start + per_page - 1]
+            )
+        pagination = CursorPagination(per_page=per_page, next_cursor=next_cursor)
+    user_ids = user_ids[start : start + per_page]
+    users = {
+        user.id: user for user in session.query(User).filter(User.id.in_(user_ids))
+    }
+    return [users[user_id] for user_id in user_ids if user_id in users], pagination
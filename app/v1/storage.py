@@ -1,19 +1,27 @@
 #   References: https://github.com/faizan170/google-cloud-storage-flask
 
 import os
+import time
 import uuid
-import datetime
 import mimetypes
 
 from werkzeug.utils import secure_filename
-from werkzeug.exceptions import NotFound, InternalServerError
-from google.cloud import storage
+from werkzeug.exceptions import InternalServerError
+from redis.exceptions import RedisError
 
+from app.core.cache import TTLCache
 from app.core.config import settings
+from app.core.redis_client import redis_client
+from app.core.storage_backend import create_storage_backend
+from app.logs.request_cost import storage_timer
 
 
-client = storage.Client(project=settings.GOOGLE_CLOUD_PROJECT)
-bucket = client.bucket(settings.BUCKET_NAME)
+#   Google Cloud Storage or local directory, selected by `STORAGE_BACKEND`
+backend = create_storage_backend()
+#   Signed GET urls of the current time window, keyed by object name
+_signed_url_cache = TTLCache(
+    maxsize=settings.SIGNED_URL_CACHE_SIZE, ttl=settings.SIGNED_URL_WINDOW
+)
 
 
 def _get_content_type(filename: str) -> str:
@@ -34,13 +42,12 @@ def _generate_put_singed_url(filename: str, expiration: int = 60) -> dict:
         content_type = _get_content_type(filename)
 
         #   Get presign url
-        blob = bucket.blob(filename_path)
-        singed_url = blob.generate_signed_url(
-            version="v4",
-            method="PUT",
-            expiration=datetime.timedelta(seconds=expiration),
-            content_type=content_type,
-        )
+        with storage_timer("sign_put_url"):
+            singed_url = backend.sign_put_url(
+                path=filename_path,
+                content_type=content_type,
+                expires_at=int(time.time()) + expiration,
+            )
 
         return {
             "singed_url": singed_url,
@@ -52,30 +59,115 @@ def _generate_put_singed_url(filename: str, expiration: int = 60) -> dict:
         raise InternalServerError(f"Error while getting presigned url: {error}.")
 
 
-def _generate_get_singed_url(filename: str, expiration: int = 60) -> dict:
-    """Uploads a file to the bucket."""
+def _sign_get_url(filename: str, expires_at: int) -> str:
+    filename_path = os.path.join(settings.BUCKET_FOLDER, filename)
+    with storage_timer("sign_get_url"):
+        return backend.sign_get_url(path=filename_path, expires_at=expires_at)
+
+
+def _get_cached_signed_urls(cache_keys: list[str]) -> list[str | None]:
     try:
-        filename_path = os.path.join(settings.BUCKET_FOLDER, filename)
-        blob = bucket.blob(filename_path)
-        singed_url = blob.generate_signed_url(
-            version="v4",
-            method="GET",
-            expiration=datetime.timedelta(seconds=expiration),
-            response_disposition="inline",  # Prevent download image
-        )
-        return {"singed_url": singed_url, "expires_in": expiration}
+        return redis_client.redis_client.mget(cache_keys)
+    except RedisError:
+        return [None] * len(cache_keys)
+
+
+def _set_cached_signed_urls(singed_urls: dict, expires_in: int) -> None:
+    try:
+        pipe = redis_client.redis_client.pipeline(transaction=False)
+        for cache_key, singed_url in singed_urls.items():
+            pipe.setex(cache_key, expires_in, singed_url)
+        pipe.execute()
+    except RedisError:
+        pass
+
+
+def _generate_get_singed_urls(filenames: list[str], expiration: int = 60) -> dict:
+    """
+    Get signed urls to read files of the bucket.
+
+    Expiries are aligned to fixed windows of `SIGNED_URL_WINDOW` seconds: every
+    request in the same window gets the same (byte-identical) url, valid for at
+    least `expiration` seconds, so browsers, nginx and CDNs can cache the image.
+    Urls are signed once per window, then served from an in-process LRU backed by
+    Redis (a single MGET for all the files missing from the LRU).
+
+    Returns:
+        dict: Filename -> {"singed_url", "expires_in"}
+    """
+    now = int(time.time())
+    window_start = now - now % settings.SIGNED_URL_WINDOW
+    window_left = window_start + settings.SIGNED_URL_WINDOW - now
+    expires_at = now + window_left + expiration
+    cache_keys = {
+        filename: f"signed_url:{filename}:{window_start}:{expiration}"
+        for filename in set(filenames)
+    }
+    try:
+        singed_urls = {
+            filename: _signed_url_cache.get(cache_key)
+            for filename, cache_key in cache_keys.items()
+        }
+        missing = [filename for filename, url in singed_urls.items() if url is None]
+        if missing:
+            cached = _get_cached_signed_urls([cache_keys[name] for name in missing])
+            to_cache = {}
+            for filename, singed_url in zip(missing, cached):
+                if singed_url is None:
+                    singed_url = _sign_get_url(filename=filename, expires_at=expires_at)
+                    to_cache[cache_keys[filename]] = singed_url
+                singed_urls[filename] = singed_url
+                _signed_url_cache.set(cache_keys[filename], singed_url, ttl=window_left)
+            if to_cache:
+                _set_cached_signed_urls(to_cache, expires_in=window_left)
+        return {
+            filename: {"singed_url": singed_url, "expires_in": expires_at - now}
+            for filename, singed_url in singed_urls.items()
+        }
     except Exception as error:
         raise InternalServerError(f"Error while getting presigned url: {error}.")
 
 
-def _storage_delete(filename: str) -> None:
-    """Deletes a blob from the bucket."""
-    try:
-        blob = bucket.blob(filename)
-        if not blob.exists():
-            raise NotFound(f"File {filename} not found!")
+def _generate_get_singed_url(filename: str, expiration: int = 60) -> dict:
+    """Get a signed url to read a file of the bucket, see `_generate_get_singed_urls`."""
+    return _generate_get_singed_urls(filenames=[filename], expiration=expiration)[
+        filename
+    ]
 
-        blob.delete()
-        return True
-    except Exception as error:
-        raise InternalServerError(f"Error while deleting file: {error}.")
+
+def _storage_read(filename: str) -> bytes:
+    """Read a file of the bucket, by its name relative to `BUCKET_FOLDER`"""
+    with storage_timer("read"):
+        return backend.read(os.path.join(settings.BUCKET_FOLDER, filename))
+
+
+def _storage_write(filename: str, data: bytes) -> None:
+    """Write a file of the bucket, by its name relative to `BUCKET_FOLDER`"""
+    with storage_timer("write"):
+        backend.write(
+            path=os.path.join(settings.BUCKET_FOLDER, filename),
+            data=data,
+            content_type=_get_content_type(filename),
+        )
+
+
+def _storage_delete_many(filenames: list[str], max_workers: int) -> list[str]:
+    """
+    Delete files of the bucket with concurrent requests, one DELETE per file
+    (no existence check first). A failed delete is logged and does not stop
+    the others.
+
+    Args:
+        filenames: Names of the files, relative to `BUCKET_FOLDER`
+        max_workers: Max number of concurrent requests
+
+    Returns:
+        list[str]: Filenames which are confirmed gone from the bucket
+    """
+    paths = {
+        os.path.join(settings.BUCKET_FOLDER, filename): filename
+        for filename in filenames
+    }
+    with storage_timer("delete_many"):
+        deleted = backend.delete_many(paths=list(paths), max_workers=max_workers)
+    return [paths[path] for path in deleted]
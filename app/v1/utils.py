@@ -1,19 +1,29 @@
-import os, time
+import time
+import base64
 from pathlib import Path
-import cProfile
-import pstats
-import io
-from functools import wraps
-from datetime import datetime
+from functools import wraps, cached_property
 
 from flask import jsonify, request, g
 from functools import wraps
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity, get_jwt
+from flask_jwt_extended import verify_jwt_in_request
 from flask_limiter.util import get_remote_address
-from werkzeug.exceptions import NotFound, Unauthorized, BadRequest
+from sqlalchemy import and_, or_
+from werkzeug.exceptions import NotFound, Unauthorized, BadRequest, Forbidden
 
+from app.core.config import settings
+from app.core.profiler import sampling_profiler
 from app.v1.models import User
+from app.v1.schemas.base import Pagination, CursorPagination
+from app.v1.services.principal import get_principal
+from app.v1.services.profiler import PROFILE_HEADER, should_profile, save_profile
 from app.logs.config import REQUEST_COUNT, REQUEST_LATENCY
+from app.logs.request_cost import (
+    register_sql_events,
+    request_endpoint,
+    observe_request_cost,
+    check_query_budget,
+    report_repeated_statements,
+)
 
 
 ALLOWED_EXTENSIONS = {"txt", "pdf", "png", "jpg", "jpeg", "gif"}
@@ -28,28 +38,128 @@ def api_response(data=None, message=None, status=200):
     return jsonify(response), status
 
 
+class AuthContext:
+    """
+    Authentication state of the current request, built once and shared by the
+    rate limiter key functions and the auth decorators: the token is decoded,
+    its signature verified and its revocation checked a single time.
+    """
+
+    def __init__(self):
+        #   Decoded claims of a valid (and not revoked) token, None without token
+        self.claims = None
+        #   Why the token was rejected (invalid, expired, revoked, ...), if it was
+        self.error = None
+        try:
+            #   Refresh tokens are decoded too, `token_required` only accepts access
+            verify_jwt_in_request(optional=True, verify_type=False)
+            #   Decoded claims are kept by flask_jwt_extended in `g`
+            self.claims = g.get("_jwt_extended_jwt") or None
+        except Exception as error:
+            self.error = error
+
+    @property
+    def user_id(self) -> int | None:
+        return int(self.claims["sub"]) if self.claims else None
+
+    @cached_property
+    def body(self) -> dict:
+        """JSON body of the request, {} when missing or invalid"""
+        body = request.get_json(silent=True)
+        return body if isinstance(body, dict) else {}
+
+    def require_access_token(self) -> int:
+        """
+        Returns:
+            int: Id of the authenticated user
+
+        Raises:
+            Unauthorized: No token, or an invalid, revoked or refresh token
+        """
+        if self.error is not None:
+            raise Unauthorized(f"Token is invalid: {str(self.error)}")
+        if self.claims is None:
+            raise Unauthorized("Token is invalid: Missing Authorization Header")
+        if self.claims.get("type") != "access":
+            raise Unauthorized("Token is invalid: Only non-refresh tokens are allowed")
+        return self.user_id
+
+
+def get_auth_context() -> AuthContext:
+    """Get the auth context of the current request, built on first use"""
+    if "auth" not in g:
+        g.auth = AuthContext()
+    return g.auth
+
+
 def token_required(func):
     """Create decorator for API authentication using JWT"""
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        try:
-            verify_jwt_in_request()
-            user_id = get_jwt_identity()
-        except Exception as error:
-            return Unauthorized(f"Token is invalid: {str(error)}")
-        current_user = User.query.filter_by(id=int(user_id)).first()
+        user_id = get_auth_context().require_access_token()
+        current_user = User.query.filter_by(id=user_id).first()
         if not current_user:
-            return NotFound(f"User {current_user.username} not found!")
+            raise NotFound(f"User {user_id} not found!")
+
+        return func(current_user=current_user, *args, **kwargs)
+
+    return wrapper
+
+
+def principal_required(func):
+    """
+    Like `token_required`, but passes a cached `Principal` (id, username, ...)
+    instead of the `User` row, so the handler does not hit the database.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        user_id = get_auth_context().require_access_token()
+        principal = get_principal(user_id=user_id)
+        if not principal:
+            raise NotFound(f"User {user_id} not found!")
+
+        return func(current_user=principal, *args, **kwargs)
+
+    return wrapper
+
+
+def admin_required(func):
+    """Like `principal_required`, for the users listed in `ADMIN_USER_IDS`"""
+
+    @wraps(func)
+    @principal_required
+    def wrapper(*args, current_user, **kwargs):
+        if current_user.id not in settings.ADMIN_USER_IDS:
+            raise Forbidden("Admin access required.")
 
         return func(current_user=current_user, *args, **kwargs)
 
     return wrapper
 
 
+def query_budget(max_statements: int):
+    """
+    Declare the max number of SQL statements of an endpoint, authentication
+    included, so that N+1 regressions fail the tests: exceeding it raises in
+    `raise` mode (development and tests), see `QUERY_BUDGET_MODE`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            response = func(*args, **kwargs)
+            check_query_budget(max_statements)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 def user_or_ip_key():
-    json_data = request.get_json(silent=True) or {}
-    username = json_data.get("username")
+    username = get_auth_context().body.get("username")
     if username:
         return f"username:{username}"
     return f"ip:{get_remote_address()}"
@@ -60,16 +170,132 @@ def user_id_from_token_key():
     Returns a unique key for the current user based on JWT token identity.
     Falls back to IP address if no valid token is present.
     """
-    try:
-        verify_jwt_in_request(optional=True)
-        user_id = get_jwt_identity()
-        if user_id:
-            return f"user_id:{user_id}"
-    except Exception:
-        pass
+    user_id = get_auth_context().user_id
+    if user_id:
+        return f"user_id:{user_id}"
     return f"ip:{get_remote_address()}"
 
 
+def get_pagination_args() -> tuple[int, int, str | None]:
+    """
+    Read pagination parameters from the query string.
+
+    Returns:
+        tuple[int, int, str | None]: page, per_page (capped at `MAX_PER_PAGE`) and
+            cursor. The cursor is None in page mode, an empty string asks for the
+            first page in cursor mode.
+    """
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 10, type=int)
+    cursor = request.args.get("cursor", None, type=str)
+    if page < 1 or per_page < 1:
+        raise BadRequest("page and per_page must be positive integers.")
+    return page, min(per_page, settings.MAX_PER_PAGE), cursor
+
+
+def get_bool_arg(name: str, default: bool = False) -> bool:
+    """Read a boolean flag (true/false, 1/0, yes/no) from the query string"""
+    value = request.args.get(name, None, type=str)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+def get_id_list_arg(name: str, max_length: int) -> list[int]:
+    """
+    Read a list of ids from the query string, as repeated (`?ids=1&ids=2`) or
+    comma separated (`?ids=1,2`) values. Duplicates are dropped, order is kept.
+
+    Args:
+        name: Name of the query parameter
+        max_length: Max number of distinct ids
+
+    Returns:
+        list[int]: Ids
+    """
+    ids, seen = [], set()
+    for value in request.args.getlist(name):
+        for item in value.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            #   isdigit() alone accepts digits that int() rejects, like "²"
+            if not (item.isascii() and item.isdigit()):
+                raise BadRequest(f"{name} must be a list of integers.")
+            id = int(item)
+            if id in seen:
+                continue
+            seen.add(id)
+            ids.append(id)
+            #   Stop parsing as soon as there are too many ids
+            if len(ids) > max_length:
+                raise BadRequest(f"At most {max_length} {name} are allowed.")
+    return ids
+
+
+def encode_cursor(created_at: int, id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}:{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, int] | None:
+    """Decode an opaque cursor into (created_at, id), None for the first page"""
+    if not cursor:
+        return None
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(created_at), int(id)
+    except ValueError:
+        raise BadRequest("Invalid cursor.")
+
+
+def paginate_query(
+    query, columns: tuple, page: int, per_page: int, cursor: str | None = None
+) -> tuple[list, Pagination | CursorPagination]:
+    """
+    Paginate a query ordered by (created_at, id) descending.
+
+    Without cursor, this is the usual OFFSET pagination with a total count.
+    With cursor, the page is read by keyset from the cursor position and only
+    `next_cursor` is returned, no COUNT(*) is issued.
+
+    Args:
+        query: Query to paginate, without ORDER BY
+        columns: (created_at, id) columns to order and seek on
+        page: Page number (page mode)
+        per_page: Number of items per page
+        cursor: Cursor of the page (cursor mode)
+
+    Returns:
+        tuple[list, Pagination | CursorPagination]: Items and pagination info
+    """
+    created_column, id_column = columns
+    query = query.order_by(created_column.desc(), id_column.desc())
+    if cursor is None:
+        results = query.paginate(page=page, per_page=per_page, max_per_page=per_page)
+        return results.items, Pagination(
+            total=results.total,
+            page=results.page,
+            per_page=results.per_page,
+            pages=results.pages,
+        )
+
+    position = decode_cursor(cursor)
+    if position:
+        created_at, last_id = position
+        query = query.filter(
+            or_(
+                created_column < created_at,
+                and_(created_column == created_at, id_column < last_id),
+            )
+        )
+    items = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+    return items, CursorPagination(per_page=per_page, next_cursor=next_cursor)
+
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -92,43 +318,38 @@ def find_file(filename: str, start_dir: Path = Path.cwd()) -> Path | None:
 
 
 def register_dependencies(app):
+    register_sql_events()
 
     @app.before_request
     def start_timer():
         g.start_time = time.time()
 
+    @app.before_request
+    def load_auth_context():
+        get_auth_context()
+
+    @app.before_request
+    def start_profiler():
+        #   Signed `X-Profile` header, or endpoint in a profiling window
+        token = request.headers.get(PROFILE_HEADER)
+        if should_profile(request.method, request_endpoint(), token):
+            sampling_profiler.start()
+            g.profiling = True
+
+    @app.teardown_request
+    def stop_profiler(error=None):
+        if g.pop("profiling", False):
+            save_profile(request.method, request_endpoint(), sampling_profiler.stop())
+
     @app.after_request
     def record_metrics(response):
         start_time = getattr(g, "start_time", None)
         if start_time is not None:
             latency = time.time() - start_time
-            REQUEST_COUNT.labels(
-                request.method, request.path, response.status_code
-            ).inc()
-            REQUEST_LATENCY.labels(request.method, request.path).observe(latency)
+            #   Route template, not the raw path: one time series per route
+            endpoint = request_endpoint()
+            REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
+            REQUEST_LATENCY.labels(request.method, endpoint).observe(latency)
+            observe_request_cost(request.method, endpoint)
+            report_repeated_statements(request.method, endpoint)
         return response
-
-
-def cprofile(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        # Create cprofile directory if it doesn't exist
-        profile_dir = "cprofile/"
-        if not os.path.exists(profile_dir):
-            os.makedirs(profile_dir)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        profile_path = os.path.join(profile_dir, f"{func.__name__}_{timestamp}.prof")
-
-        pr = cProfile.Profile()
-        pr.enable()
-
-        result = func(*args, **kwargs)
-
-        pr.disable()
-
-        s = io.StringIO()
-        ps = pstats.Stats(pr, stream=s).sort_stats("cumulative")
-        ps.dump_stats(profile_path)
-        return result
-
-    return wrapper
@@ -0,0 +1,56 @@
+"""add image variants
+
+Revision ID: 3c8e1f9b2d47
+Revises: a5d81f0c6e27
+Create Date: 2026-10-18 04:12:27.530914
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3c8e1f9b2d47"
+down_revision = "a5d81f0c6e27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #   Existing images are pending, their variants are made by `flask process-images`
+    with op.batch_alter_table("image_cron", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "processing_status",
+                sa.String(length=20),
+                server_default="pending",
+                nullable=False,
+            )
+        )
+
+    op.create_table(
+        "image_variants",
+        sa.Column("image_id", sa.Integer(), nullable=False),
+        sa.Column("variant", sa.String(length=20), nullable=False),
+        sa.Column("format", sa.String(length=10), nullable=False),
+        sa.Column("image_name", sa.String(length=255), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=False),
+        sa.Column("height", sa.Integer(), nullable=False),
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.Integer(), nullable=False),
+        sa.Column("modified_at", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["image_id"],
+            ["image_cron.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "image_id", "variant", "format", name="uq_image_variants_image_variant"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("image_variants")
+    with op.batch_alter_table("image_cron", schema=None) as batch_op:
+        batch_op.drop_column("processing_status")
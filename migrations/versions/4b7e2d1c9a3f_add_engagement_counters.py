@@ -0,0 +1,61 @@
+"""add engagement counters
+
+Revision ID: 4b7e2d1c9a3f
+Revises: cc7dfe3a5efb
+Create Date: 2026-10-18 03:05:12.481220
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4b7e2d1c9a3f"
+down_revision = "cc7dfe3a5efb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("posts", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("like_count", sa.Integer(), server_default="0", nullable=False)
+        )
+        batch_op.add_column(
+            sa.Column("comment_count", sa.Integer(), server_default="0", nullable=False)
+        )
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "follower_count", sa.Integer(), server_default="0", nullable=False
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "following_count", sa.Integer(), server_default="0", nullable=False
+            )
+        )
+
+    #   Backfill counters of existing rows
+    op.execute(
+        "UPDATE posts SET "
+        "like_count = (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id), "
+        "comment_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)"
+    )
+    op.execute(
+        "UPDATE users SET "
+        "follower_count = (SELECT COUNT(*) FROM follows WHERE follows.following_id = users.id), "
+        "following_count = (SELECT COUNT(*) FROM follows WHERE follows.follower_id = users.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.drop_column("following_count")
+        batch_op.drop_column("follower_count")
+
+    with op.batch_alter_table("posts", schema=None) as batch_op:
+        batch_op.drop_column("comment_count")
+        batch_op.drop_column("like_count")
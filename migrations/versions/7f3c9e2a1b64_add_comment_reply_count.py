@@ -0,0 +1,44 @@
+"""add comment reply count
+
+Revision ID: 7f3c9e2a1b64
+Revises: 4b7e2d1c9a3f
+Create Date: 2026-10-18 03:24:40.117352
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7f3c9e2a1b64"
+down_revision = "4b7e2d1c9a3f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("comments", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("reply_count", sa.Integer(), server_default="0", nullable=False)
+        )
+        batch_op.create_index(
+            "ix_comments_post_parent_created",
+            ["post_id", "parent_comment_id", "created_at", "id"],
+            unique=False,
+        )
+
+    #   Backfill counters of existing rows (MySQL cannot read the updated table
+    #   in a subquery, so counts are joined from a derived table)
+    op.execute(
+        "UPDATE comments JOIN ("
+        "SELECT parent_comment_id, COUNT(*) AS reply_count FROM comments "
+        "WHERE parent_comment_id IS NOT NULL GROUP BY parent_comment_id"
+        ") AS replies ON replies.parent_comment_id = comments.id "
+        "SET comments.reply_count = replies.reply_count"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("comments", schema=None) as batch_op:
+        batch_op.drop_index("ix_comments_post_parent_created")
+        batch_op.drop_column("reply_count")
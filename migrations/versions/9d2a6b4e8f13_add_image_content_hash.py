@@ -0,0 +1,37 @@
+"""add image content hash
+
+Revision ID: 9d2a6b4e8f13
+Revises: 3c8e1f9b2d47
+Create Date: 2026-10-18 04:48:02.716349
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9d2a6b4e8f13"
+down_revision = "3c8e1f9b2d47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #   Existing images get their hash when (re)processed by `flask process-images`
+    with op.batch_alter_table("image_cron", schema=None) as batch_op:
+        batch_op.add_column(
+            sa.Column("content_hash", sa.String(length=64), nullable=True)
+        )
+        batch_op.create_index(
+            batch_op.f("ix_image_cron_content_hash"), ["content_hash"], unique=False
+        )
+        batch_op.create_index(
+            batch_op.f("ix_image_cron_image_name"), ["image_name"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("image_cron", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_image_cron_image_name"))
+        batch_op.drop_index(batch_op.f("ix_image_cron_content_hash"))
+        batch_op.drop_column("content_hash")
@@ -0,0 +1,52 @@
+"""add unique tag name
+
+Revision ID: a5d81f0c6e27
+Revises: 7f3c9e2a1b64
+Create Date: 2026-10-18 03:41:09.352814
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a5d81f0c6e27"
+down_revision = "7f3c9e2a1b64"
+branch_labels = None
+depends_on = None
+
+
+#   Tag kept for every (case-insensitive) name
+KEPT_TAGS = "(SELECT tag_name, MIN(id) AS kept_id FROM tags GROUP BY tag_name) AS kept"
+
+
+def upgrade():
+    #   Merge duplicated tags into the oldest one before adding the unique key
+    op.execute(
+        "UPDATE IGNORE post_tag "
+        "JOIN tags ON tags.id = post_tag.tag_id "
+        f"JOIN {KEPT_TAGS} ON kept.tag_name = tags.tag_name "
+        "SET post_tag.tag_id = kept.kept_id "
+        "WHERE post_tag.tag_id <> kept.kept_id"
+    )
+    #   Posts which had many spellings of a tag
+    op.execute(
+        "DELETE post_tag FROM post_tag "
+        "JOIN tags ON tags.id = post_tag.tag_id "
+        f"JOIN {KEPT_TAGS} ON kept.tag_name = tags.tag_name "
+        "WHERE post_tag.tag_id <> kept.kept_id"
+    )
+    op.execute(
+        "DELETE tags FROM tags "
+        f"JOIN {KEPT_TAGS} ON kept.tag_name = tags.tag_name "
+        "WHERE tags.id <> kept.kept_id"
+    )
+    op.execute("UPDATE tags SET tag_name = LOWER(tag_name)")
+
+    with op.batch_alter_table("tags", schema=None) as batch_op:
+        batch_op.create_unique_constraint("uq_tags_tag_name", ["tag_name"])
+
+
+def downgrade():
+    with op.batch_alter_table("tags", schema=None) as batch_op:
+        batch_op.drop_constraint("uq_tags_tag_name", type_="unique")
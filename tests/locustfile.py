@@ -20,23 +20,40 @@ class PostCreationSequence(TaskSet):
 
     @seq_task(1)
     def upload_image(self):
-        """Upload an image before creating a post."""
-        files = {
-            "file": ("test_image.jpg", open(self.test_image_path, "rb"), "image/jpeg")
-        }
+        """Upload an image with a signed url before creating a post."""
         headers = self.parent.parent.get_headers()
         headers.pop("Content-Type", None)
 
         with self.client.post(
-            "/api/v1/posts/upload",
+            "/api/v1/posts/sign-url",
+            headers=headers,
+            data={"filename": "test_image.jpg"},
+            catch_response=True,
+        ) as response:
+            if response.status_code != 201:
+                response.failure(f"Sign url failed: {response.json()}")
+                return
+            signed = response.json()["data"]
+
+        #   Straight to the storage (GCS, or the local backend of the app)
+        with open(self.test_image_path, "rb") as f:
+            self.client.put(
+                signed["singed_url"],
+                data=f.read(),
+                headers={"Content-Type": signed["content_type"]},
+                name="storage PUT",
+            )
+
+        with self.client.post(
+            "/api/v1/posts/save-image",
             headers=headers,
-            files=files,
+            data={"filename": signed["filename"]},
             catch_response=True,
         ) as response:
             if response.status_code == 201:
                 self.image_id = response.json()["data"]["image_id"]
                 return True
-            response.failure(f"Upload image failed: {response.json()}")
+            response.failure(f"Save image failed: {response.json()}")
 
     @seq_task(2)
     def create_post(self):
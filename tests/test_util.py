@@ -1,5 +1,32 @@
+import io
+import os
+import time
+import tempfile
 import unittest
-from app.v1.utils import allowed_file
+from unittest import mock
+from flask import Flask
+from sqlalchemy import create_engine, text
+from werkzeug.exceptions import BadRequest
+
+from app.core.config import settings
+from app.core.profiler import SamplingProfiler
+from app.core.password_hasher import PasswordHasher
+from app.core.storage_backend import LocalStorage
+from app.logs.request_cost import (
+    QueryBudgetExceeded,
+    normalize_statement,
+    register_sql_events,
+    get_request_cost,
+    outside_query_budget,
+)
+from app.v1.services.profiler import sign_profile_token, verify_profile_token
+from app.v1.utils import (
+    allowed_file,
+    encode_cursor,
+    decode_cursor,
+    get_id_list_arg,
+    query_budget,
+)
 
 
 class TestUnits(unittest.TestCase):
@@ -57,5 +84,238 @@ class TestUnits(unittest.TestCase):
         self.assertFalse(allowed_file("."), "Test failed for only dot")
 
 
+class TestCursor(unittest.TestCase):
+
+    #   Test case #1: Cursor decodes to the position it was built from
+    def test_round_trip(self):
+        cursor = encode_cursor(created_at=1748400000, id=42)
+        self.assertEqual(decode_cursor(cursor), (1748400000, 42))
+
+    #   Test case #2: Empty cursor means the first page
+    def test_empty_cursor(self):
+        self.assertIsNone(decode_cursor(""))
+
+    #   Test case #3: Tampered cursor is rejected
+    def test_invalid_cursor(self):
+        with self.assertRaises(BadRequest):
+            decode_cursor("not-a-cursor")
+        with self.assertRaises(BadRequest):
+            decode_cursor(encode_cursor(created_at="abc", id=1))
+
+
+class TestIdListArg(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    #   Test case #1: Comma separated and repeated values, duplicates dropped
+    def test_parse(self):
+        with self.app.test_request_context("/?ids=3,1&ids=2,3"):
+            self.assertEqual(get_id_list_arg("ids", max_length=5), [3, 1, 2])
+        with self.app.test_request_context("/"):
+            self.assertEqual(get_id_list_arg("ids", max_length=5), [])
+
+    #   Test case #2: Invalid or too many ids are rejected
+    def test_invalid(self):
+        with self.app.test_request_context("/?ids=1,a"):
+            with self.assertRaises(BadRequest):
+                get_id_list_arg("ids", max_length=5)
+        with self.app.test_request_context("/?ids=1,2,3"):
+            with self.assertRaises(BadRequest):
+                get_id_list_arg("ids", max_length=2)
+        with self.app.test_request_context("/?ids=1,²"):
+            with self.assertRaises(BadRequest):
+                get_id_list_arg("ids", max_length=5)
+        with self.app.test_request_context("/?ids=1,1,1,2,2"):
+            self.assertEqual(get_id_list_arg("ids", max_length=2), [1, 2])
+
+
+class TestQueryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.engine = create_engine("sqlite://")
+        register_sql_events()
+
+    def run_queries(self, count: int):
+        with self.engine.connect() as connection:
+            for id in range(count):
+                connection.execute(text("SELECT :id"), {"id": id})
+
+    #   Test case #1: N+1 loop statements and IN lists of any length share a shape
+    def test_normalize_statement(self):
+        self.assertEqual(
+            normalize_statement("SELECT * FROM posts WHERE id = %(id_1)s LIMIT 1"),
+            normalize_statement("SELECT *  FROM posts\nWHERE id = 42 LIMIT 1"),
+        )
+        self.assertEqual(
+            normalize_statement("SELECT * FROM users WHERE id IN (%s, %s, %s)"),
+            "SELECT * FROM users WHERE id IN (?)",
+        )
+        self.assertEqual(
+            normalize_statement("SELECT * FROM tags WHERE name = 'it''s'"),
+            "SELECT * FROM tags WHERE name = ?",
+        )
+
+    #   Test case #2: Repeated statements are recorded by shape
+    def test_repeated_statements(self):
+        with mock.patch.object(settings, "QUERY_BUDGET_MODE", "raise"):
+            with self.app.test_request_context("/"):
+                self.run_queries(4)
+                cost = get_request_cost()
+                self.assertEqual(cost.sql_statements, 4)
+                self.assertEqual(cost.repeated_statements(3), [("SELECT ?", 4)])
+
+    #   Test case #3: Exceeding the budget fails in raise mode only
+    def test_budget_exceeded(self):
+        view = query_budget(3)(lambda count: self.run_queries(count))
+        with mock.patch.object(settings, "QUERY_BUDGET_MODE", "raise"):
+            with self.app.test_request_context("/"):
+                view(3)
+            with self.app.test_request_context("/"):
+                with self.assertRaises(QueryBudgetExceeded):
+                    view(4)
+        with mock.patch.object(settings, "QUERY_BUDGET_MODE", "log"):
+            with self.app.test_request_context("/"):
+                view(4)
+
+    #   Test case #4: A cold read filling caches fits the budget of the warm read
+    def test_cold_cache(self):
+        def view(cold: bool):
+            if cold:
+                with outside_query_budget():
+                    self.run_queries(4)
+            self.run_queries(3)
+
+        view = query_budget(3)(view)
+        with mock.patch.object(settings, "QUERY_BUDGET_MODE", "raise"):
+            with self.app.test_request_context("/"):
+                view(cold=True)
+                self.assertEqual(get_request_cost().sql_statements, 7)
+            with self.app.test_request_context("/"):
+                view(cold=False)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def busy_loop(self, seconds: float):
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            pass
+
+    #   Test case #1: Stacks of the profiled thread are sampled, root first
+    def test_sampling(self):
+        profiler = SamplingProfiler(interval=0.001, max_depth=128)
+        profiler.start()
+        self.busy_loop(0.1)
+        stacks = profiler.stop()
+        self.assertGreater(sum(stacks.values()), 0)
+        self.assertTrue(
+            any(stack.endswith(":TestProfiler.busy_loop") for stack in stacks)
+        )
+        self.assertEqual(profiler.stop(), {})
+
+    #   Test case #2: Profile tokens are signed and expire
+    def test_profile_token(self):
+        token = sign_profile_token(expires_in=60)
+        self.assertTrue(verify_profile_token(token))
+        self.assertFalse(verify_profile_token(token[:-1] + "x"))
+        self.assertFalse(verify_profile_token(sign_profile_token(expires_in=-1)))
+        self.assertFalse(verify_profile_token("not-a-token"))
+        self.assertFalse(verify_profile_token("².x"))
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def hasher(self, method: str) -> PasswordHasher:
+        return PasswordHasher(method=method, workers=1, queue_size=0, timeout=1)
+
+    #   Test case #1: Methods with default parameters match the hashes they make
+    def test_needs_rehash_defaults(self):
+        scrypt_hash = "scrypt:32768:8:1$salt$hash"
+        pbkdf2_hash = "pbkdf2:sha256:1000000$salt$hash"
+        self.assertFalse(self.hasher("scrypt").needs_rehash(scrypt_hash))
+        self.assertFalse(self.hasher("scrypt:32768:8:1").needs_rehash(scrypt_hash))
+        self.assertFalse(self.hasher("pbkdf2").needs_rehash(pbkdf2_hash))
+        self.assertFalse(self.hasher("pbkdf2:sha256").needs_rehash(pbkdf2_hash))
+
+    #   Test case #2: Hashes of another method or parameters are upgraded
+    def test_needs_rehash_outdated(self):
+        self.assertTrue(
+            self.hasher("scrypt").needs_rehash("pbkdf2:sha256:1000000$salt$hash")
+        )
+        self.assertTrue(
+            self.hasher("pbkdf2:sha256").needs_rehash("pbkdf2:sha256:600000$salt$hash")
+        )
+        self.assertTrue(
+            self.hasher("scrypt:65536:8:1").needs_rehash("scrypt:32768:8:1$salt$hash")
+        )
+
+
+class TestLocalStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(
+            root=self.root.name, base_url="http://localhost/storage", secret_key="key"
+        )
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def signature(self, url: str) -> str:
+        return url.rpartition("signature=")[2]
+
+    #   Test case #1: Signed urls are bound to their method, path and content type
+    def test_verify(self):
+        expires_at = int(time.time()) + 60
+        url = self.storage.sign_put_url("f/a.png", "image/png", expires_at)
+        signature = self.signature(url)
+        self.assertTrue(
+            self.storage.verify("PUT", "f/a.png", expires_at, signature, "image/png")
+        )
+        self.assertFalse(
+            self.storage.verify("PUT", "f/a.png", expires_at, signature, "text/html")
+        )
+        self.assertFalse(
+            self.storage.verify("GET", "f/a.png", expires_at, signature, "image/png")
+        )
+        self.assertFalse(
+            self.storage.verify("PUT", "f/b.png", expires_at, signature, "image/png")
+        )
+        self.assertFalse(
+            self.storage.verify(
+                "PUT", "f/a.png", expires_at + 1, signature, "image/png"
+            )
+        )
+        self.assertFalse(self.storage.verify("GET", "f/a.png", expires_at, "x" * 64))
+
+    #   Test case #2: Expired urls are rejected
+    def test_verify_expired(self):
+        expires_at = int(time.time()) - 1
+        url = self.storage.sign_get_url("f/a.png", expires_at)
+        self.assertFalse(
+            self.storage.verify("GET", "f/a.png", expires_at, self.signature(url))
+        )
+
+    #   Test case #3: Paths outside of the root are rejected
+    def test_file_path(self):
+        self.assertEqual(
+            self.storage.file_path("f/a.png"),
+            os.path.join(os.path.abspath(self.root.name), "f", "a.png"),
+        )
+        self.assertIsNone(self.storage.file_path("../a.png"))
+        self.assertIsNone(self.storage.file_path("f/../../a.png"))
+        self.assertIsNone(self.storage.file_path("/etc/passwd"))
+
+    #   Test case #4: Oversized uploads leave no file behind
+    def test_write_stream_max_size(self):
+        self.storage.write_stream("f/a.png", io.BytesIO(b"1234"), max_size=4)
+        self.assertEqual(self.storage.read("f/a.png"), b"1234")
+        with self.assertRaises(ValueError):
+            self.storage.write_stream("f/b.png", io.BytesIO(b"12345"), max_size=4)
+        self.assertEqual(os.listdir(os.path.join(self.root.name, "f")), ["a.png"])
+
+
 if __name__ == "__main__":
     unittest.main()